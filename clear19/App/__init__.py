@@ -2,22 +2,37 @@ import subprocess
 from datetime import datetime
 from pathlib import Path
 
+from clear19.data import Config
+from clear19.data.data_bus import DataBus
+from clear19.data.disk_data import DiskData
 from clear19.data.download_manager import DownloadManager
 from clear19.data.media_player import MediaPlayer
 from clear19.data.system_data import SystemData
+from clear19.data.temp_values import TempValues
+from clear19.data.wetter_com import WeatherProvider, WetterCom
 from clear19.scheduler import Scheduler
 
 
 class Global:
+    data_bus: DataBus
+    disk_data: DiskData
     download_manager: DownloadManager
     media_player: MediaPlayer
     system_data: SystemData
+    weather_provider: WeatherProvider
 
     @staticmethod
     def init(scheduler: Scheduler):
+        Global.data_bus = DataBus()
         Global.download_manager = DownloadManager(Path.home().joinpath('.cache/clear/clear19'))
-        Global.media_player = MediaPlayer(scheduler)
-        Global.system_data = SystemData(scheduler)
+        Global.media_player = MediaPlayer(scheduler, Global.data_bus)
+        Global.system_data = SystemData(scheduler, Global.data_bus,
+                                        aggregate_cgroups=Config.SystemData.process_aggregation() == 'cgroup')
+        Global.disk_data = DiskData(scheduler, Global.data_bus, Config.DiskStats.drives())
+        if Config.Weather.provider() == 'temp_values':
+            Global.weather_provider = TempValues(Config.Weather.temp_values_url(), Global.download_manager)
+        else:
+            Global.weather_provider = WetterCom(Config.Weather.city_code(), Global.download_manager)
 
 
 def uptime() -> datetime:
@@ -3,6 +3,7 @@ import logging
 import math
 import signal
 from datetime import timedelta
+from pathlib import Path
 from queue import Queue
 from typing import Union, Type, Dict, Optional
 
@@ -22,6 +23,7 @@ from clear19.logitech.key_listener import KeyListener
 from clear19.scheduler import TaskParameters
 from clear19.widgets.color import Color
 from clear19.widgets.geometry import Size
+from clear19.widgets.image_widget import ImageWidget
 from clear19.widgets.widget import AppWidget, Screen
 
 log = logging.getLogger(__name__)
@@ -53,6 +55,7 @@ class App(AppWidget):
 
             super().__init__()
             Global.init(self.scheduler)
+            ImageWidget.image_cache.svg_cache_path = Path.home().joinpath('.cache/clear/clear19/svg')
             self.foreground = Color.GRAY90
             self._screens = {Screens.MAIN: MainScreen(self),
                              Screens.TIME: TimeScreen(self),
@@ -75,6 +78,7 @@ class App(AppWidget):
                 p = schedule_queue.get()
                 if isinstance(p, TaskParameters):
                     if p.command == 'UPDATE':
+                        Global.data_bus.deliver()
                         if self.dirty:
                             self.update_lcd()
                     else:
@@ -88,6 +92,8 @@ class App(AppWidget):
                         log.critical(f"Unknown key event: {p}")
                 else:
                     log.warning(f"Unknown queue content: {p}")
+            for widget, avoided_frames in self.avoided_frames_report():
+                log.debug(f"{widget.__class__.__name__} at {widget.rectangle} avoided {avoided_frames} frames.")
             if key_listener:
                 key_listener.stop()
             self.scheduler.stop_scheduler()
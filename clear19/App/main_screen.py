@@ -1,13 +1,15 @@
 import dataclasses
 import logging
 from datetime import timedelta
+from pathlib import Path
 from typing import Optional
 
 from clear19.App import Global
 from clear19.App.screens import Screens
 from clear19.data import Config
 from clear19.data.fritzbox import FritzBox
-from clear19.data.wetter_com import WetterCom, WeatherData
+from clear19.data.net_dev import NetDev
+from clear19.data.wetter_com import WeatherData
 from clear19.logitech.g19 import G19Key, DisplayKey
 from clear19.widgets.bar_widget import BarWidget
 from clear19.widgets.color import Color
@@ -53,7 +55,7 @@ class MainScreen(Screen):
         self.lh1.rectangle = Rectangle(self.time.position(Anchor.BOTTOM_LEFT).anchored(Anchor.TOP_LEFT),
                                        Size(self.width - self.lv2_3.left, self.lh1.preferred_size().height))
 
-        self.wetter_com = WetterCom(Config.Weather.city_code(), Global.download_manager)
+        self.weather_provider = Global.weather_provider
         self.weather_widgets = WeatherWidgets(self, None, Global.download_manager)
         self.weather_widgets.rectangle = Rectangle(self.position(Anchor.BOTTOM_LEFT),
                                                    self.weather_widgets.preferred_size)
@@ -125,7 +127,8 @@ class MainScreen(Screen):
                                              + Point(2, 5),
                                              self.lhs.position(Anchor.TOP_RIGHT))
 
-        self.fritz_box = FritzBox(self.app.scheduler, Config.FritzBox.address(), Config.FritzBox.password())
+        self.fritz_box = FritzBox(self.app.scheduler, Global.data_bus, Config.FritzBox.address(),
+                                  Config.FritzBox.password())
         self.fritz_box_connected = FritzBoxConnectedWidget(self, self.fritz_box, Font(size=12))
         self.fritz_box_connected.rectangle = Rectangle(
             self.lh1.position(Anchor.BOTTOM_LEFT).anchored(Anchor.TOP_LEFT) + Point(1, 1),
@@ -148,12 +151,20 @@ class MainScreen(Screen):
             self.fritz_box_ip6.position(Anchor.TOP_LEFT).anchored(Anchor.BOTTOM_LEFT) + Point(0, -1),
             Size(self.lh1.width, self.fritz_box_ip4.preferred_size.height))
 
-        self.fritz_box_traffic_graph = FritzBoxTrafficGraphWidget(self, self.fritz_box)
+        if Config.Network.traffic_source() == 'net_dev':
+            self.traffic_source = NetDev(self.app.scheduler, Global.data_bus, Config.Network.interfaces())
+            history_name = 'net_dev_traffic'
+        else:
+            self.traffic_source = self.fritz_box
+            history_name = 'fritz_box_traffic'
+        self.fritz_box_traffic_graph = FritzBoxTrafficGraphWidget(
+            self, self.traffic_source,
+            history_path=Path.home().joinpath('.cache/clear/clear19/history', history_name))
         self.fritz_box_traffic_graph.rectangle = Rectangle(
             self.fritz_box_hosts.position(Anchor.BOTTOM_LEFT).anchored(Anchor.TOP_LEFT) + Point(0, 1),
             self.fritz_box_ip4.position(Anchor.TOP_RIGHT) + Point(0, -1))
 
-        self.fritz_box_traffic = FritzBoxTrafficWidget(self, self.fritz_box, Font(size=11))
+        self.fritz_box_traffic = FritzBoxTrafficWidget(self, self.traffic_source, Font(size=11))
         self.fritz_box_traffic.rectangle = Rectangle(
             self.fritz_box_hosts.position(Anchor.BOTTOM_LEFT).anchored(Anchor.TOP_LEFT) + Point(0, 1),
             self.fritz_box_ip4.position(Anchor.TOP_RIGHT) + Point(0, -1))
@@ -177,4 +188,4 @@ class MainScreen(Screen):
         return False
 
     def load_weather(self, _=None) -> Optional[WeatherData]:
-        return self.wetter_com.load_weather(lambda wps2: self.weather_widgets.set_weather_periods(wps2))
+        return self.weather_provider.load_weather(lambda wps2: self.weather_widgets.set_weather_periods(wps2))
@@ -4,8 +4,7 @@ from typing import Optional
 
 from clear19.App import Global
 from clear19.App.screens import Screens
-from clear19.data import Config
-from clear19.data.wetter_com import WetterCom, WeatherData
+from clear19.data.wetter_com import WeatherData
 from clear19.logitech.g19 import G19Key, DisplayKey
 from clear19.widgets.geometry import VAnchor
 from clear19.widgets.text_widget import TextWidget
@@ -18,7 +17,7 @@ class WeatherScreen(Screen):
     def __init__(self, parent: AppWidget):
         super().__init__(parent, "Time")
 
-        self.wetter_com = WetterCom(Config.Weather.city_code(), Global.download_manager)
+        self.weather_provider = Global.weather_provider
 
         self.title = TextWidget(self, "Wetter", h_alignment=TextWidget.HAlignment.CENTER)
         self.title.rectangle = self.rectangle
@@ -36,7 +35,7 @@ class WeatherScreen(Screen):
             return True
 
     def load_weather(self, _=None):
-        data = self.wetter_com.load_weather(self.read_weather)
+        data = self.weather_provider.load_weather(self.read_weather)
         if data:
             self.read_weather(data)
 
@@ -1,5 +1,6 @@
 import json
 from configparser import ConfigParser
+from typing import Optional, List
 
 
 class Config:
@@ -35,6 +36,13 @@ class Config:
         def temp_values_url() -> str:
             return Config._config()['Weather']['temp_values']
 
+        @staticmethod
+        def provider() -> str:
+            """
+            :return: 'wetter.com' or 'temp_values'.
+            """
+            return Config._config()['Weather'].get('provider', 'wetter.com')
+
     class FritzBox:
         @staticmethod
         def address() -> str:
@@ -44,6 +52,30 @@ class Config:
         def password() -> str:
             return Config._config()['FritzBox']['password']
 
+    class Network:
+        @staticmethod
+        def traffic_source() -> str:
+            """
+            :return: 'fritzbox' to show the traffic of the Fritz!Box or 'net_dev' to show the traffic of this machine.
+            """
+            return Config._config().get('Network', 'traffic_source', fallback='fritzbox')
+
+        @staticmethod
+        def interfaces() -> Optional[List[str]]:
+            """
+            :return: Interfaces whose traffic is shown by 'net_dev', or None for all physical interfaces.
+            """
+            interfaces = Config._config().get('Network', 'interfaces', fallback='')
+            return [i.strip() for i in interfaces.split(',') if i.strip()] or None
+
+    class SystemData:
+        @staticmethod
+        def process_aggregation() -> str:
+            """
+            :return: 'process' to list single processes or 'cgroup' to list systemd units and containers.
+            """
+            return Config._config().get('SystemData', 'process_aggregation', fallback='process')
+
     class DiskStats:
         @staticmethod
         def drives() -> dict[str, str]:
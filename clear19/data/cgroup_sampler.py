@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Tuple, Optional
+
+log = logging.getLogger(__name__)
+
+
+class CgroupSampler:
+    """
+    Measures the CPU usage per systemd service, scope or container by reading cpu.stat of the cgroup v2 hierarchy.
+    A cgroup accounts the usage of all its processes and sub groups, so one read per unit is enough. Units with the
+    same name, e.g. several scopes of one application, are added up.
+    The hierarchy is only scanned for new units every RESCAN_INTERVAL samples, or after a unit vanished.
+    """
+    UNIT_SUFFIXES: Tuple[str, ...] = ('.service', '.scope')
+    RESCAN_INTERVAL: int = 10
+    """Number of samples after which the hierarchy is scanned for new units."""
+
+    _ESCAPE_PATTERN = re.compile(r'\\x([0-9a-fA-F]{2})')
+    _INSTANCE_PATTERN = re.compile(r'-([0-9]+|[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12})$')
+    _CONTAINER_PATTERN = re.compile(r'^(docker|libpod|cri-containerd|crio)-([0-9a-f]{12})[0-9a-f]{52}$')
+
+    _root: str
+    _usage: Dict[str, int]
+    """CPU usage in microseconds per cgroup path at the last sample."""
+    _names: Dict[str, str]
+    _unit_paths: Optional[List[str]] = None
+    """Paths of the units found by the last scan, or None if a scan is due."""
+    _samples_since_scan: int = 0
+    _last_sample: Optional[float] = None
+
+    def __init__(self, root: Optional[str] = None):
+        """
+        :param root: Mount point of the cgroup v2 hierarchy. If None, it is detected.
+        """
+        self._root = root or self.find_root() or '/sys/fs/cgroup'
+        self._usage = {}
+        self._names = {}
+
+    @staticmethod
+    def find_root() -> Optional[str]:
+        """
+        :return: Mount point of the cgroup v2 hierarchy, or None if the system doesn't use cgroup v2.
+        """
+        for root in ('/sys/fs/cgroup', '/sys/fs/cgroup/unified'):
+            if os.path.exists(os.path.join(root, 'cgroup.controllers')):
+                return root
+        return None
+
+    def sample(self) -> List[Tuple[str, float]]:
+        """
+        :return: Name and CPU usage in percent of one core of every unit since the last sample. The usage is 0 on the
+                 first sample.
+        """
+        now = time.monotonic()
+        interval = (now - self._last_sample) * 1e6 if self._last_sample else None
+        self._last_sample = now
+        old_usage = self._usage
+        usage = {}
+        result: Dict[str, float] = {}
+        if self._unit_paths is None or self._samples_since_scan >= self.RESCAN_INTERVAL:
+            self._unit_paths = self._units(self._root)
+            self._samples_since_scan = 0
+        self._samples_since_scan += 1
+        paths = self._unit_paths
+        for path in paths:
+            current = self._read_usage(path)
+            if current is None:
+                # The unit stopped, the next sample scans the hierarchy again.
+                self._unit_paths = None
+                continue
+            usage[path] = current
+            name = self._names.get(path)
+            if name is None:
+                name = self._names[path] = self.unit_name(os.path.basename(path))
+            old = old_usage.get(path)
+            percent = (current - old) / interval * 100 if interval and old is not None and current >= old else 0.0
+            result[name] = result.get(name, 0.0) + percent
+        for path in self._names.keys() - usage.keys():
+            del self._names[path]
+        self._usage = usage
+        return list(result.items())
+
+    def top(self, n: int) -> List[Tuple[str, float]]:
+        """
+        Takes a sample and selects the busiest units.
+        :param n: Maximum number of units.
+        :return: Name and CPU usage of the n busiest units, sorted by CPU usage, descending.
+        """
+        return heapq.nlargest(n, self.sample(), key=lambda p: p[1])
+
+    @staticmethod
+    def unit_name(unit: str) -> str:
+        """
+        :return: Readable name of a unit: Without suffix, escapes and instance numbers, and with short container IDs.
+        """
+        for suffix in CgroupSampler.UNIT_SUFFIXES:
+            if unit.endswith(suffix):
+                unit = unit[:-len(suffix)]
+                if suffix == '.scope':
+                    unit = CgroupSampler._INSTANCE_PATTERN.sub('', unit)
+                break
+        unit = CgroupSampler._ESCAPE_PATTERN.sub(lambda m: chr(int(m.group(1), 16)), unit)
+        container = CgroupSampler._CONTAINER_PATTERN.match(unit)
+        if container:
+            return f'{container.group(1)} {container.group(2)}'
+        if unit.startswith('app-'):
+            unit = unit[len('app-'):]
+        return unit
+
+    def _units(self, path: str, in_unit: bool = False) -> List[str]:
+        """
+        :param in_unit: True if path belongs to a unit. Then only nested units are returned, other sub groups are
+                        accounted by the unit.
+        :return: Paths of the innermost units below path, e.g. the application scopes within user@.service. Groups
+                 without sub groups outside of units, e.g. containers that are not managed by systemd, count as units,
+                 too.
+        """
+        units = []
+        try:
+            with os.scandir(path) as entries:
+                children = [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return units
+        for child in children:
+            is_unit = child.name.endswith(self.UNIT_SUFFIXES)
+            sub_units = self._units(child.path, in_unit or is_unit)
+            if sub_units:
+                units.extend(sub_units)
+            elif is_unit or not in_unit:
+                units.append(child.path)
+        return units
+
+    @staticmethod
+    def _read_usage(path: str) -> Optional[int]:
+        """
+        :return: Consumed CPU time of the cgroup in microseconds, or None if it vanished.
+        """
+        try:
+            with open(os.path.join(path, 'cpu.stat'), 'rb') as file:
+                for line in file:
+                    if line.startswith(b'usage_usec '):
+                        return int(line[len(b'usage_usec '):])
+        except OSError:
+            pass
+        return None
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import logging
+import math
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from threading import Lock
+from typing import Generic, TypeVar, Callable, Dict, List, Optional, Any
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class Topic(Generic[T]):
+    """
+    Identifies a kind of sample on a DataBus. Topics are compared by identity, the name is only for logging.
+    """
+    _name: str
+
+    def __init__(self, name: str):
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __repr__(self) -> str:
+        return f'Topic({self._name})'
+
+
+class DataBus:
+    """
+    Delivers the samples that data providers publish to subscribers.
+    Providers publish on their own threads. Subscribers are only called by deliver, which the App calls on its thread
+    with every update of the display. So subscribers can change widgets without locking against painting.
+    A sample that equals the previous sample of its topic is dropped. If a subscriber has several undelivered samples
+    of a topic, it only gets the latest one. New subscribers get the latest sample of their topic with the next deliver.
+    """
+    @dataclass(eq=False)
+    class Subscription(Generic[T]):
+        topic: Topic[T]
+        callback: Callable[[T], None]
+        min_interval: float
+        """Minimum number of seconds between two calls of the callback."""
+        last_delivery: float = -math.inf
+        pending: bool = False
+        value: Optional[T] = None
+
+    _subscriptions: Dict[Topic, List[DataBus.Subscription]]
+    _latest: Dict[Topic, Any]
+    _has_pending: bool = False
+    _lock: Lock
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._latest = {}
+        self._lock = Lock()
+
+    def publish(self, topic: Topic[T], value: T, force: bool = False) -> bool:
+        """
+        Publishes a sample. Can be called from any thread.
+        :param topic: Topic of the sample.
+        :param value: The sample. Must not be changed after publishing it.
+        :param force: If True, the sample is delivered even if it equals the previous one.
+        :return: False if the sample was dropped because it didn't change.
+        """
+        with self._lock:
+            if not force and topic in self._latest and self._equal(self._latest[topic], value):
+                return False
+            self._latest[topic] = value
+            for subscription in self._subscriptions.get(topic, ()):
+                subscription.value = value
+                subscription.pending = True
+                self._has_pending = True
+        return True
+
+    def subscribe(self, topic: Topic[T], callback: Callable[[T], None],
+                  min_interval: Optional[timedelta] = None) -> DataBus.Subscription[T]:
+        """
+        :param topic: Topic of the samples.
+        :param callback: Gets the samples, called in deliver. Starts with the latest sample, if there is one.
+        :param min_interval: If set, the callback is called at most once in this interval. Samples in between are
+                             dropped, except the latest one, which is delivered when the interval passed.
+        :return: Handle for unsubscribe.
+        """
+        subscription = DataBus.Subscription(topic, callback, min_interval.total_seconds() if min_interval else 0)
+        with self._lock:
+            self._subscriptions.setdefault(topic, []).append(subscription)
+            # Later samples that equal the latest one are dropped, so the subscriber would miss the current value.
+            if topic in self._latest:
+                subscription.value = self._latest[topic]
+                subscription.pending = True
+                self._has_pending = True
+        return subscription
+
+    def unsubscribe(self, subscription: DataBus.Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.topic, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+
+    def latest(self, topic: Topic[T]) -> Optional[T]:
+        """
+        :return: The last published sample of the topic, or None.
+        """
+        with self._lock:
+            return self._latest.get(topic)
+
+    def deliver(self):
+        """
+        Calls the subscribers that have pending samples. Shall be called periodically on the thread that paints.
+        """
+        if not self._has_pending:
+            return
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            self._has_pending = False
+            for subscriptions in self._subscriptions.values():
+                for subscription in subscriptions:
+                    if not subscription.pending:
+                        continue
+                    if now - subscription.last_delivery < subscription.min_interval:
+                        self._has_pending = True
+                        continue
+                    due.append((subscription.callback, subscription.value))
+                    subscription.pending = False
+                    subscription.value = None
+                    subscription.last_delivery = now
+        for callback, value in due:
+            # noinspection PyBroadException
+            try:
+                callback(value)
+            except Exception:
+                log.error(f"Exception in data bus subscriber {callback}.", exc_info=True)
+
+    @staticmethod
+    def _equal(a: Any, b: Any) -> bool:
+        if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+            return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and np.array_equal(a, b)
+        try:
+            return bool(a == b)
+        except ValueError:
+            return False
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock, Thread, Event
+from typing import Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Validators:
+    """HTTP validators of a cached file, used for conditional requests."""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class DiskCache:
+    """
+    Stores downloaded files on disk, bounded by a total size quota.
+    Files are named by the SHA-256 of their content. An index file maps URLs to files and holds size, fetch time and
+    validators. It is loaded once, so lookups need no file system access. A background thread writes the index and
+    evicts the least recently used files when the quota is exceeded.
+    """
+    INDEX_FILE = 'index.json'
+
+    @dataclass
+    class Entry:
+        file: str
+        size: int
+        fetch_time: float
+        """POSIX timestamp of the download or the last successful revalidation."""
+        last_used: float
+        etag: Optional[str] = None
+        last_modified: Optional[str] = None
+
+        @property
+        def fetched(self) -> datetime:
+            return datetime.fromtimestamp(self.fetch_time)
+
+        @property
+        def validators(self) -> Optional[Validators]:
+            if self.etag or self.last_modified:
+                return Validators(self.etag, self.last_modified)
+            return None
+
+    _path: Path
+    _max_size: int
+    _maintenance_interval: timedelta
+    _entries: Dict[str, Entry]
+    _references: Dict[str, int]
+    _size: int = 0
+    _lock: Lock
+    _flush_lock: Lock
+    _dirty: bool = False
+    _wake: Event
+    _running: bool = True
+
+    def __init__(self, path: Path, max_size: int = 256 * 2 ** 20,
+                 maintenance_interval: timedelta = timedelta(seconds=30)):
+        """
+        :param path: Directory of the cache. Files in it that are not referenced by the index are deleted.
+        :param max_size: Maximum total size of all cached files in bytes.
+        :param maintenance_interval: Interval in which the index is written and the quota is enforced.
+        """
+        self._path = path
+        self._max_size = max_size
+        self._maintenance_interval = maintenance_interval
+        self._entries = {}
+        self._references = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wake = Event()
+        self._path.mkdir(mode=0o755, parents=True, exist_ok=True)
+        self._load_index()
+        Thread(target=self._maintenance_worker, name="DiskCache maintenance", daemon=True).start()
+
+    def lookup(self, url: str) -> Optional[DiskCache.Entry]:
+        """
+        :return: The index entry of the URL, or None if it is not cached. Doesn't access the file system.
+        """
+        with self._lock:
+            return self._entries.get(url)
+
+    def read(self, url: str) -> Optional[bytes]:
+        """
+        :return: The cached content of the URL, or None if it is not cached or the file is not readable.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if not entry:
+                return None
+            entry.last_used = datetime.now().timestamp()
+            self._dirty = True
+        try:
+            with open(str(self._path.joinpath(entry.file)), 'rb') as file:
+                return file.read()
+        except OSError:
+            log.warning(f"Failed to read cached file of {url}.", exc_info=True)
+            self.remove(url)
+            return None
+
+    def write(self, url: str, content: bytes, validators: Optional[Validators] = None,
+              fetched: Optional[datetime] = None):
+        """
+        Stores the content of the URL and replaces its previous content.
+        :param validators: HTTP validators of the content.
+        :param fetched: When the content was downloaded. Defaults to now.
+        """
+        name = hashlib.sha256(content).hexdigest()
+        path = self._path.joinpath(name)
+        tmp_path = self._path.joinpath(f'.{name}.{os.getpid()}.{id(content)}.tmp')
+        try:
+            with open(str(tmp_path), 'wb') as file:
+                file.write(content)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        now = datetime.now().timestamp()
+        with self._lock:
+            os.replace(tmp_path, path)
+            old = self._entries.get(url)
+            self._entries[url] = DiskCache.Entry(name, len(content), fetched.timestamp() if fetched else now, now,
+                                                 validators.etag if validators else None,
+                                                 validators.last_modified if validators else None)
+            self._reference(name, len(content))
+            if old:
+                self._release(old.file, old.size)
+            self._dirty = True
+        self._wake.set()
+
+    def touch(self, url: str, validators: Optional[Validators] = None):
+        """
+        Marks the cached content of the URL as fetched now, e.g. after a successful revalidation.
+        :param validators: If given, replaces the stored validators.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                entry.fetch_time = entry.last_used = datetime.now().timestamp()
+                if validators:
+                    entry.etag = validators.etag
+                    entry.last_modified = validators.last_modified
+                self._dirty = True
+
+    def remove(self, url: str):
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry:
+                self._release(entry.file, entry.size)
+                self._dirty = True
+
+    def flush(self):
+        """
+        Writes the index if it changed.
+        """
+        # Serialises the writers of the temporary file, and keeps an older snapshot from replacing a newer one.
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                index = {url: asdict(entry) for url, entry in self._entries.items()}
+                self._dirty = False
+            tmp_path = self._path.joinpath(f'.{self.INDEX_FILE}.tmp')
+            try:
+                with open(str(tmp_path), 'w') as file:
+                    json.dump(index, file)
+                os.replace(tmp_path, self._path.joinpath(self.INDEX_FILE))
+            except OSError:
+                log.error("Failed to write disk cache index.", exc_info=True)
+                with self._lock:
+                    self._dirty = True
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self.flush()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def size(self) -> int:
+        """
+        :return: Total size of all cached files.
+        """
+        return self._size
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def _load_index(self):
+        try:
+            with open(str(self._path.joinpath(self.INDEX_FILE)), 'r') as file:
+                index = json.load(file)
+            for url, entry in index.items():
+                self._entries[url] = DiskCache.Entry(**entry)
+                self._reference(self._entries[url].file, self._entries[url].size)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError):
+            log.error("Failed to load disk cache index. Starting with an empty cache.", exc_info=True)
+            self._entries.clear()
+            self._references.clear()
+            self._size = 0
+
+    def _maintenance_worker(self):
+        self._remove_unreferenced()
+        while self._running:
+            self._evict()
+            self.flush()
+            self._wake.wait(self._maintenance_interval.total_seconds())
+            self._wake.clear()
+
+    def _remove_unreferenced(self):
+        """
+        Drops index entries without file and deletes files without index entry, e.g. from older cache layouts.
+        Runs while files are written, so each file is checked and deleted with the lock held.
+        """
+        stale_tmp_time = (datetime.now() - timedelta(hours=1)).timestamp()
+        existing = set()
+        for path in self._path.iterdir():
+            if path.name == self.INDEX_FILE:
+                continue
+            try:
+                if not path.is_file():
+                    continue
+                if path.name.endswith('.tmp'):
+                    # Temporary files of running writes are kept, only leftovers of crashes are deleted.
+                    if path.stat().st_mtime < stale_tmp_time:
+                        path.unlink(missing_ok=True)
+                    continue
+                with self._lock:
+                    if path.name in self._references:
+                        existing.add(path.name)
+                    else:
+                        log.debug(f"Deleting unreferenced cache file {path}.")
+                        path.unlink(missing_ok=True)
+            except OSError:
+                log.warning(f"Failed to check cache file {path}.", exc_info=True)
+        with self._lock:
+            # Files of entries that were written during the scan were possibly not listed.
+            missing = [url for url, entry in self._entries.items()
+                       if entry.file not in existing and not self._path.joinpath(entry.file).is_file()]
+            for url in missing:
+                entry = self._entries.pop(url)
+                self._release(entry.file, entry.size)
+                self._dirty = True
+
+    def _evict(self):
+        with self._lock:
+            if self._size <= self._max_size:
+                return
+            for url, entry in sorted(self._entries.items(), key=lambda e: e[1].last_used):
+                if self._size <= self._max_size:
+                    break
+                log.debug(f"Evicting {url} from disk cache.")
+                del self._entries[url]
+                self._release(entry.file, entry.size)
+            self._dirty = True
+
+    def _reference(self, name: str, size: int):
+        """Has to be called with self._lock held."""
+        if name not in self._references:
+            self._references[name] = 0
+            self._size += size
+        self._references[name] += 1
+
+    def _release(self, name: str, size: int):
+        """Has to be called with self._lock held."""
+        self._references[name] -= 1
+        if not self._references[name]:
+            del self._references[name]
+            self._size -= size
+            try:
+                self._path.joinpath(name).unlink()
+            except FileNotFoundError:
+                pass
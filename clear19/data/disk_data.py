@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import timedelta
+from threading import Thread
+from typing import Dict, Optional, Tuple, Callable, List
+
+import numpy as np
+
+from clear19.data.data_bus import DataBus, Topic
+from clear19.scheduler import Scheduler
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DiskUsage:
+    total: int  # In bytes
+    used: int
+    free: int
+    """Bytes available to unprivileged users."""
+    percent: float
+    """Used space in percent of the space available to unprivileged users, like df and psutil."""
+
+
+@dataclass(frozen=True)
+class DiskIo:
+    read_rate: float  # In bytes per second
+    write_rate: float
+    utilisation: float
+    """Percentage of time in which the device was busy."""
+
+
+class DiskData:
+    """
+    Reads the capacity and the I/O throughput of disks.
+    The capacity is sampled with statvfs on daemon threads, at most one call per mount at a time, so a hung network
+    mount neither blocks the scheduler, the other mounts nor the exit of the interpreter. Mounts whose usage doesn't
+    change are sampled less often.
+    The I/O throughput of all devices is calculated from one read of /proc/diskstats per second.
+    Samples are published to the data bus, the listeners are called on the thread that delivers the bus.
+    """
+    USAGE_TOPIC: Topic[Dict[str, Optional[DiskUsage]]] = Topic('disk_data.usage')
+    IO_TOPIC: Topic[Dict[str, DiskIo]] = Topic('disk_data.io')
+
+    MIN_USAGE_INTERVAL: timedelta = timedelta(seconds=5)
+    MAX_USAGE_INTERVAL: timedelta = timedelta(minutes=5)
+    TIMEOUT: timedelta = timedelta(seconds=5)
+    """Time after which the usage of a mount whose statvfs didn't return is reported as unknown."""
+    SECTOR_SIZE: int = 512
+    """Size of the sectors counted in /proc/diskstats, independent of the device."""
+
+    @dataclass
+    class _Mount:
+        path: str
+        interval: float
+        """Current sample interval in seconds."""
+        next_sample: float = 0
+        future: Optional[Future] = None
+        started: float = 0
+        device: Optional[Tuple[int, int]] = None
+        """Major and minor number of the device."""
+        usage: Optional[DiskUsage] = None
+
+    _proc_path: str
+    _data_bus: DataBus
+    _mounts: Dict[str, DiskData._Mount]
+    _devices: List[Tuple[int, int]]
+    _device_names: List[str]
+    _counters: Optional[np.ndarray] = None
+    """Read sectors, written sectors and milliseconds doing I/O per device at the last sample."""
+    _last_io_sample: Optional[float] = None
+    _device_io: Dict[str, DiskIo]
+
+    def __init__(self, scheduler: Scheduler, data_bus: DataBus, mounts: Dict[str, str], proc_path: str = '/proc'):
+        """
+        :param scheduler: Used to update the data every second.
+        :param data_bus: Receives the samples.
+        :param mounts: Paths of the mounted file systems by name.
+        """
+        self._proc_path = proc_path
+        self._data_bus = data_bus
+        self._mounts = {name: DiskData._Mount(path, DiskData.MIN_USAGE_INTERVAL.total_seconds())
+                        for name, path in mounts.items()}
+        self._devices = []
+        self._device_names = []
+        self._device_io = {}
+        scheduler.schedule_synchronous(timedelta(seconds=1), self._update)
+        self._update()
+
+    def _update(self, _=None):
+        now = time.monotonic()
+        changed = False
+        for name, mount in self._mounts.items():
+            if mount.future and mount.future.done():
+                changed |= self._sampled(mount, mount.future, now)
+                mount.future = None
+            elif mount.future and now - mount.started > DiskData.TIMEOUT.total_seconds() and mount.usage:
+                log.warning(f'statvfs of "{mount.path}" did not return within {DiskData.TIMEOUT}.')
+                mount.usage = None
+                changed = True
+            if not mount.future and now >= mount.next_sample:
+                mount.started = now
+                mount.future = self._submit_stat(mount.path)
+        if changed:
+            self._data_bus.publish(DiskData.USAGE_TOPIC, self.usage)
+        self._sample_io(now)
+
+    @staticmethod
+    def _sampled(mount: DiskData._Mount, future: Future, now: float) -> bool:
+        """
+        Takes the result of a statvfs call and adapts the sample interval: It is doubled while the usage doesn't change
+        noticeably, and reset when it does.
+        :return: True if the usage changed.
+        """
+        try:
+            device, usage = future.result()
+        except OSError as e:
+            log.warning(f'Failed to get the usage of "{mount.path}": {e}')
+            device, usage = None, None
+        old = mount.usage
+        if old and usage and abs(usage.used - old.used) <= usage.total / 1000:
+            mount.interval = min(mount.interval * 2, DiskData.MAX_USAGE_INTERVAL.total_seconds())
+        else:
+            mount.interval = DiskData.MIN_USAGE_INTERVAL.total_seconds()
+        mount.next_sample = now + mount.interval
+        mount.device = device
+        mount.usage = usage
+        return usage != old
+
+    @staticmethod
+    def _submit_stat(path: str) -> Future:
+        """
+        Runs _stat on a new daemon thread. Threads of a ThreadPoolExecutor are joined when the interpreter exits, which
+        would never return while statvfs hangs.
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(DiskData._stat(path))
+            except Exception as e:
+                future.set_exception(e)
+
+        Thread(target=run, name='DiskData statvfs', daemon=True).start()
+        return future
+
+    @staticmethod
+    def _stat(path: str) -> Tuple[Tuple[int, int], DiskUsage]:
+        """
+        Runs on a daemon thread, as it may block on network mounts.
+        :return: Major and minor number of the device and the usage of the file system.
+        """
+        device = os.stat(path).st_dev
+        vfs = os.statvfs(path)
+        total = vfs.f_blocks * vfs.f_frsize
+        free = vfs.f_bavail * vfs.f_frsize
+        used = (vfs.f_blocks - vfs.f_bfree) * vfs.f_frsize
+        percent = used / (used + free) * 100 if used + free else 0.0
+        return (os.major(device), os.minor(device)), DiskUsage(total, used, free, round(percent, 1))
+
+    def _sample_io(self, now: float):
+        try:
+            with open(os.path.join(self._proc_path, 'diskstats'), 'rb') as file:
+                rows = [line.split() for line in file.read().splitlines()]
+        except OSError as e:
+            log.warning(f"Failed to read disk statistics: {e}")
+            return
+        rows = [row for row in rows if len(row) >= 13]
+        devices = [(int(row[0]), int(row[1])) for row in rows]
+        # Fields after major, minor and name: sectors read is the third, sectors written the seventh and milliseconds
+        # doing I/O the tenth.
+        counters = np.array([row[3:13] for row in rows], dtype=np.int64).reshape(-1, 10)[:, [2, 6, 9]]
+        if self._counters is not None and devices == self._devices and now > self._last_io_sample:
+            seconds = now - self._last_io_sample
+            delta = np.maximum(counters - self._counters, 0) / seconds
+            read_rates = delta[:, 0] * DiskData.SECTOR_SIZE
+            write_rates = delta[:, 1] * DiskData.SECTOR_SIZE
+            utilisations = np.minimum(delta[:, 2] / 10, 100)
+            self._device_io = {name: DiskIo(float(r), float(w), float(u)) for name, r, w, u
+                               in zip(self._device_names, read_rates, write_rates, utilisations)}
+        else:
+            self._devices = devices
+            self._device_names = [row[2].decode() for row in rows]
+            self._device_io = {}
+        self._counters = counters
+        self._last_io_sample = now
+        if self._device_io:
+            self._data_bus.publish(DiskData.IO_TOPIC, self.io)
+
+    def add_usage_listener(self, listener: Callable[[Dict[str, Optional[DiskUsage]]], None]):
+        """
+        :param listener: Gets the usage by mount name. It is None for mounts that are unavailable.
+        """
+        self._data_bus.subscribe(DiskData.USAGE_TOPIC, listener)
+
+    def add_io_listener(self, listener: Callable[[Dict[str, DiskIo]], None]):
+        """
+        :param listener: Gets the I/O throughput of the devices of the mounts by mount name.
+        """
+        self._data_bus.subscribe(DiskData.IO_TOPIC, listener)
+
+    @property
+    def usage(self) -> Dict[str, Optional[DiskUsage]]:
+        """
+        :return: Usage by mount name, None for mounts that are unavailable or not sampled yet.
+        """
+        return {name: mount.usage for name, mount in self._mounts.items()}
+
+    @property
+    def io(self) -> Dict[str, DiskIo]:
+        """
+        :return: I/O throughput of the devices of the mounts by mount name. Mounts on virtual devices, like btrfs or
+                 LVM volumes, are missing.
+        """
+        io = {}
+        for name, mount in self._mounts.items():
+            if mount.device in self._devices:
+                device_io = self._device_io.get(self._device_names[self._devices.index(mount.device)])
+                if device_io:
+                    io[name] = device_io
+        return io
+
+    @property
+    def device_io(self) -> Dict[str, DiskIo]:
+        """
+        :return: I/O throughput of every block device and partition by device name.
+        """
+        return self._device_io
@@ -1,165 +1,445 @@
 from __future__ import annotations
 
+import itertools
 import logging
-import os
 import urllib.request
-from dataclasses import dataclass
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
 from datetime import timedelta, datetime
 from pathlib import Path
 from queue import Queue
-from threading import Thread, Lock
-from typing import Dict, Callable, Optional
+from threading import Thread, Event, Condition, Lock
+from typing import Callable, Optional, List, Dict, Iterator, Tuple
 from urllib.error import URLError
 from urllib.parse import urlparse
 
-log = logging.getLogger(__name__)
+import requests
+from requests.adapters import HTTPAdapter
 
+from clear19.data.disk_cache import DiskCache, Validators
+from clear19.data.lru_cache import LruCache
 
-def file_name_from_url(url: str) -> str:
-    return os.path.basename(urlparse(url).path)
+log = logging.getLogger(__name__)
 
 
 class DownloadManager:
     """
     Downloads files and caches them on disk and memory.
+    Downloads run in a pool of workers, with a limited number of parallel downloads per host. HTTP(S) connections are
+    kept alive and reused.
+    Files can be requested with a callback by get, or as a cancellable future by fetch.
     """
-    @dataclass
+    PRIORITY_USER_VISIBLE: float = 10
+    """Priority for content the user is waiting for, like album art."""
+    PRIORITY_DEFAULT: float = 100
+    """Priority for background refreshes."""
+
+    @dataclass(order=True)
     class _DownloadJob:
-        url: str
-        callback: Callable[[bytes], None]
-
-    @dataclass
-    class _CacheEntry:
-        content: bytes
-        date: datetime
-
-    _cache_path: Path
-    _mem_cache: Dict[str, _CacheEntry]
-    _mem_cache_lock: Lock
-    _name_generator: Callable[[str], str]
-    _download_queue: Queue[Optional[DownloadManager._DownloadJob]]
+        priority: float
+        sequence: int
+        url: str = field(compare=False)
+        callbacks: List[Callable[[bytes], None]] = field(compare=False)
+        lifetime: timedelta = field(compare=False)
+        stale_while_revalidate: bool = field(compare=False, default=False)
+        revalidate: bool = field(compare=False, default=False)
+        """
+        The cached content is outdated. It is not taken from the memory cache, and the file on disk, if any, is
+        revalidated with a conditional request.
+        """
+        futures: List[Future] = field(compare=False, default_factory=list)
+        subscribers: int = field(compare=False, default=1)
+        """Number of requests that wait for this job. The job is dropped when all of them were cancelled."""
+        started: bool = field(compare=False, default=False)
+        cancelled: bool = field(compare=False, default=False)
+        memory_cache: bool = field(compare=False, default=True)
+        """
+        Keep the content in the memory cache. False if all requesters only use the content once, e.g. to decode it.
+        """
+
+    _disk_cache: DiskCache
+    _mem_cache: LruCache[str, bytes]
+    _expiry_interval: timedelta
+    _stopped: Event
+    _max_per_host: int
+    _timeout: float
+    _session: requests.Session
+    _sequence: Iterator[int]
+    _pending_downloads: List[DownloadManager._DownloadJob]
+    _active_hosts: Dict[str, int]
+    _downloads_condition: Condition
     _disk_load_queue: Queue[Optional[DownloadManager._DownloadJob]]
+    _in_flight: Dict[str, DownloadManager._DownloadJob]
+    _in_flight_lock: Lock
+    _deduplicated_requests: int = 0
+    _cancelled_requests: int = 0
     _running: bool = True
 
-    def __init__(self, cache_path: Path, name_generator: Callable[[str], str] = file_name_from_url):
+    def __init__(self, cache_path: Path, disk_cache_size: int = 256 * 2 ** 20,
+                 mem_cache_size: int = 32 * 2 ** 20, expiry_interval: timedelta = timedelta(minutes=1),
+                 workers: int = 4, max_per_host: int = 2, timeout: float = 30):
         """
         :param cache_path: Path where cached files shall be stored.
-        :param name_generator: Generates file names for the cached files from the URL. Default implementation just
-                               preserves the file name.
-        """
-        self._cache_path = cache_path
-        self._name_generator = name_generator
-        self._mem_cache = {}
-        self._mem_cache_lock = Lock()
-        self._download_queue = Queue()
+        :param disk_cache_size: Maximum number of bytes stored in cache_path. Least recently used files are evicted
+                                first.
+        :param mem_cache_size: Maximum number of bytes kept in the memory cache. Least recently used files are
+                               evicted first.
+        :param expiry_interval: Interval in which files whose lifetime passed are removed from the memory cache.
+        :param workers: Maximum number of parallel downloads.
+        :param max_per_host: Maximum number of parallel downloads from the same host.
+        :param timeout: Timeout for connecting and for reading from the server in seconds.
+        """
+        self._disk_cache = DiskCache(cache_path, disk_cache_size)
+        self._mem_cache = LruCache(mem_cache_size)
+        self._expiry_interval = expiry_interval
+        self._stopped = Event()
+        self._max_per_host = max_per_host
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=max_per_host)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._sequence = itertools.count()
+        self._pending_downloads = []
+        self._active_hosts = {}
+        self._downloads_condition = Condition()
         self._disk_load_queue = Queue()
+        self._in_flight = {}
+        self._in_flight_lock = Lock()
 
-        self.cache_path.mkdir(mode=0o755, parents=True, exist_ok=True)
-
-        Thread(target=self._download_worker, name="DownloadManager download worker", daemon=True).start()
+        for i in range(workers):
+            Thread(target=self._download_worker, name=f"DownloadManager download worker {i}", daemon=True).start()
         Thread(target=self._disk_load_worker, name="DownloadManager disk load worker", daemon=True).start()
+        Thread(target=self._expiry_worker, name="DownloadManager expiry worker", daemon=True).start()
 
-    def get(self, url: str, callback: Callable[[bytes], None] = None, lifetime: timedelta = timedelta(days=30)) \
-            -> Optional[bytes]:
+    def get(self, url: str, callback: Callable[[bytes], None] = None, lifetime: timedelta = timedelta(days=30),
+            priority: float = PRIORITY_DEFAULT, stale_while_revalidate: bool = False) -> Optional[bytes]:
         """
         Downloads a file. Content is only returned, if file is already in memory.
+        Requests for a file that is already being loaded don't load it again, but get the result of the pending load.
+        Outdated cached files are revalidated with their ETag or Last-Modified date, so unchanged files are not
+        downloaded again.
         :param url: URL of file.
         :param callback: Function that shall be called when the download is finished. Will instantly be called when
                          the file is in memory.
         :param lifetime: Maximum age of cached file.
+        :param priority: Pending downloads with lower priority values are started first.
+        :param stale_while_revalidate: If True, an outdated cached file is used like a current one, while it is
+                                       revalidated in background. The callback is called again with the result.
         :return: Content of file or None.
         """
-        with self._mem_cache_lock:
-            if url in self._mem_cache:
-                if self._mem_cache[url].date + lifetime >= datetime.now():
-                    log.verbose(f"Getting URL '{url}' from memory cache.")
-                    return self._mem_cache[url].content
-                else:
-                    del self._mem_cache[url]
+        content = self._from_memory(url, callback, lifetime, priority, stale_while_revalidate)
+        if content is None:
+            self._load(url, callback, None, lifetime, priority, stale_while_revalidate)
+        return content
 
-        cache_file = self.cache_path.joinpath(self.name_generator(url))
-        if cache_file.exists():
-            file_time = datetime.fromtimestamp(cache_file.stat().st_mtime)
-            if file_time + lifetime >= datetime.now():
-                self._disk_load_queue.put(self._DownloadJob(url, callback))
-                log.verbose(f"Loading URL '{url}' from file cache.")
-                return None
+    def fetch(self, url: str, lifetime: timedelta = timedelta(days=30), priority: float = PRIORITY_DEFAULT,
+              stale_while_revalidate: bool = False, memory_cache: bool = True) -> Future[Optional[bytes]]:
+        """
+        Downloads a file like get, but never blocks and returns a future for the content.
+        Cancelling the future withdraws the request. When all requests for a file were withdrawn before its download
+        started, the download is dropped. Use asyncio.wrap_future to await the future in a coroutine.
+        :param url: URL of file.
+        :param lifetime: Maximum age of cached file.
+        :param priority: Pending downloads with lower priority values are started first.
+        :param stale_while_revalidate: If True, the future is resolved with an outdated cached file, while it is
+                                       revalidated in background.
+        :param memory_cache: If False, the content is only cached on disk. For large files that are processed once,
+                             like images that are decoded and scaled down.
+        :return: Future that is resolved with the content of the file, or None if it could not be loaded.
+        """
+        future = Future()
+        content = self._from_memory(url, None, lifetime, priority, stale_while_revalidate)
+        if content is not None:
+            future.set_result(content)
+            return future
+        job = self._load(url, None, future, lifetime, priority, stale_while_revalidate, memory_cache=memory_cache)
+        future.add_done_callback(lambda f: self._cancel(job, f) if f.cancelled() else None)
+        return future
+
+    def _from_memory(self, url: str, callback: Optional[Callable[[bytes], None]], lifetime: timedelta,
+                     priority: float, stale_while_revalidate: bool) -> Optional[bytes]:
+        content = self._mem_cache.get(url, None if stale_while_revalidate else lifetime)
+        if content is not None:
+            date = self._mem_cache.date(url)
+            if stale_while_revalidate and date and date + lifetime < datetime.now():
+                log.verbose(f"Getting stale URL '{url}' from memory cache and revalidating it.")
+                self._load(url, callback, None, lifetime, priority, True, stale_in_memory=True)
             else:
-                log.debug(f"File {cache_file} is too old. Deleting it.")
-                cache_file.unlink()
+                log.verbose(f"Getting URL '{url}' from memory cache.")
+        return content
+
+    def _load(self, url: str, callback: Optional[Callable[[bytes], None]], future: Optional[Future],
+              lifetime: timedelta, priority: float, stale_while_revalidate: bool, stale_in_memory: bool = False,
+              memory_cache: bool = True) -> DownloadManager._DownloadJob:
+        with self._in_flight_lock:
+            job = self._in_flight.get(url)
+            if job:
+                if callback:
+                    job.callbacks.append(callback)
+                if future:
+                    job.futures.append(future)
+                job.subscribers += 1
+                job.memory_cache = job.memory_cache or memory_cache
+                self._deduplicated_requests += 1
+                log.verbose(f"URL '{url}' is already being loaded.")
+                if priority < job.priority:
+                    with self._downloads_condition:
+                        job.priority = priority
+                return job
+            job = self._DownloadJob(priority, next(self._sequence), url, [callback] if callback else [], lifetime,
+                                    stale_while_revalidate, futures=[future] if future else [],
+                                    memory_cache=memory_cache)
+            self._in_flight[url] = job
+
+        # The stale content in memory has to be refreshed, even if there is no file on disk to revalidate.
+        job.revalidate = stale_in_memory
+        entry = self._disk_cache.lookup(url)
+        if entry:
+            if entry.fetched + lifetime >= datetime.now():
+                self._disk_load_queue.put(job)
+                log.verbose(f"Loading URL '{url}' from file cache.")
+                return job
+            job.revalidate = True
+            if stale_while_revalidate and not stale_in_memory:
+                self._disk_load_queue.put(job)
+                log.verbose(f"Loading stale URL '{url}' from file cache and revalidating it.")
+                return job
+            log.debug(f"Cached file of '{url}' is too old. Revalidating it.")
 
         log.verbose(f"Downloading URL '{url}'.")
-        self._download_queue.put(self._DownloadJob(url, callback))
-        return None
+        self._enqueue_download(job)
+        return job
 
-    @property
-    def cache_path(self) -> Path:
-        return self._cache_path
+    def _cancel(self, job: DownloadManager._DownloadJob, future: Future):
+        """
+        Withdraws the request of a cancelled future. Drops the job if nobody else waits for it and it didn't start yet.
+        """
+        with self._in_flight_lock:
+            if future in job.futures:
+                job.futures.remove(future)
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return
+            with self._downloads_condition:
+                if job.started:
+                    return
+                job.cancelled = True
+                self._pending_downloads = [j for j in self._pending_downloads if j is not job]
+            if self._in_flight.get(job.url) is job:
+                del self._in_flight[job.url]
+            self._cancelled_requests += 1
+        log.verbose(f"Cancelled loading of URL '{job.url}'.")
+
+    def _enqueue_download(self, job: DownloadManager._DownloadJob):
+        with self._downloads_condition:
+            self._pending_downloads.append(job)
+            self._downloads_condition.notify_all()
 
     @property
-    def name_generator(self) -> Callable[[str], str]:
-        return self._name_generator
+    def cache_path(self) -> Path:
+        return self._disk_cache.path
 
     @property
     def running(self) -> bool:
         return self._running
 
+    @property
+    def deduplicated_requests(self) -> int:
+        """
+        :return: Number of requests that were served by a load that was already pending.
+        """
+        return self._deduplicated_requests
+
+    @property
+    def cancelled_requests(self) -> int:
+        """
+        :return: Number of loads that were dropped before they started, because all their requests were cancelled.
+        """
+        return self._cancelled_requests
+
+    @property
+    def mem_cache_statistics(self) -> LruCache.Statistics:
+        """
+        :return: Hit, miss and eviction counts and the current size of the memory cache.
+        """
+        return self._mem_cache.statistics
+
     def stop(self):
         self._running = False
-        self._download_queue.put(None)
+        self._stopped.set()
+        with self._downloads_condition:
+            self._downloads_condition.notify_all()
+        self._disk_load_queue.put(None)
+        self._session.close()
+        self._disk_cache.stop()
+
+    def _next_download(self) -> Optional[DownloadManager._DownloadJob]:
+        """
+        Waits for the pending download with the lowest priority value whose host has a free slot and reserves the slot.
+        :return: The job, or None if the DownloadManager was stopped.
+        """
+        with self._downloads_condition:
+            while self.running:
+                self._pending_downloads = [j for j in self._pending_downloads if not j.cancelled]
+                for job in sorted(self._pending_downloads):
+                    host = urlparse(job.url).netloc
+                    if self._active_hosts.get(host, 0) < self._max_per_host:
+                        self._pending_downloads.remove(job)
+                        self._active_hosts[host] = self._active_hosts.get(host, 0) + 1
+                        job.started = True
+                        return job
+                self._downloads_condition.wait()
+            return None
 
     def _download_worker(self):
         while self.running:
-            job = self._download_queue.get()
+            job = self._next_download()
             if not job:
                 continue
+            try:
+                self._download(job)
+            except Exception:
+                # Unexpected errors, like a ValueError for a malformed URL, must neither kill the worker nor leave the
+                # job in flight, where it would swallow all later requests of the URL.
+                log.error(f'Failed to load "{job.url}".', exc_info=True)
+                self._notify(job, None)
+            finally:
+                host = urlparse(job.url).netloc
+                with self._downloads_condition:
+                    self._active_hosts[host] -= 1
+                    if not self._active_hosts[host]:
+                        del self._active_hosts[host]
+                    self._downloads_condition.notify_all()
 
-            in_mem_cache = False
-            with self._mem_cache_lock:
-                if job.url in self._mem_cache:
-                    self._notify(job, self._mem_cache[job.url].content)
-                    in_mem_cache = True
-            if not in_mem_cache:
-                log.debug(f"Downloading: {job.url}")
-                now = datetime.now()
-                try:
-                    with urllib.request.urlopen(job.url) as file:
-                        content = file.read()
-                except URLError as err:
-                    log.error(f'Failed to download "{job.url}".', exc_info=True)
-                    content = None
-                if content:
-                    with self._mem_cache_lock:
-                        self._mem_cache[job.url] = self._CacheEntry(content, now)
-                    cache_file = self.cache_path.joinpath(self.name_generator(job.url))
-                    with open(str(cache_file), 'wb') as file:
-                        file.write(content)
+    def _download(self, job: DownloadManager._DownloadJob):
+        if not job.revalidate:
+            content = self._mem_cache.peek(job.url)
+            if content is not None:
                 self._notify(job, content)
+                return
+
+        entry = self._disk_cache.lookup(job.url) if job.revalidate else None
+        validators = entry.validators if entry else None
+        log.debug(f"Downloading: {job.url}")
+        now = datetime.now()
+        try:
+            content, new_validators = self._fetch(job.url, validators)
+            if content is None:
+                content = self._read_cached(job.url)
+                if content is None:
+                    log.debug(f"Cached file of {job.url} vanished during revalidation. Downloading it again.")
+                    content, new_validators = self._fetch(job.url, None)
+                else:
+                    log.debug(f"{job.url} was not modified.")
+                    self._disk_cache.touch(job.url)
+                    self._cache_in_memory(job, content, now)
+                    self._notify(job, content)
+                    return
+        except (requests.RequestException, URLError, OSError):
+            log.error(f'Failed to download "{job.url}".', exc_info=True)
+            content = self._read_cached(job.url) if job.revalidate else None
+            self._notify(job, content)
+            return
+
+        if content:
+            self._cache_in_memory(job, content, now)
+            try:
+                self._disk_cache.write(job.url, content, new_validators, now)
+            except OSError:
+                log.error(f'Failed to write cache file of "{job.url}".', exc_info=True)
+        self._notify(job, content)
+
+    def _fetch(self, url: str, validators: Optional[Validators]) -> Tuple[Optional[bytes], Optional[Validators]]:
+        """
+        :param validators: If given, the file is only downloaded if it was modified.
+        :return: The content, or None if it was not modified, and the validators of the new content.
+        """
+        if urlparse(url).scheme in ('http', 'https'):
+            headers = {}
+            if validators and validators.etag:
+                headers['If-None-Match'] = validators.etag
+            if validators and validators.last_modified:
+                headers['If-Modified-Since'] = validators.last_modified
+            with self._session.get(url, headers=headers, timeout=self._timeout) as response:
+                if response.status_code == 304 and headers:
+                    return None, validators
+                response.raise_for_status()
+                new_validators = Validators(response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                if not new_validators.etag and not new_validators.last_modified:
+                    new_validators = None
+                return response.content, new_validators
+        with urllib.request.urlopen(url, timeout=self._timeout) as file:
+            return file.read(), None
+
+    def _read_cached(self, url: str) -> Optional[bytes]:
+        content = self._mem_cache.peek(url)
+        if content is not None:
+            return content
+        return self._disk_cache.read(url)
 
     def _disk_load_worker(self):
         while self.running:
             job = self._disk_load_queue.get()
-            if not job:
+            if not job or job.cancelled:
                 continue
 
-            in_mem_cache = False
-            with self._mem_cache_lock:
-                if job.url in self._mem_cache:
-                    self._notify(job, self._mem_cache[job.url].content)
-                    in_mem_cache = True
-            if not in_mem_cache:
-                cache_file = self.cache_path.joinpath(self.name_generator(job.url))
-                now = datetime.now()
-                with open(str(cache_file), 'rb') as file:
-                    content = file.read()
-                with self._mem_cache_lock:
-                    self._mem_cache[job.url] = self._CacheEntry(content, now)
+            content = self._mem_cache.peek(job.url)
+            if content is not None:
+                self._notify(job, content)
+            else:
+                entry = self._disk_cache.lookup(job.url)
+                content = self._disk_cache.read(job.url) if entry else None
+                if content is None:
+                    log.warning(f'Failed to read cached file of "{job.url}". Downloading it again.')
+                    job.revalidate = False
+                    self._enqueue_download(job)
+                    continue
+                self._cache_in_memory(job, content, entry.fetched)
                 self._notify(job, content)
+                if job.revalidate:
+                    self._revalidate_later(job)
+
+    def _revalidate_later(self, job: DownloadManager._DownloadJob):
+        """
+        Queues the revalidation of a file whose stale content was already delivered to the callbacks of job.
+        """
+        with self._in_flight_lock:
+            pending = self._in_flight.get(job.url)
+            if pending:
+                pending.callbacks.extend(job.callbacks)
+                pending.subscribers += 1
+                return
+            refresh = self._DownloadJob(job.priority, next(self._sequence), job.url, list(job.callbacks),
+                                        job.lifetime, job.stale_while_revalidate, True,
+                                        memory_cache=job.memory_cache)
+            self._in_flight[job.url] = refresh
+        self._enqueue_download(refresh)
 
-    @staticmethod
-    def _notify(job: Optional[DownloadManager._DownloadJob], data: bytes):
-        if job:
+    def _cache_in_memory(self, job: DownloadManager._DownloadJob, content: bytes, date: datetime):
+        if job.memory_cache:
+            self._mem_cache.put(job.url, content, None if job.stale_while_revalidate else job.lifetime, date)
+
+    def _expiry_worker(self):
+        while not self._stopped.wait(self._expiry_interval.total_seconds()):
+            expired = self._mem_cache.expire()
+            if expired:
+                log.verbose(f"Removed {expired} expired files from memory cache. {self._mem_cache.statistics}")
+
+    def _notify(self, job: DownloadManager._DownloadJob, data: Optional[bytes]):
+        with self._in_flight_lock:
+            if self._in_flight.get(job.url) is job:
+                del self._in_flight[job.url]
+            callbacks = list(job.callbacks)
+            futures = job.futures
+            job.futures = []
+        for future in futures:
+            try:
+                future.set_result(data)
+            except InvalidStateError:
+                pass  # Cancelled in the meantime.
+        for callback in callbacks:
             try:
-                job.callback(data)
+                callback(data)
             except Exception as e:
                 log.error(f"Error when notify job: {e}", exc_info=True)
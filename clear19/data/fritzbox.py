@@ -1,17 +1,18 @@
 #!/usr/bin/env python3
 import logging
-from dataclasses import dataclass
-from datetime import timedelta
+import random
+from dataclasses import dataclass, replace
+from datetime import timedelta, datetime
 from queue import Queue
 from threading import Lock, Thread
-from typing import List, Callable, Optional, Tuple
+from typing import Callable, Optional, Tuple, Dict, Any, List
 
 from fritzconnection import FritzConnection
-from fritzconnection.core.exceptions import FritzConnectionException
+from fritzconnection.core.exceptions import FritzConnectionException, FritzActionError, FritzServiceError, \
+    ActionError, ServiceError, FritzArgumentError, FritzLookUpError
 from fritzconnection.lib.fritzhosts import FritzHosts
-from fritzconnection.lib.fritzstatus import FritzStatus
-from fritzconnection.lib.fritzwlan import FritzWLAN
 
+from clear19.data.data_bus import DataBus, Topic
 from clear19.scheduler import Scheduler, TaskParameters
 
 log = logging.getLogger(__name__)
@@ -31,85 +32,212 @@ class FritzBoxData:
     bytes_sent: Optional[int] = None
     bytes_received: Optional[int] = None
 
+    poll_time: Optional[float] = None
+    """POSIX time stamp of the poll that read the traffic values."""
+    stale: bool = False
+    """The last poll failed, so the values are outdated."""
+
+
+@dataclass(eq=False)
+class Viewer:
+    """
+    Something that displays FritzBoxData, e.g. a widget. Its state is set on the thread of the App and only read by
+    the provider of the data, so the provider doesn't access the widget tree from its own thread.
+    """
+    shows_traffic: bool = False
+    """If True, the data is polled fast while the viewer is shown."""
+    shown: bool = False
+
 
 class FritzBox:
+    """
+    Polls a Fritz!Box via TR-064 over one persistent connection.
+    Every poll reads the traffic counters and rates with a single GetAddonInfos and the connection state with
+    GetStatusInfo. Slower changing values are read with their own, longer intervals: The link properties, the host
+    list, which is fetched as one XML document instead of one action per host, and the external addresses, which are
+    also refreshed when the connection state changes.
+    The poll interval depends on the viewers: Fast while a viewer that shows the traffic is shown, slow while only
+    other viewers are shown, and polling pauses while no viewer is shown. When the Fritz!Box is unreachable, the data
+    is marked as stale and connecting is retried with exponential backoff.
+    """
+    TOPIC: Topic[FritzBoxData] = Topic('fritz_box')
+
+    FAST_INTERVAL: timedelta = timedelta(seconds=3)
+    SLOW_INTERVAL: timedelta = timedelta(seconds=30)
+    MIN_BACKOFF: timedelta = timedelta(seconds=5)
+    MAX_BACKOFF: timedelta = timedelta(minutes=5)
+    TIMEOUT: float = 10
+    LINK_INTERVAL: timedelta = timedelta(seconds=30)
+    HOSTS_INTERVAL: timedelta = timedelta(seconds=10)
+    ADDRESS_INTERVAL: timedelta = timedelta(minutes=5)
+
+    WIFI_INTERFACE_TYPE = '802.11'
+
+    _ANSWERED_ERRORS = (ActionError, ServiceError, FritzArgumentError, FritzLookUpError)
+    """Errors that the Fritz!Box answered with, so the connection itself still works."""
+
     _address: str
+    _port: Optional[int]
     _password: str
-    _listeners: List[Callable[[FritzBoxData], None]]
-    _listeners_mutex: Lock
+    _data_bus: DataBus
     _data_mutex: Lock
     _running: bool = True
-    _status_queue: 'Queue[TaskParameters]'
-    _hosts_queue: 'Queue[TaskParameters]'
+    _tick_queue: 'Queue[TaskParameters]'
+    _connection: Optional[FritzConnection] = None
+    _viewers: List[Viewer]
+    _last_poll: Optional[datetime] = None
+    _retry_at: Optional[datetime] = None
+    _failures: int = 0
+    _last_updates: Dict[str, datetime]
+    _round_trips: int = 0
     current_data: Optional[FritzBoxData] = None
 
-    def __init__(self, scheduler: Scheduler, address: str, password: str):
+    def __init__(self, scheduler: Scheduler, data_bus: DataBus, address: str, password: str,
+                 port: Optional[int] = None):
+        """
+        :param port: TR-064 port of the Fritz!Box. If None, the default port is used.
+        """
         self._address = address
+        self._port = port
         self._password = password
-        self._listeners = []
-        self._listeners_mutex = Lock()
+        self._data_bus = data_bus
         self._data_mutex = Lock()
+        self._viewers = []
+        self._last_updates = {}
         self.current_data = FritzBoxData()
-        self._status_queue = Queue(maxsize=1)
-        scheduler.schedule_to_queue(timedelta(seconds=3), self._status_queue)
-        Thread(target=self._poll_status_loop, daemon=True).start()
-        self._hosts_queue = Queue(maxsize=1)
-        scheduler.schedule_to_queue(timedelta(seconds=10), self._hosts_queue)
-        Thread(target=self._poll_hosts_loop, daemon=True).start()
-
-    def _poll_status_loop(self):
-        try:
-            fritz_connection = FritzConnection(address=self._address, password=self._password)
-        except FritzConnectionException:
-            # Error is logged by FritzConnection
-            return
+        self._tick_queue = Queue(maxsize=1)
+        scheduler.schedule_to_queue(timedelta(seconds=1), self._tick_queue)
+        Thread(target=self._poll_loop, daemon=True).start()
+
+    def add_viewer(self, shows_traffic: bool = False) -> Viewer:
+        """
+        Registers something that displays the data, to adapt the poll interval.
+        :param shows_traffic: If True, the data is polled fast while the viewer is shown.
+        :return: The viewer, whose shown flag has to be kept up to date.
+        """
+        viewer = Viewer(shows_traffic)
+        self._viewers.append(viewer)
+        return viewer
+
+    def _poll_interval(self) -> Optional[timedelta]:
+        """
+        :return: The current poll interval, or None if polling is paused.
+        """
+        shown = [viewer.shows_traffic for viewer in list(self._viewers) if viewer.shown]
+        if any(shown):
+            return FritzBox.FAST_INTERVAL
+        if shown:
+            return FritzBox.SLOW_INTERVAL
+        return None
+
+    def _poll_loop(self):
         while self._running:
-            try:
-                status = FritzStatus(fc=fritz_connection)
-                with self._data_mutex:
-                    self.current_data.is_linked = status.is_linked
-                    self.current_data.is_connected = status.is_connected
-                    self.current_data.external_ip = status.external_ip
-                    self.current_data.external_ipv6 = status.external_ipv6
-                    self.current_data.max_bit_rate = status.max_bit_rate
-                    self.current_data.transmission_rate = status.transmission_rate
-                    self.current_data.bytes_sent = status.bytes_sent
-                    self.current_data.bytes_received = status.bytes_received
-            except IOError as e:
-                log.warning(f"Failed to get FritzBox data: {e}")
-
-            self._notify_listeners()
-            self._status_queue.get()
-
-    def _poll_hosts_loop(self):
+            now = datetime.now()
+            interval = self._poll_interval()
+            if interval and (not self._last_poll or self._last_poll + interval <= now) \
+                    and (not self._retry_at or self._retry_at <= now):
+                self._poll_once(now)
+            self._tick_queue.get()
+
+    def _poll_once(self, now: datetime):
+        self._last_poll = now
+        round_trips = self._round_trips
         try:
-            fritz_connection = FritzConnection(address=self._address, password=self._password)
-        except FritzConnectionException:
-            # Error is logged by FritzConnection
-            return
-        while self._running:
+            if not self._connection:
+                self._connection = FritzConnection(address=self._address, port=self._port, password=self._password,
+                                                   timeout=FritzBox.TIMEOUT)
+            data = self._poll(replace(self.current_data, stale=False))
+            if self._failures:
+                log.info("FritzBox is reachable again.")
+            self._failures = 0
+            self._retry_at = None
+        except Exception as e:
+            # Unexpected errors, like a KeyError for an answer without an expected value, must not end the poll loop.
+            if not isinstance(e, FritzBox._ANSWERED_ERRORS):
+                # Connect again on the next attempt, a reused connection would keep failing after the Fritz!Box
+                # rebooted.
+                self._connection = None
+            self._failures += 1
+            delay = min(FritzBox.MIN_BACKOFF * 2 ** (self._failures - 1), FritzBox.MAX_BACKOFF)
+            # Jitter, so several clients don't retry in lockstep after the router rebooted.
+            delay *= random.uniform(0.5, 1)
+            self._retry_at = now + delay
+            if isinstance(e, (IOError, FritzConnectionException)):
+                log.warning(f"Failed to get FritzBox data, retrying in {delay.total_seconds():.0f} s: {e}")
+            else:
+                log.error(f"Unexpected answer of FritzBox, retrying in {delay.total_seconds():.0f} s.", exc_info=True)
+            data = replace(self.current_data, stale=True)
+        log.verbose(f"Polled FritzBox with {self._round_trips - round_trips} round trips.")
+        with self._data_mutex:
+            self.current_data = data
+        self._notify_listeners()
+
+    def _poll(self, data: FritzBoxData) -> FritzBoxData:
+        """
+        :param data: Copy of the current data, which is updated.
+        :return: data
+        """
+        now = datetime.now()
+        data.poll_time = now.timestamp()
+        counters = self._call('WANCommonIFC1', 'GetAddonInfos')
+        data.transmission_rate = (counters['NewByteSendRate'], counters['NewByteReceiveRate'])
+        data.bytes_sent = int(counters.get('NewX_AVM_DE_TotalBytesSent64', counters['NewTotalBytesSent']))
+        data.bytes_received = int(counters.get('NewX_AVM_DE_TotalBytesReceived64', counters['NewTotalBytesReceived']))
+
+        is_connected = self._call('WANIPConn1', 'GetStatusInfo')['NewConnectionStatus'] == 'Connected'
+        connection_changed = is_connected != data.is_connected
+        data.is_connected = is_connected
+
+        if self._due('link', FritzBox.LINK_INTERVAL, now):
+            link = self._call('WANCommonIFC1', 'GetCommonLinkProperties')
+            data.is_linked = link['NewPhysicalLinkStatus'] == 'Up'
+            data.max_bit_rate = (link['NewLayer1UpstreamMaxBitRate'], link['NewLayer1DownstreamMaxBitRate'])
+            self._last_updates['link'] = now
+
+        if connection_changed or self._due('address', FritzBox.ADDRESS_INTERVAL, now):
+            data.external_ip = self._call('WANIPConn1', 'GetExternalIPAddress')['NewExternalIPAddress']
             try:
-                hosts = FritzHosts(fc=fritz_connection)
-                wlan = FritzWLAN(fc=fritz_connection)
-                active_hosts = len(hosts.get_active_hosts())
-                with self._data_mutex:
-                    self.current_data.wifi_hosts = wlan.total_host_number
-                    self.current_data.lan_hosts = active_hosts - self.current_data.wifi_hosts
-            except IOError as e:
-                log.warning(f"Failed to get FritzBox data: {e}")
-
-            self._notify_listeners()
-            self._hosts_queue.get()
+                data.external_ipv6 = self._call('WANIPConn1',
+                                                'X_AVM_DE_GetExternalIPv6Address')['NewExternalIPv6Address']
+            except (FritzActionError, FritzServiceError):
+                data.external_ipv6 = None
+            self._last_updates['address'] = now
+
+        if self._due('hosts', FritzBox.HOSTS_INTERVAL, now):
+            # One action for the path of the host list and one request for the list itself.
+            self._round_trips += 2
+            hosts = FritzHosts(fc=self._connection).get_hosts_attributes()
+            active = [host for host in hosts if host.get('Active') in (True, 1, '1')]
+            data.wifi_hosts = sum(1 for host in active if host.get('InterfaceType') == FritzBox.WIFI_INTERFACE_TYPE)
+            data.lan_hosts = len(active) - data.wifi_hosts
+            self._last_updates['hosts'] = now
+        return data
+
+    def _due(self, name: str, interval: timedelta, now: datetime) -> bool:
+        """
+        :return: True if the values called name were not successfully updated within interval.
+        """
+        last_update = self._last_updates.get(name)
+        return not last_update or last_update + interval <= now
+
+    def _call(self, service: str, action: str) -> Dict[str, Any]:
+        self._round_trips += 1
+        return self._connection.call_action(service, action)
+
+    @property
+    def round_trips(self) -> int:
+        """
+        :return: Number of requests sent to the Fritz!Box so far.
+        """
+        return self._round_trips
 
     def add_listener(self, listener: Callable[[FritzBoxData], None]):
-        with self._listeners_mutex:
-            self._listeners.append(listener)
+        """
+        :param listener: Called on the thread that delivers the data bus.
+        """
+        self._data_bus.subscribe(FritzBox.TOPIC, listener)
 
     def _notify_listeners(self):
-        with self._listeners_mutex:
-            for listener in self._listeners:
-                # noinspection PyBroadException
-                try:
-                    listener(self.current_data)
-                except Exception:
-                    log.error("Exception in FritzBox listener.", exc_info=True)
+        with self._data_mutex:
+            data = replace(self.current_data)
+        self._data_bus.publish(FritzBox.TOPIC, data)
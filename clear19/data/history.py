@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import logging
+import math
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Tuple, List, Optional, Sequence
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    Fixed size ring buffer of time stamped rows.
+    Every row is written twice, at its index and capacity rows behind it, so the latest rows are always a contiguous
+    part of the array and can be read as a view without copying.
+    The buffer can be backed by memory mapped files, so its rows survive restarts.
+    """
+    _capacity: int
+    _times: np.ndarray
+    _values: np.ndarray
+    _state: np.ndarray
+    """Index of the next row and number of rows, stored in an array so it is persisted with the rows."""
+
+    def __init__(self, capacity: int, shape: Tuple[int, ...], path: Optional[Path] = None):
+        """
+        :param capacity: Maximum number of rows. Older rows are overwritten.
+        :param shape: Shape of a row.
+        :param path: If set, the buffer is stored in memory mapped files with this path and the suffixes .times.npy,
+                     .values.npy and .state.npy. Existing files with the same capacity and shape are continued.
+        """
+        self._capacity = capacity
+        shapes = ((2 * capacity,), (2 * capacity,) + shape, (2,))
+        dtypes = (np.float64, np.float64, np.int64)
+        arrays = self._open(path, shapes, dtypes) if path else None
+        if arrays:
+            self._times, self._values, self._state = arrays
+        else:
+            self._times, self._values, self._state = (np.zeros(s, d) for s, d in zip(shapes, dtypes))
+
+    @staticmethod
+    def _open(path: Path, shapes: Sequence[Tuple[int, ...]], dtypes: Sequence[type]) \
+            -> Optional[Tuple[np.ndarray, ...]]:
+        """
+        :return: Memory mapped arrays for times, values and state, or None if the files can't be used.
+        """
+        files = [path.with_name(f'{path.name}.{name}.npy') for name in ('times', 'values', 'state')]
+        try:
+            path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+            if all(file.exists() for file in files):
+                arrays = [np.load(str(file), mmap_mode='r+') for file in files]
+                if all(a.shape == s and a.dtype == d for a, s, d in zip(arrays, shapes, dtypes)):
+                    return tuple(arrays)
+                log.info(f"Discarding history {path} with different shape.")
+            return tuple(np.lib.format.open_memmap(str(file), 'w+', d, s) for file, s, d in zip(files, shapes, dtypes))
+        except (OSError, ValueError):
+            log.error(f'Failed to open history "{path}". Keeping it in memory only.', exc_info=True)
+            return None
+
+    def flush(self):
+        """
+        Writes the rows to the files, if the buffer is memory mapped.
+        """
+        for array in (self._times, self._values, self._state):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def append(self, time: float, values: np.ndarray):
+        """
+        :param time: Time stamp of the row, not before the time stamp of the last row.
+        :param values: Row with the shape that was given to the constructor.
+        """
+        for i in (self._next, self._next + self._capacity):
+            self._times[i] = time
+            self._values[i] = values
+        self._state[0] = (self._next + 1) % self._capacity
+        self._state[1] = min(self._count + 1, self._capacity)
+
+    def view(self, since: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The returned arrays are views into the buffer. They are overwritten when the buffer wrapped around.
+        :param since: If set, only rows with this time stamp or later are returned.
+        :return: Time stamps and rows, oldest first.
+        """
+        end = self._next + self._capacity
+        start = end - self._count
+        times = self._times[start:end]
+        if since is not None:
+            start += int(np.searchsorted(times, since))
+        return self._times[start:end], self._values[start:end]
+
+    @property
+    def _next(self) -> int:
+        return int(self._state[0])
+
+    @property
+    def _count(self) -> int:
+        return int(self._state[1])
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+
+def decimate(times: np.ndarray, values: np.ndarray, start: float, end: float, buckets: int) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reduces sorted samples to the minimum and maximum per bucket, e.g. one bucket per pixel of a graph, so drawing
+    doesn't depend on the number of samples.
+    :param times: Sorted time stamps.
+    :param values: Samples with shape (len(times), columns).
+    :param start: Start of the first bucket.
+    :param end: End of the last bucket.
+    :param buckets: Number of buckets of equal length between start and end.
+    :return: Indices of the buckets that contain samples, and minimum and maximum of each of these buckets with shape
+             (len(indices), columns).
+    """
+    first = int(np.searchsorted(times, start, side='left'))
+    last = int(np.searchsorted(times, end, side='right'))
+    times = times[first:last]
+    values = values[first:last]
+    if not len(times):
+        return np.empty(0, dtype=int), np.empty((0,) + values.shape[1:]), np.empty((0,) + values.shape[1:])
+    indices = np.minimum(((times - start) * (buckets / (end - start))).astype(int), buckets - 1)
+    indices, starts = np.unique(indices, return_index=True)
+    return indices, np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+
+class History:
+    """
+    History of a fixed number of values at several resolutions with constant memory.
+    The first resolution stores the samples as they are. Coarser resolutions store the mean, minimum and maximum of
+    fixed time buckets and are updated incrementally, whenever a bucket of the next finer resolution is complete.
+    """
+    DEFAULT_RESOLUTIONS: Sequence[Tuple[timedelta, timedelta]] = ((timedelta(seconds=1), timedelta(minutes=5)),
+                                                                  (timedelta(seconds=10), timedelta(hours=1)),
+                                                                  (timedelta(minutes=1), timedelta(hours=24)))
+
+    @dataclass
+    class Window:
+        """
+        Part of a history. All arrays are views into the ring buffers of the history.
+        """
+        resolution: timedelta
+        times: np.ndarray
+        """Time stamps of the samples, or start of the buckets, as seconds since the epoch."""
+        mean: np.ndarray
+        """Values with shape (len(times), columns)."""
+        min: np.ndarray
+        max: np.ndarray
+
+    @dataclass
+    class _Bucket:
+        start: float
+        count: int
+        sum: np.ndarray
+        min: np.ndarray
+        max: np.ndarray
+
+    _columns: int
+    _resolutions: List[float]
+    _buffers: List[RingBuffer]
+    _buckets: List[Optional[History._Bucket]]
+
+    def __init__(self, columns: int, resolutions: Sequence[Tuple[timedelta, timedelta]] = DEFAULT_RESOLUTIONS):
+        """
+        :param columns: Number of values per sample.
+        :param resolutions: Pairs of resolution and kept duration, finest first. The finest resolution should match
+                            the sample rate.
+        """
+        self._columns = columns
+        self._resolutions = [resolution.total_seconds() for resolution, _ in resolutions]
+        self._buffers = [RingBuffer(math.ceil(duration / resolution), (1 if i == 0 else 3, columns))
+                         for i, (resolution, duration) in enumerate(resolutions)]
+        self._buckets = [None] * len(resolutions)
+
+    def append(self, time: float, values: Sequence[float]):
+        """
+        :param time: Time stamp of the sample as seconds since the epoch, not before the last sample.
+        :param values: One value per column.
+        """
+        values = np.asarray(values, dtype=float)
+        self._buffers[0].append(time, values[np.newaxis])
+        self._aggregate(1, time, 1, values, values, values)
+
+    def _aggregate(self, level: int, time: float, count: int, total: np.ndarray, minimum: np.ndarray,
+                   maximum: np.ndarray):
+        """
+        Adds a sample or a completed bucket of the finer level to the current bucket of level.
+        """
+        if level >= len(self._buffers):
+            return
+        start = time - time % self._resolutions[level]
+        bucket = self._buckets[level]
+        if bucket and bucket.start != start:
+            self._buffers[level].append(bucket.start, np.stack((bucket.sum / bucket.count, bucket.min, bucket.max)))
+            self._aggregate(level + 1, bucket.start, bucket.count, bucket.sum, bucket.min, bucket.max)
+            bucket = None
+        if bucket:
+            bucket.count += count
+            bucket.sum += total
+            np.minimum(bucket.min, minimum, out=bucket.min)
+            np.maximum(bucket.max, maximum, out=bucket.max)
+        else:
+            self._buckets[level] = self._Bucket(start, count, total.copy(), minimum.copy(), maximum.copy())
+
+    def window(self, duration: timedelta) -> History.Window:
+        """
+        :param duration: Length of the window up to the last sample.
+        :return: Samples of the finest resolution that keeps the whole duration, including the bucket in which the
+                 window starts. Buckets that are not complete yet are not included.
+        """
+        seconds = duration.total_seconds()
+        level = next((i for i, (resolution, buffer) in enumerate(zip(self._resolutions, self._buffers))
+                      if resolution * buffer.capacity >= seconds), len(self._buffers) - 1)
+        buffer = self._buffers[level]
+        times, _ = self._buffers[0].view()
+        since = (times[-1] if len(times) else 0) - seconds
+        if level:
+            since -= since % self._resolutions[level]
+        times, values = buffer.view(since)
+        mean = values[:, 0]
+        return History.Window(timedelta(seconds=self._resolutions[level]), times, mean,
+                              values[:, 1] if level else mean, values[:, 2] if level else mean)
+
+    @property
+    def columns(self) -> int:
+        return self._columns
+
+    @property
+    def latest(self) -> Optional[np.ndarray]:
+        """
+        :return: The last sample or None.
+        """
+        _, values = self._buffers[0].view()
+        return values[-1, 0] if len(values) else None
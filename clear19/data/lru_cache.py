@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Generic, TypeVar, Callable, Optional, Hashable
+
+log = logging.getLogger(__name__)
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LruCache(Generic[K, V]):
+    """
+    Thread safe least recently used cache that is bounded by the total size of its values.
+    Entries can have a time to live after which they are dropped.
+    """
+    @dataclass
+    class Statistics:
+        hits: int = 0
+        misses: int = 0
+        evictions: int = 0
+        """Entries dropped to stay within the size budget."""
+        expirations: int = 0
+        """Entries dropped because their time to live passed."""
+        size: int = 0
+        """Current total size of all values."""
+        entries: int = 0
+
+    @dataclass
+    class _Entry:
+        value: V
+        size: int
+        date: datetime
+        expires: Optional[datetime]
+
+    _max_size: int
+    _size_of: Callable[[V], int]
+    _entries: OrderedDict[K, _Entry]
+    _size: int = 0
+    _statistics: Statistics
+    _lock: Lock
+
+    def __init__(self, max_size: int, size_of: Callable[[V], int] = len):
+        """
+        :param max_size: Maximum total size of all values. Least recently used entries are evicted to stay below.
+        :param size_of: Determines the size of a value, by default its length in bytes.
+        """
+        self._max_size = max_size
+        self._size_of = size_of
+        self._entries = OrderedDict()
+        self._statistics = LruCache.Statistics()
+        self._lock = Lock()
+
+    def get(self, key: K, max_age: Optional[timedelta] = None) -> Optional[V]:
+        """
+        :param key: Key of the entry.
+        :param max_age: If set, entries that were stored longer ago are treated as missing and dropped.
+        :return: The cached value or None.
+        """
+        now = datetime.now()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._expired(entry, now, max_age):
+                self._remove(key)
+                self._statistics.expirations += 1
+                entry = None
+            if not entry:
+                self._statistics.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._statistics.hits += 1
+            return entry.value
+
+    def peek(self, key: K) -> Optional[V]:
+        """
+        :return: The cached value or None. Neither changes the order of the entries nor the statistics.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.value if entry and not self._expired(entry, datetime.now()) else None
+
+    def date(self, key: K) -> Optional[datetime]:
+        """
+        :return: When the value of the entry was stored, or None if there is no such entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.date if entry else None
+
+    def put(self, key: K, value: V, ttl: Optional[timedelta] = None, date: Optional[datetime] = None):
+        """
+        Stores a value. Values that are larger than the whole budget are not stored.
+        :param key: Key of the entry.
+        :param value: Value to store.
+        :param ttl: Time to live. If set, the entry is dropped after this time.
+        :param date: When the value was created. Defaults to now.
+        """
+        size = self._size_of(value)
+        if date is None:
+            date = datetime.now()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self._max_size:
+                log.debug(f"Not caching {key}: {size} bytes exceed the cache size of {self._max_size} bytes.")
+                return
+            while self._size + size > self._max_size:
+                self._remove(next(iter(self._entries)))
+                self._statistics.evictions += 1
+            self._entries[key] = LruCache._Entry(value, size, date, date + ttl if ttl is not None else None)
+            self._size += size
+
+    def pop(self, key: K) -> Optional[V]:
+        """
+        Removes an entry.
+        :return: The value of the removed entry or None.
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._remove(key).value
+            return None
+
+    def expire(self) -> int:
+        """
+        Removes all entries whose time to live passed.
+        :return: The number of removed entries.
+        """
+        now = datetime.now()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+            for key in expired:
+                self._remove(key)
+            self._statistics.expirations += len(expired)
+            return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size: int):
+        with self._lock:
+            self._max_size = max_size
+            while self._size > self._max_size:
+                self._remove(next(iter(self._entries)))
+                self._statistics.evictions += 1
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def statistics(self) -> LruCache.Statistics:
+        """
+        :return: A snapshot of the statistics.
+        """
+        with self._lock:
+            return replace(self._statistics, size=self._size, entries=len(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return self.peek(key) is not None
+
+    def _remove(self, key: K) -> _Entry:
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+        return entry
+
+    @staticmethod
+    def _expired(entry: _Entry, now: datetime, max_age: Optional[timedelta] = None) -> bool:
+        if entry.expires is not None and entry.expires < now:
+            return True
+        return max_age is not None and entry.date + max_age < now
@@ -1,18 +1,18 @@
-import datetime
 import logging
-import re
+import math
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from threading import Thread, Lock
+from datetime import datetime
+from threading import Thread, Condition
 from typing import Dict, Optional, Callable, List
 
 import dbus
 from _dbus_glib_bindings import DBusGMainLoop
 from dbus import Bus
+from dbus.lowlevel import HANDLER_RESULT_NOT_YET_HANDLED, Message
 from dbus.mainloop import NativeMainLoop
-from dbus.proxies import ProxyObject
 from gi.repository import GLib
 
+from clear19.data.data_bus import DataBus, Topic
 from clear19.scheduler import Scheduler
 
 log = logging.getLogger(__name__)
@@ -34,136 +34,289 @@ class Track:
 class KnownPosition:
     position: float  # In seconds
     time: datetime
+    rate: float = 1.0
 
     def current_position(self):
         past = datetime.now() - self.time
-        return self.position + past.seconds + past.microseconds / 1000000
+        return self.position + (past.seconds + past.microseconds / 1000000) * self.rate
 
 
 @dataclass()
 class PlayState:
     track: Track
     playing: bool
+    player_name: Optional[str] = None
 
 
-class MediaPlayer:
+class PlaybackClock:
     """
-    Reads data about media players from dbus.
+    Calls subscribers exactly when the playback position reaches a position at which their display changes, e.g. the
+    next displayed second or the next pixel of a progress bar. The time until then is calculated from the known
+    position and rate, so the clock thread sleeps in between, and entirely while the player is paused.
     """
-    _listeners: List[Callable[[PlayState], None]]
-    _listeners_mutex: Lock
-
-    _session_bus_loop: NativeMainLoop
-    _session_bus: Bus
-
-    _current_conn: Optional[ProxyObject] = None
-    _connected_conns: List[ProxyObject]
-    _conn_names: Dict[str, str]
-    _current_player_name: Optional[str] = None
-
-    _current_track: Optional[Track] = None
-    _playing: bool = None
+    @dataclass(eq=False)
+    class Subscription:
+        topic: Topic[float]
+        next_change: Callable[[Optional[Track], float], Optional[float]]
+        """Gets the track and the current position and returns the next position at which the subscriber has to be
+        called, or None if it doesn't have to be called until the state of the player changes."""
+        next_position: Optional[float] = None
+
+    EPSILON: float = 0.001
+    """Seconds the clock wakes up after a deadline, so positions are not rounded to the value before the change."""
+
+    _data_bus: DataBus
+    _subscriptions: List[Subscription]
+    _condition: Condition
+    _thread: Optional[Thread] = None
+    _track: Optional[Track] = None
     _position: Optional[KnownPosition] = None
+    _playing: bool = False
+    _changed: bool = True
 
-    def __init__(self, scheduler: Scheduler):
-        self._listeners = []
-        self._listeners_mutex = Lock()
-
-        self._conn_names = {}
+    def __init__(self, data_bus: DataBus):
+        self._data_bus = data_bus
+        self._subscriptions = []
+        self._condition = Condition()
 
-        self._session_bus_loop = DBusGMainLoop(set_as_default=True)
-        self._session_bus = dbus.SessionBus()
-
-        self._connected_conns = []
-        self._read_current_status()
-
-        loop = GLib.MainLoop()
-        # noinspection PyUnresolvedReferences
-        Thread(target=loop.run, daemon=True).start()
-
-        scheduler.schedule_synchronous(timedelta(seconds=1), self._update_connections)
-
-    def _update_connections(self, _):
-        self._get_connection()
+    @staticmethod
+    def next_boundary(position: float, step: float, offset: float = 0.0) -> float:
+        """
+        :return: The first position after position that is offset plus a multiple of step.
+        """
+        return offset + (math.floor((position - offset) / step) + 1) * step
+
+    def subscribe(self, listener: Callable[[float], None],
+                  next_change: Callable[[Optional[Track], float], Optional[float]]):
+        """
+        :param listener: Gets the current position. Called on the thread that delivers the data bus, when the position
+                         returned by next_change is reached and whenever the state of the player changed.
+        :param next_change: Gets the track and the current position and returns the next position at which listener
+                            has to be called, or None. Called on the clock thread.
+        """
+        subscription = PlaybackClock.Subscription(Topic(f'media_player.position.{len(self._subscriptions)}'),
+                                                  next_change)
+        self._data_bus.subscribe(subscription.topic, listener)
+        with self._condition:
+            self._subscriptions.append(subscription)
+            self._changed = True
+            if not self._thread:
+                self._thread = Thread(target=self._run, name='PlaybackClock', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def update(self, track: Optional[Track], position: Optional[KnownPosition], playing: bool):
+        """
+        Called by the media player whenever the track, position, rate or play state changes. All subscribers are
+        called with the new position.
+        """
+        with self._condition:
+            if track == self._track and position is self._position and playing == self._playing:
+                return
+            self._track = track
+            self._position = position
+            self._playing = playing
+            self._changed = True
+            self._condition.notify()
 
-    def _get_connection(self) -> Optional[ProxyObject]:
-        conns = []
-        for conn_name in self._session_bus.list_names():
-            if re.match('org.mpris.MediaPlayer2.', conn_name):
-                conn = self._session_bus.get_object(conn_name, "/org/mpris/MediaPlayer2")
-                conns.append(conn)
-                self._conn_names[conn.bus_name] = conn_name[23:]
+    def _current_position(self) -> float:
+        if not self._position:
+            return 0
+        if self._playing:
+            return self._position.current_position()
+        return self._position.position
+
+    def _run(self):
+        with self._condition:
+            while True:
+                position = self._current_position()
+                rate = self._position.rate if self._position and self._playing else 0
+                wait = None
+                for subscription in self._subscriptions:
+                    if self._changed or subscription.next_position is None \
+                            or (rate > 0 and position >= subscription.next_position):
+                        if self._changed or subscription.next_position is not None:
+                            self._data_bus.publish(subscription.topic, position, force=True)
+                        subscription.next_position = subscription.next_change(self._track, position)
+                    if rate > 0 and subscription.next_position is not None:
+                        seconds = max(0.0, (subscription.next_position - position) / rate)
+                        wait = seconds if wait is None else min(wait, seconds)
+                self._changed = False
+                self._condition.wait(None if wait is None else wait + PlaybackClock.EPSILON)
 
-        if not conns:
-            connection = None
 
-        elif len(conns) == 1:
-            connection = conns[0]
+class MediaPlayer:
+    """
+    Reads data about media players from dbus.
+    Players are found by NameOwnerChanged signals, their state is read once with GetAll and then kept up to date by
+    PropertiesChanged and Seeked signals. So no D-Bus calls are made while nothing changes.
+    """
+    PLAY_STATE_TOPIC: Topic[PlayState] = Topic('media_player.play_state')
+
+    BUS_NAME_PREFIX = 'org.mpris.MediaPlayer2.'
+    OBJECT_PATH = '/org/mpris/MediaPlayer2'
+    PLAYER_INTERFACE = 'org.mpris.MediaPlayer2.Player'
+    PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+
+    _NAME_OWNER_CHANGED_RULE = "type='signal',sender='org.freedesktop.DBus',interface='org.freedesktop.DBus'," \
+                               "member='NameOwnerChanged',path='/org/freedesktop/DBus'," \
+                               "arg0namespace='org.mpris.MediaPlayer2'"
+
+    @dataclass(eq=False)
+    class _Player:
+        name: str
+        """Name of the player, i.e. the bus name without prefix."""
+        owner: str
+        """Unique bus name of the player, which is the sender of its signals."""
+        track: Optional[Track] = None
+        playing: bool = False
+        position: Optional[KnownPosition] = None
+
+    _data_bus: DataBus
+
+    _session_bus_loop: Optional[NativeMainLoop] = None
+    _session_bus: Bus
 
+    _players: Dict[str, _Player]
+    """Known players by their unique bus name. Only changed on the thread of the main loop."""
+    _current_player: Optional[_Player] = None
+    _clock: PlaybackClock
+
+    # noinspection PyUnusedLocal
+    def __init__(self, scheduler: Scheduler, data_bus: DataBus, bus: Optional[Bus] = None):
+        """
+        :param bus: Bus on which the players are searched, e.g. the connection to a private dbus-daemon. The caller
+                    has to run the main loop of the bus. If None, the session bus is used and a GLib main loop is run
+                    on a daemon thread.
+        """
+        self._data_bus = data_bus
+        self._players = {}
+        self._clock = PlaybackClock(data_bus)
+
+        if bus:
+            self._session_bus = bus
         else:
-            playing_conns = []
-            for conn in conns:
-                playing = str(conn.Get('org.mpris.MediaPlayer2.Player', 'PlaybackStatus',
-                                       dbus_interface='org.freedesktop.DBus.Properties')) == 'Playing'
-                if playing:
-                    playing_conns.append(conn)
-
-            if playing_conns:
-                conns = playing_conns
-
-            if self._current_conn and self._current_conn.bus_name in map(lambda b: b.bus_name, conns):
-                connection = self._current_conn
-            else:
-                connection = conns[0]
-
-        if not self.comp_conns(self._current_conn, connection):
-            self._current_conn = connection
-            if connection and connection.bus_name not in map(lambda b: b.bus_name, self._connected_conns):
-                connection.connect_to_signal("PropertiesChanged", self._handle_properties_changed)
-                self._connected_conns.append(connection)
-            self._read_current_status(connection)
-
-        return connection
+            self._session_bus_loop = DBusGMainLoop(set_as_default=True)
+            self._session_bus = dbus.SessionBus()
+
+        # Subscribe before listing the names, so no player that appears in between is missed.
+        # add_signal_receiver only supports exact argument matches, so the rule for name changes is added directly.
+        # With arg0namespace, the bus daemon only sends changes of player names, and other clients coming and going
+        # don't wake this process.
+        self._session_bus.add_message_filter(self._filter_name_owner_changed)
+        self._session_bus.add_match_string(MediaPlayer._NAME_OWNER_CHANGED_RULE)
+        self._session_bus.add_signal_receiver(self._handle_properties_changed, 'PropertiesChanged',
+                                              MediaPlayer.PROPERTIES_INTERFACE, None, MediaPlayer.OBJECT_PATH,
+                                              sender_keyword='sender')
+        self._session_bus.add_signal_receiver(self._handle_seeked, 'Seeked', MediaPlayer.PLAYER_INTERFACE, None,
+                                              MediaPlayer.OBJECT_PATH, sender_keyword='sender')
+        for name in self._session_bus.list_names():
+            if name.startswith(MediaPlayer.BUS_NAME_PREFIX):
+                self._add_player(str(name), str(self._session_bus.get_name_owner(name)))
+
+        if not bus:
+            loop = GLib.MainLoop()
+            # noinspection PyUnresolvedReferences
+            Thread(target=loop.run, daemon=True).start()
+
+    # noinspection PyUnusedLocal
+    def _filter_name_owner_changed(self, connection: Bus, message: Message) -> int:
+        if message.is_signal('org.freedesktop.DBus', 'NameOwnerChanged') \
+                and message.get_sender() == 'org.freedesktop.DBus':
+            self._handle_name_owner_changed(*message.get_args_list())
+        return HANDLER_RESULT_NOT_YET_HANDLED
+
+    def _handle_name_owner_changed(self, name: str, old_owner: str, new_owner: str):
+        # arg0namespace also matches the name org.mpris.MediaPlayer2 itself.
+        if not name.startswith(MediaPlayer.BUS_NAME_PREFIX):
+            return
+        if old_owner:
+            self._remove_player(str(old_owner))
+        if new_owner:
+            self._add_player(str(name), str(new_owner))
+
+    def _add_player(self, name: str, owner: str):
+        if owner in self._players:
+            return
+        player = MediaPlayer._Player(name[len(MediaPlayer.BUS_NAME_PREFIX):], owner)
+        self._players[owner] = player
+        log.debug(f"Found media player {player.name}.")
+        proxy = self._session_bus.get_object(owner, MediaPlayer.OBJECT_PATH, introspect=False)
+        proxy.GetAll(MediaPlayer.PLAYER_INTERFACE, dbus_interface=MediaPlayer.PROPERTIES_INTERFACE,
+                     reply_handler=lambda properties: self._handle_get_all(player, properties),
+                     error_handler=lambda e: log.warning(f"Failed to read the state of media player {player.name}: "
+                                                         f"{e}"))
+
+    def _remove_player(self, owner: str):
+        player = self._players.pop(owner, None)
+        if player:
+            log.debug(f"Media player {player.name} disappeared.")
+            self._update_current_player()
+
+    def _handle_get_all(self, player: _Player, properties: dbus.Dictionary):
+        if self._players.get(player.owner) is not player:
+            return
+        self._update_player(player, properties)
+        self._update_current_player()
+
+    def _handle_properties_changed(self, interface: str, changed: dbus.Dictionary, _, sender: str = None):
+        player = self._players.get(sender)
+        if player and interface == MediaPlayer.PLAYER_INTERFACE:
+            self._update_player(player, changed)
+            self._update_current_player()
+
+    def _handle_seeked(self, position: int, sender: str = None):
+        player = self._players.get(sender)
+        if player:
+            rate = player.position.rate if player.position else 1.0
+            player.position = KnownPosition(float(position) / 1000000, datetime.now(), rate)
+            self._notify_listeners(force=True)
 
     @staticmethod
-    def comp_conns(a: ProxyObject, b: ProxyObject):
-        if not a and not b:
-            return True
-        if a and not b or b and not a:
-            return False
-        return a.bus_name == b.bus_name
-
-    def _read_current_status(self, conn: ProxyObject = None, data: Optional[dbus.Dictionary] = None) -> Optional[Track]:
-        metadata = None
-        play_state = None
-        position = None
-        if data and 'Metadata' in data:
-            metadata = data['Metadata']
-        if data and 'PlaybackStatus' in data:
-            play_state = str(data['PlaybackStatus']) == 'Playing'
-        if data and 'Position' in data:
-            position = float(data['Position']) / 1000000
-
-        if not metadata or not play_state:
-            if not conn:
-                conn = self._get_connection()
-            if conn:
-                props_iface = dbus.Interface(conn, dbus_interface='org.freedesktop.DBus.Properties')
-                if not metadata:
-                    metadata = props_iface.Get('org.mpris.MediaPlayer2.Player', 'Metadata')
-                if not play_state:
-                    play_state = str(props_iface.Get('org.mpris.MediaPlayer2.Player', 'PlaybackStatus')) == 'Playing'
-                if not position:
-                    try:
-                        position = float(props_iface.Get('org.mpris.MediaPlayer2.Player', 'Position')) / 1000000
-                    except dbus.exceptions.DBusException:
-                        pass
-
-        self.current_track = self._read_metadata(metadata)
-        self._set_playing(play_state)
-        if position:
-            self._position = KnownPosition(position, datetime.now())
-        return self.current_track
+    def _update_player(player: _Player, properties: dbus.Dictionary):
+        """
+        Applies changed properties of the player interface to the player.
+        Players don't signal changes of the position while playing, so the position is extrapolated from the last known
+        position and rebased whenever the play state, the rate or the track changes.
+        """
+        position = player.position.position if player.position else 0
+        if player.position and player.playing:
+            position = player.position.current_position()
+        rate = player.position.rate if player.position else 1.0
+        rebase = player.position is None
+        if 'Metadata' in properties:
+            track = MediaPlayer._read_metadata(properties['Metadata'])
+            if track != player.track:
+                player.track = track
+                position = 0
+                rebase = True
+        if 'PlaybackStatus' in properties:
+            playing = str(properties['PlaybackStatus']) == 'Playing'
+            if playing != player.playing:
+                player.playing = playing
+                rebase = True
+                log.info(f"{player.name}: {'Playing' if playing else 'Stopped'}")
+        if 'Rate' in properties and float(properties['Rate']) != rate:
+            rate = float(properties['Rate'])
+            rebase = True
+        if 'Position' in properties:
+            position = float(properties['Position']) / 1000000
+            rebase = True
+        if rebase:
+            player.position = KnownPosition(position, datetime.now(), rate)
+
+    def _update_current_player(self):
+        """
+        Selects the player that is shown: The current one, as long as it exists and no other player plays while it
+        doesn't, otherwise the first playing player or any player.
+        """
+        players = list(self._players.values())
+        playing = [p for p in players if p.playing]
+        if playing:
+            players = playing
+        if self._current_player not in players:
+            self._current_player = players[0] if players else None
+        self._notify_listeners()
 
     @staticmethod
     def _read_metadata(metadata: Optional[Dict]) -> Optional[Track]:
@@ -180,60 +333,55 @@ class MediaPlayer:
                      if 'xesam:artist' in metadata else None,
                      float(metadata['xesam:autoRating']) if 'xesam:autoRating' in metadata else None)
 
-    def _handle_properties_changed(self, _, data, _3):
-        self._read_current_status(data=data)
-
     def add_listener(self, listener: Callable[[PlayState], None]):
-        with self._listeners_mutex:
-            self._listeners.append(listener)
-
-    def _notify_listeners(self):
-        with self._listeners_mutex:
-            current_state = self.current_play_state
-            for listener in self._listeners:
-                # noinspection PyBroadException
-                try:
-                    listener(current_state)
-                except Exception:
-                    log.error("Exception in play state listener.", exc_info=True)
+        """
+        :param listener: Called on the thread that delivers the data bus.
+        """
+        self._data_bus.subscribe(MediaPlayer.PLAY_STATE_TOPIC, listener)
+
+    def add_position_listener(self, listener: Callable[[float], None],
+                              next_change: Callable[[Optional[Track], float], Optional[float]]):
+        """
+        Subscribes to the playback clock of the current player, see PlaybackClock.subscribe.
+        """
+        self._clock.subscribe(listener, next_change)
+
+    def _notify_listeners(self, force: bool = False):
+        player = self._current_player
+        if player:
+            self._clock.update(player.track, player.position, player.playing)
+        else:
+            self._clock.update(None, None, False)
+        self._data_bus.publish(MediaPlayer.PLAY_STATE_TOPIC, self.current_play_state, force)
 
     @property
-    def current_track(self) -> Track:
-        return self._current_track
-
-    @current_track.setter
-    def current_track(self, current_track: Track):
-        if self._current_track != current_track:
-            self._current_track = current_track
-            self._position = KnownPosition(0, datetime.now())
-            self._notify_listeners()
+    def current_track(self) -> Optional[Track]:
+        player = self._current_player
+        return player.track if player else None
 
     @property
     def playing(self) -> bool:
-        return self._playing
-
-    def _set_playing(self, playing: bool):
-        if self._playing != playing:
-            self._position = KnownPosition(self.current_position, datetime.now())
-            self._playing = playing
-            log.info("Playing" if playing else "Stopped")
-            self._notify_listeners()
+        player = self._current_player
+        return player.playing if player else False
 
     @property
     def current_play_state(self) -> PlayState:
-        return PlayState(self.current_track, self.playing)
+        player = self._current_player
+        if player:
+            return PlayState(player.track, player.playing, player.name)
+        return PlayState(None, False)
 
     @property
     def current_position(self) -> float:
-        if not self._position:
+        player = self._current_player
+        if not player or not player.position:
             return 0
-        if self.playing:
-            return self._position.current_position()
+        if player.playing:
+            return player.position.current_position()
         else:
-            return self._position.position
+            return player.position.position
 
     @property
     def current_player_name(self) -> Optional[str]:
-        if self._current_conn:
-            return self._conn_names[self._current_conn.bus_name]
-        return None
+        player = self._current_player
+        return player.name if player else None
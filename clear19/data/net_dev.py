@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+from dataclasses import replace
+from datetime import timedelta
+from typing import Callable, List, Optional, Tuple, Dict
+
+import numpy as np
+
+from clear19.data.data_bus import DataBus, Topic
+from clear19.data.fritzbox import FritzBoxData, Viewer
+from clear19.scheduler import Scheduler
+
+log = logging.getLogger(__name__)
+
+
+class NetDev:
+    """
+    Measures the network traffic of this machine from /proc/net/dev, as a local alternative to polling a Fritz!Box.
+    The file is read once per second and the rates of all interfaces are calculated at once. The sum of the selected
+    interfaces is published as FritzBoxData with the traffic values, so the Fritz!Box traffic widgets can show it.
+    """
+    TOPIC: Topic[FritzBoxData] = Topic('net_dev')
+
+    FAST_INTERVAL: timedelta = timedelta(seconds=1)
+
+    _proc_path: str
+    _sys_path: str
+    _data_bus: DataBus
+    _interfaces: Optional[List[str]]
+    _viewers: List[Viewer]
+    _names: List[str]
+    _selected: np.ndarray
+    """Mask of the interfaces that are added up."""
+    _max_bit_rate: Optional[Tuple[int, int]] = None
+    _bytes: Optional[np.ndarray] = None
+    """Received and sent bytes per interface at the last sample."""
+    _rates: np.ndarray
+    """Received and sent bytes per second per interface."""
+    _last_sample: Optional[float] = None
+    current_data: FritzBoxData
+
+    def __init__(self, scheduler: Scheduler, data_bus: DataBus, interfaces: Optional[List[str]] = None,
+                 proc_path: str = '/proc', sys_path: str = '/sys'):
+        """
+        :param interfaces: Interfaces whose traffic is added up. If None, all physical interfaces are used.
+        """
+        self._proc_path = proc_path
+        self._sys_path = sys_path
+        self._data_bus = data_bus
+        self._interfaces = interfaces
+        self._viewers = []
+        self._names = []
+        self._selected = np.zeros(0, dtype=bool)
+        self._rates = np.zeros((0, 2))
+        self.current_data = FritzBoxData()
+        scheduler.schedule_synchronous(NetDev.FAST_INTERVAL, self._update)
+
+    def add_listener(self, listener: Callable[[FritzBoxData], None]):
+        """
+        :param listener: Called on the thread that delivers the data bus.
+        """
+        self._data_bus.subscribe(NetDev.TOPIC, listener)
+
+    def add_viewer(self, shows_traffic: bool = False) -> Viewer:
+        """
+        Registers something that displays the data. The file is not read while no viewer is shown.
+        :param shows_traffic: Only for compatibility with FritzBox, the file is always read every second.
+        :return: The viewer, whose shown flag has to be kept up to date.
+        """
+        viewer = Viewer(shows_traffic)
+        self._viewers.append(viewer)
+        return viewer
+
+    def _update(self, _=None):
+        if self._viewers and not any(viewer.shown for viewer in list(self._viewers)):
+            return
+        poll_time = time.time()
+        try:
+            names, counters = self._read()
+        except OSError as e:
+            log.warning(f"Failed to read network traffic: {e}")
+            self._publish(replace(self.current_data, stale=True))
+            return
+        now = time.monotonic()
+        if self._bytes is not None and names == self._names and now > self._last_sample:
+            delta = counters - self._bytes
+            # Counters of an interface that was recreated start again at 0.
+            self._rates = np.where(delta >= 0, delta, 0) / (now - self._last_sample)
+        else:
+            self._rates = np.zeros(counters.shape)
+            if names != self._names:
+                self._select(names)
+        self._bytes = counters
+        self._last_sample = now
+
+        received, sent = counters[self._selected].sum(axis=0)
+        rate_received, rate_sent = self._rates[self._selected].sum(axis=0)
+        self._publish(replace(self.current_data, transmission_rate=(round(rate_sent), round(rate_received)),
+                              bytes_sent=int(sent), bytes_received=int(received), max_bit_rate=self._max_bit_rate,
+                              poll_time=poll_time, stale=False))
+
+    def _publish(self, data: FritzBoxData):
+        self.current_data = data
+        self._data_bus.publish(NetDev.TOPIC, replace(data))
+
+    def _read(self) -> Tuple[List[str], np.ndarray]:
+        """
+        :return: Names of the interfaces and their received and sent bytes.
+        """
+        with open(os.path.join(self._proc_path, 'net/dev'), 'rb') as file:
+            # The first two lines are headers.
+            lines = file.read().splitlines()[2:]
+        names = []
+        fields = []
+        for line in lines:
+            name, _, values = line.partition(b':')
+            names.append(name.strip().decode())
+            fields.append(values.split())
+        if not fields:
+            return names, np.zeros((0, 2), dtype=np.int64)
+        # Received bytes are the first field, sent bytes the ninth.
+        return names, np.array(fields, dtype=np.int64)[:, [0, 8]]
+
+    def _select(self, names: List[str]):
+        """
+        Selects the interfaces that are added up and reads their link speed. Called when the interfaces changed.
+        """
+        self._names = names
+        if self._interfaces is not None:
+            selected = [name in self._interfaces for name in names]
+        else:
+            # Physical interfaces have a device, virtual ones like lo, bridges and veth don't.
+            selected = [os.path.exists(os.path.join(self._sys_path, 'class/net', name, 'device')) for name in names]
+        self._selected = np.array(selected, dtype=bool)
+        total = 0
+        for name, is_selected in zip(names, selected):
+            if not is_selected:
+                continue
+            try:
+                with open(os.path.join(self._sys_path, 'class/net', name, 'speed')) as file:
+                    speed = int(file.read())
+            except (OSError, ValueError):
+                continue
+            if speed > 0:
+                total += speed * 1000000
+        self._max_bit_rate = (total, total) if total else None
+
+    @property
+    def rates(self) -> Dict[str, Tuple[float, float]]:
+        """
+        :return: Received and sent bytes per second of every interface.
+        """
+        return {name: (float(rx), float(tx)) for name, (rx, tx) in zip(self._names, self._rates)}
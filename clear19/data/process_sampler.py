@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Optional
+
+log = logging.getLogger(__name__)
+
+
+class ProcessSampler:
+    """
+    Measures the CPU usage of all processes by reading /proc/<pid>/stat only.
+    Process names are read once per process, the CPU usage is calculated from the consumed jiffies since the last
+    sample.
+    """
+    @dataclass
+    class _Process:
+        name: str
+        start_time: int
+        """Start time of the process in jiffies after boot. Distinguishes processes that reuse a PID."""
+        jiffies: int
+
+    COMM_LENGTH: int = 15
+    """Maximum length of the name in /proc/<pid>/stat. Longer names are read from /proc/<pid>/cmdline."""
+
+    _proc_path: str
+    _clock_ticks: int
+    _processes: Dict[int, ProcessSampler._Process]
+    _last_sample: Optional[float] = None
+
+    def __init__(self, proc_path: str = '/proc'):
+        self._proc_path = proc_path
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+        self._processes = {}
+
+    def sample(self) -> List[Tuple[str, float]]:
+        """
+        :return: Name and CPU usage in percent of one core of every process since the last sample. The usage is 0 on
+                 the first sample.
+        """
+        now = time.monotonic()
+        interval = (now - self._last_sample) * self._clock_ticks if self._last_sample else None
+        self._last_sample = now
+        old_processes = self._processes
+        processes = {}
+        result = []
+        with os.scandir(self._proc_path) as entries:
+            for entry in entries:
+                if not entry.name.isdigit():
+                    continue
+                pid = int(entry.name)
+                stat = self._read_stat(pid)
+                if not stat:
+                    continue
+                comm, start_time, jiffies = stat
+                old = old_processes.get(pid)
+                if old and old.start_time == start_time:
+                    process = old
+                    usage = (jiffies - old.jiffies) / interval * 100 if interval else 0.0
+                    process.jiffies = jiffies
+                else:
+                    process = self._Process(self._name(pid, comm), start_time, jiffies)
+                    usage = 0.0
+                processes[pid] = process
+                result.append((process.name, usage))
+        self._processes = processes
+        return result
+
+    def top(self, n: int) -> List[Tuple[str, float]]:
+        """
+        Takes a sample and selects the busiest processes.
+        :param n: Maximum number of processes.
+        :return: Name and CPU usage of the n busiest processes, sorted by CPU usage, descending.
+        """
+        return heapq.nlargest(n, self.sample(), key=lambda p: p[1])
+
+    def _read_stat(self, pid: int) -> Optional[Tuple[str, int, int]]:
+        """
+        :return: Name, start time and consumed user and system jiffies of the process, or None if it vanished.
+        """
+        try:
+            with open(f'{self._proc_path}/{pid}/stat', 'rb') as file:
+                stat = file.read()
+        except OSError:
+            return None
+        # The name is in parentheses and may contain spaces and parentheses itself.
+        name_end = stat.rfind(b')')
+        fields = stat[name_end + 2:].split()
+        # Fields after the name start with field 3 (state). utime is field 14, stime 15 and starttime 22.
+        return (stat[stat.find(b'(') + 1:name_end].decode(errors='replace'), int(fields[19]),
+                int(fields[11]) + int(fields[12]))
+
+    def _name(self, pid: int, comm: str) -> str:
+        """
+        :return: The name of the process. Like psutil, names truncated by the kernel are completed from the command
+                 line.
+        """
+        if len(comm) < self.COMM_LENGTH:
+            return comm
+        try:
+            with open(f'{self._proc_path}/{pid}/cmdline', 'rb') as file:
+                cmdline = file.read().split(b'\0')
+        except OSError:
+            return comm
+        if cmdline and cmdline[0]:
+            name = os.path.basename(cmdline[0].decode(errors='replace'))
+            if name.startswith(comm):
+                return name
+        return comm
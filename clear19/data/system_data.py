@@ -1,69 +1,106 @@
+import logging
+import os
+import time
 from datetime import timedelta
-from threading import Lock
-from typing import List, Callable, Type, Tuple, Dict
+from typing import List, Callable, Type, Tuple, Union, Optional
 
+import numpy as np
 import psutil
-from psutil import NoSuchProcess, Process
 
+from clear19.data.cgroup_sampler import CgroupSampler
+from clear19.data.data_bus import DataBus, Topic
+from clear19.data.history import History
+from clear19.data.process_sampler import ProcessSampler
 from clear19.scheduler import Scheduler
 
+log = logging.getLogger(__name__)
+
 
 class SystemData:
     """
     Reads system performance data.
+    Keeps a history of the CPU, memory and swap usage and of the load average at several resolutions.
+    Samples are published to the data bus, the listeners are called on the thread that delivers the bus.
     """
     CpuTimes: Type = psutil._pslinux.scputimes
     MemStats: Type = psutil._ntuples.svmem
 
+    CPU_TOPIC: Topic[CpuTimes] = Topic('system_data.cpu')
+    PER_CPU_TOPIC: Topic[np.ndarray] = Topic('system_data.per_cpu')
+    MEM_TOPIC: Topic[MemStats] = Topic('system_data.mem')
+    PROCESS_TOPIC: Topic[List[Tuple[str, float]]] = Topic('system_data.processes')
+
     _cpu_times_percent: CpuTimes = None
+    _per_cpu_times: Optional[np.ndarray] = None
+    _per_cpu_percent: np.ndarray
     _process_cpu_percent: List[Tuple[str, float]]
 
-    _cpu_listeners: List[Callable[[CpuTimes], None]]
-    _cpu_listeners_lock: Lock
-    _mem_listeners: List[Callable[[MemStats], None]]
-    _mem_listeners_lock: Lock
-    _process_listeners: List[Callable[[List[Tuple[str, float]]], None]]
-    _process_listeners_lock: Lock
-
-    _processes: Dict[int, Process]
-
-    def __init__(self, scheduler: Scheduler):
-        self._cpu_listeners = []
-        self._cpu_listeners_lock = Lock()
-        self._mem_listeners = []
-        self._mem_listeners_lock = Lock()
-        self._process_listeners = []
-        self._process_listeners_lock = Lock()
-        self._processes = {}
+    _data_bus: DataBus
+
+    _process_sampler: Union[ProcessSampler, CgroupSampler]
+    _process_count: int
+
+    _cpu_history: History
+    _mem_history: History
+    _swap_history: History
+    _load_history: History
+
+    def __init__(self, scheduler: Scheduler, data_bus: DataBus, process_count: int = 20,
+                 aggregate_cgroups: bool = False):
+        """
+        :param scheduler: Used to update the data every second.
+        :param data_bus: Receives the samples.
+        :param process_count: Number of the busiest processes that are reported to process listeners.
+        :param aggregate_cgroups: If True, process listeners get the CPU usage per systemd unit or container instead of
+                                  per process. Requires cgroup v2.
+        """
+        self._data_bus = data_bus
+        if aggregate_cgroups and CgroupSampler.find_root():
+            self._process_sampler = CgroupSampler()
+        else:
+            if aggregate_cgroups:
+                log.warning("cgroup v2 is not available. Listing single processes.")
+            self._process_sampler = ProcessSampler()
+        self._process_count = process_count
+        self._cpu_history = History(1 + psutil.cpu_count())
+        self._mem_history = History(1)
+        self._swap_history = History(1)
+        self._load_history = History(3)
         scheduler.schedule_synchronous(timedelta(seconds=1), self._update_1)
-        scheduler.schedule_synchronous(timedelta(seconds=10), self._update_10)
         self._update_1()
-        self._update_10()
 
     def _update_1(self, _=None):
         self._cpu_times_percent = psutil.cpu_times_percent()
+        self._per_cpu_percent = self._sample_per_cpu()
         self._mem_stats = psutil.virtual_memory()
-        self._fire_cpu_update(self._cpu_times_percent)
-        self._fire_mem_update(self._mem_stats)
-
-    def _update_10(self, _=None):
-        process_cpu_percent = []
-        old_processes = self._processes
-        new_processes = {}
-        for pid in psutil.pids():
-            if pid in old_processes:
-                p = old_processes.pop(pid)
-            else:
-                try:
-                    p = psutil.Process(pid)
-                except NoSuchProcess:
-                    p = None
-            if p:
-                process_cpu_percent.append((p.name(), p.cpu_percent()))
-                new_processes[pid] = p
-        self._processes = new_processes
-        self._process_cpu_percent = process_cpu_percent
-        self._fire_process_update(process_cpu_percent)
+        self._process_cpu_percent = self._process_sampler.top(self._process_count)
+        now = time.time()
+        self._cpu_history.append(now, np.concatenate(([100 - self._cpu_times_percent.idle], self._per_cpu_percent)))
+        self._mem_history.append(now, [self._mem_stats.percent])
+        self._swap_history.append(now, [psutil.swap_memory().percent])
+        self._load_history.append(now, os.getloadavg())
+        self._data_bus.publish(SystemData.CPU_TOPIC, self._cpu_times_percent)
+        self._data_bus.publish(SystemData.PER_CPU_TOPIC, self._per_cpu_percent)
+        self._data_bus.publish(SystemData.MEM_TOPIC, self._mem_stats)
+        self._data_bus.publish(SystemData.PROCESS_TOPIC, self._process_cpu_percent)
+
+    def _sample_per_cpu(self) -> np.ndarray:
+        """
+        :return: Used CPU in percent of every core since the last call.
+        """
+        times = np.array(psutil.cpu_times(percpu=True))
+        last_times = self._per_cpu_times
+        self._per_cpu_times = times
+        if last_times is None or last_times.shape != times.shape:
+            return np.zeros(len(times))
+        delta = times - last_times
+        # Guest times are already included in user and nice.
+        fields = SystemData.CpuTimes._fields
+        total = delta[:, :fields.index('guest')].sum(axis=1) if 'guest' in fields else delta.sum(axis=1)
+        idle = delta[:, fields.index('idle')] + delta[:, fields.index('iowait')]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = np.where(total > 0, (total - idle) / total * 100, 0)
+        return np.clip(percent, 0, 100)
 
     @property
     def cpu_times_percent(self) -> CpuTimes:
@@ -73,37 +110,64 @@ class SystemData:
     def cpu_count(self) -> int:
         return psutil.cpu_count()
 
+    @property
+    def per_cpu_percent(self) -> np.ndarray:
+        """
+        :return: Used CPU in percent of every core.
+        """
+        return self._per_cpu_percent
+
     @property
     def mem_stats(self) -> MemStats:
         return self._mem_stats
 
     @property
     def process_cpu_percent(self) -> List[Tuple[str, float]]:
+        """
+        :return: Name and CPU usage in percent of the busiest processes, or units if cgroups are aggregated, sorted by
+                 CPU usage, descending.
+        """
         return self._process_cpu_percent
 
+    @property
+    def cpu_history(self) -> History:
+        """
+        :return: Used CPU in percent, the total in the first column and one column per core.
+        """
+        return self._cpu_history
+
+    @property
+    def mem_history(self) -> History:
+        """
+        :return: Used memory in percent.
+        """
+        return self._mem_history
+
+    @property
+    def swap_history(self) -> History:
+        """
+        :return: Used swap in percent.
+        """
+        return self._swap_history
+
+    @property
+    def load_history(self) -> History:
+        """
+        :return: Load average over 1, 5 and 15 minutes.
+        """
+        return self._load_history
+
     def add_cpu_listener(self, listener: Callable[[CpuTimes], None]):
-        with self._cpu_listeners_lock:
-            self._cpu_listeners.append(listener)
+        self._data_bus.subscribe(SystemData.CPU_TOPIC, listener)
 
-    def _fire_cpu_update(self, data: CpuTimes):
-        with self._cpu_listeners_lock:
-            for listener in self._cpu_listeners:
-                listener(data)
+    def add_per_cpu_listener(self, listener: Callable[[np.ndarray], None]):
+        """
+        :param listener: Gets the used CPU in percent of every core.
+        """
+        self._data_bus.subscribe(SystemData.PER_CPU_TOPIC, listener)
 
     def add_mem_listener(self, listener: Callable[[MemStats], None]):
-        with self._mem_listeners_lock:
-            self._mem_listeners.append(listener)
-
-    def _fire_mem_update(self, data: MemStats):
-        with self._mem_listeners_lock:
-            for listener in self._mem_listeners:
-                listener(data)
+        self._data_bus.subscribe(SystemData.MEM_TOPIC, listener)
 
     def add_process_listener(self, listener: Callable[[List[Tuple[str, float]]], None]):
-        with self._process_listeners_lock:
-            self._process_listeners.append(listener)
-
-    def _fire_process_update(self, data: List[Tuple[str, float]]):
-        with self._process_listeners_lock:
-            for listener in self._process_listeners:
-                listener(data)
+        self._data_bus.subscribe(SystemData.PROCESS_TOPIC, listener)
@@ -0,0 +1,142 @@
+"""
+Weather data from a small JSON document, e.g. served by own sensors:
+
+{
+    "location": "Garden",
+    "periods": [
+        {"start": "2026-10-19T14:00:00", "end": "2026-10-19T15:00:00", "temp": 12.5, "humidity": 71},
+        {"start": 1792418400, "temp": 12.1, "pop": 20, "rainfall": 0.2}
+    ]
+}
+
+Times are ISO 8601 strings or POSIX timestamps. "end" defaults to one hour after "start". All other keys of a period
+are optional and named like the fields of WeatherPeriod; unknown keys are ignored. Periods with malformed values are
+skipped.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Optional, Callable, Union, Dict, Any
+
+from clear19.data.download_manager import DownloadManager
+from clear19.data.wetter_com import WeatherProvider, WeatherData, WeatherPeriod
+
+log = logging.getLogger(__name__)
+
+
+class TempValues(WeatherProvider):
+    """
+    Loads weather data from the JSON document configured as Weather.temp_values.
+    The document is only parsed again when its content changed.
+    """
+    _url: str
+    _download_manager: DownloadManager
+    _lifetime: timedelta
+    _digest: Optional[bytes] = None
+    _data: Optional[WeatherData] = None
+    _data_lock: Lock
+
+    def __init__(self, url: str, download_manager: DownloadManager, lifetime: timedelta = timedelta(minutes=1)):
+        """
+        :param url: URL of the JSON document.
+        :param download_manager: Used to fetch the document.
+        :param lifetime: Time after which the document is fetched again.
+        """
+        self._url = url
+        self._download_manager = download_manager
+        self._lifetime = lifetime
+        self._data_lock = Lock()
+
+    def load_weather(self, callback: Optional[Callable[[WeatherData], None]]) -> Optional[WeatherData]:
+        content = self._download_manager.get(self._url, lambda c: self._on_downloaded(c, callback), self._lifetime,
+                                             stale_while_revalidate=True)
+        try:
+            return self._update(content)
+        except ValueError:
+            log.error(f"Error when parsing '{self._url}'.", exc_info=True)
+
+    def _on_downloaded(self, content: Optional[bytes], callback: Optional[Callable[[WeatherData], None]]):
+        try:
+            data = self._update(content)
+        except ValueError:
+            log.error(f"Error when parsing '{self._url}'.", exc_info=True)
+            return
+        if callback:
+            callback(data)
+
+    def _update(self, content: Optional[bytes]) -> Optional[WeatherData]:
+        """
+        :return: The parsed data. If the content didn't change, the previously parsed data.
+        """
+        if not content:
+            return None
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        with self._data_lock:
+            if digest == self._digest:
+                return self._data
+        data = self.parse_json(content)
+        with self._data_lock:
+            self._digest = digest
+            self._data = data
+        return data
+
+    @staticmethod
+    def parse_json(content: Union[str, bytes]) -> Optional[WeatherData]:
+        """
+        Converts the JSON document to WeatherData. Periods are built while the document is decoded, as soon as the
+        object with the "periods" list is complete.
+        :raises ValueError: If the document is malformed.
+        """
+        if not content:
+            return None
+        data = json.loads(content, object_hook=_decode_object)
+        if not isinstance(data, WeatherData):
+            raise ValueError('JSON document does not contain a "periods" list.')
+        return data
+
+
+def _decode_object(o: Dict[str, Any]) -> Union[WeatherData, Dict[str, Any]]:
+    if 'periods' not in o:
+        return o
+    if not isinstance(o['periods'], list):
+        raise ValueError('"periods" is not a list.')
+    periods = []
+    for entry in o['periods']:
+        if not isinstance(entry, dict) or 'start' not in entry:
+            raise ValueError('Every entry of "periods" needs a "start" time.')
+        try:
+            periods.append(_decode_period(entry))
+        except (ValueError, TypeError, OverflowError, OSError) as e:
+            # A single broken record shall not discard the whole document.
+            log.warning(f"Skipping malformed period {entry}: {e}")
+    periods.sort(key=lambda wp: wp.start)
+    data = WeatherData(str(o.get('location', '')))
+    data.periods = periods
+    return data
+
+
+def _decode_period(o: Dict[str, Any]) -> WeatherPeriod:
+    start = _parse_time(o['start'])
+    end = _parse_time(o['end']) if 'end' in o else start + timedelta(hours=1)
+    wp = WeatherPeriod(start, end)
+    for key in ('short_text', 'long_text', 'icon', 'wind_direction'):
+        if key in o:
+            setattr(wp, key, str(o[key]))
+    for key in ('temp', 'pop', 'rainfall', 'wind_speed', 'wind_squall_speed', 'pressure', 'humidity',
+                'cloudiness'):
+        if key in o:
+            setattr(wp, key, float(o[key]))
+    return wp
+
+
+def _parse_time(value: Union[str, int, float]) -> datetime:
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    t = datetime.fromisoformat(value)
+    if t.tzinfo:
+        t = t.astimezone().replace(tzinfo=None)
+    return t
@@ -2,9 +2,13 @@ from __future__ import annotations
 
 import logging
 import re
+from abc import ABC, ABCMeta, abstractmethod
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import List, Callable, Optional, Union
+from html.parser import HTMLParser
+from typing import List, Callable, Optional, Union, Dict, Tuple, Sequence, Iterable
+
+import numpy as np
 
 # noinspection PyUnresolvedReferences
 from bs4 import BeautifulSoup, Tag
@@ -64,16 +68,172 @@ class WeatherPeriod:
         return c
 
 
+class WeatherSeries:
+    """
+    Hourly forecast data stored column wise in NumPy arrays.
+    Windows of consecutive periods are aggregated with cumulative sums, with the same rules as WeatherPeriod.__add__.
+    """
+    _MEAN_COLUMNS = ('temp', 'wind_speed', 'pressure', 'humidity', 'cloudiness')
+
+    start: np.ndarray  # POSIX timestamps
+    end: np.ndarray  # POSIX timestamps
+    temp: np.ndarray
+    pop: np.ndarray
+    rainfall: np.ndarray
+    wind_speed: np.ndarray
+    wind_squall_speed: np.ndarray
+    pressure: np.ndarray
+    humidity: np.ndarray
+    cloudiness: np.ndarray
+    short_text: List[str]
+    long_text: List[str]
+    icon: List[str]
+    wind_direction: List[str]
+
+    def __init__(self, periods: Sequence[WeatherPeriod] = ()):
+        def column(attribute: str) -> np.ndarray:
+            return np.fromiter((getattr(wp, attribute) for wp in periods), dtype=np.float64, count=len(periods))
+
+        self.start = np.fromiter((wp.start.timestamp() for wp in periods), dtype=np.float64, count=len(periods))
+        self.end = np.fromiter((wp.end.timestamp() for wp in periods), dtype=np.float64, count=len(periods))
+        for attribute in ('temp', 'pop', 'rainfall', 'wind_speed', 'wind_squall_speed', 'pressure', 'humidity',
+                          'cloudiness'):
+            setattr(self, attribute, column(attribute))
+        self.short_text = [wp.short_text for wp in periods]
+        self.long_text = [wp.long_text for wp in periods]
+        self.icon = [wp.icon for wp in periods]
+        self.wind_direction = [wp.wind_direction for wp in periods]
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, WeatherSeries):
+            return NotImplemented
+        return all(np.array_equal(getattr(self, a), getattr(other, a))
+                   for a in ('start', 'end', 'temp', 'pop', 'rainfall', 'wind_speed', 'wind_squall_speed',
+                             'pressure', 'humidity', 'cloudiness')) \
+            and self.short_text == other.short_text and self.long_text == other.long_text \
+            and self.icon == other.icon and self.wind_direction == other.wind_direction
+
+    def period(self, i: int) -> WeatherPeriod:
+        """
+        :return: The hourly period at index i as WeatherPeriod.
+        """
+        return WeatherPeriod(datetime.fromtimestamp(self.start[i]), datetime.fromtimestamp(self.end[i]),
+                             self.short_text[i], self.long_text[i], self.icon[i], float(self.temp[i]),
+                             float(self.pop[i]), float(self.rainfall[i]), self.wind_direction[i],
+                             float(self.wind_speed[i]), float(self.wind_squall_speed[i]), float(self.pressure[i]),
+                             float(self.humidity[i]), float(self.cloudiness[i]))
+
+    def periods(self) -> List[WeatherPeriod]:
+        """
+        :return: All hourly periods as WeatherPeriod objects.
+        """
+        return [self.period(i) for i in range(len(self))]
+
+    def aggregate(self, bounds: Sequence[int]) -> List[WeatherPeriod]:
+        """
+        Combines consecutive periods into windows.
+        :param bounds: Strictly increasing indices. Window k covers the periods bounds[k] to bounds[k + 1] - 1.
+        :return: One WeatherPeriod per window.
+        """
+        b = np.asarray(bounds, dtype=np.intp)
+        if len(b) < 2:
+            return []
+        if b[0] < 0 or b[-1] > len(self) or np.any(np.diff(b) <= 0):
+            raise ValueError(f'Invalid window bounds for {len(self)} periods: {list(bounds)}')
+        first = b[:-1]
+        last = b[1:] - 1
+
+        duration = self.end - self.start
+        weighted = np.vstack([getattr(self, c) for c in self._MEAN_COLUMNS]) * duration
+        weighted_sums = self._window_sums(weighted, b)
+        means = weighted_sums / self._window_sums(duration, b)
+
+        # Probability that it rains in at least one of the periods: 1 - product of the probabilities that it doesn't.
+        dry = 1 - self.pop / 100
+        certain = dry <= 0
+        dry_log = np.log(np.where(certain, 1, dry))
+        pop = 100 * (1 - np.exp(self._window_sums(dry_log, b)) * (self._window_sums(certain, b) == 0))
+
+        rainfall = self._window_sums(self.rainfall, b)
+        squall = np.maximum.reduceat(self.wind_squall_speed[:b[-1]], first)
+
+        wps = []
+        for k in range(len(first)):
+            f = first[k]
+            strongest = f + int(np.argmax(self.wind_speed[f:last[k] + 1]))
+            wps.append(WeatherPeriod(datetime.fromtimestamp(self.start[f]), datetime.fromtimestamp(self.end[last[k]]),
+                                     self.short_text[f], self.long_text[f], self.icon[f],
+                                     float(means[0, k]), float(pop[k]), float(rainfall[k]),
+                                     self.wind_direction[strongest], float(means[1, k]), float(squall[k]),
+                                     float(means[2, k]), float(means[3, k]), float(means[4, k])))
+        return wps
+
+    def aggregate_sizes(self, sizes: Iterable[int]) -> List[WeatherPeriod]:
+        """
+        Combines consecutive periods into windows of the given sizes, starting with the first period.
+        """
+        return self.aggregate(np.concatenate(([0], np.cumsum(list(sizes), dtype=np.intp))))
+
+    def aggregate_every(self, size: int) -> List[WeatherPeriod]:
+        """
+        Combines consecutive periods into windows of the same size. Periods that don't fill a whole window are dropped.
+        """
+        return self.aggregate(np.arange(0, len(self) + 1, size))
+
+    def aggregate_at(self, times: Sequence[datetime]) -> List[WeatherPeriod]:
+        """
+        Combines periods into windows that are separated at the given times, e.g. at sunrise and sunset.
+        A window contains all periods that start between two consecutive times.
+        """
+        cuts = np.searchsorted(self.start, [t.timestamp() for t in times])
+        return self.aggregate(np.unique(np.clip(cuts, 0, len(self))))
+
+    @staticmethod
+    def _window_sums(values: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+        cumulative = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,))
+        np.cumsum(values, axis=-1, out=cumulative[..., 1:])
+        return cumulative[..., bounds[1:]] - cumulative[..., bounds[:-1]]
+
+
 @dataclass
 class WeatherData:
     """
     Contains forecast data from wetter.com.
     """
     location: str = ''
-    periods: List[WeatherPeriod] = field(default_factory=list)
+    series: WeatherSeries = field(default_factory=WeatherSeries)
+
+    @property
+    def periods(self) -> List[WeatherPeriod]:
+        """
+        :return: The hourly forecast as WeatherPeriod objects.
+        """
+        return self.series.periods()
+
+    @periods.setter
+    def periods(self, periods: Sequence[WeatherPeriod]):
+        self.series = WeatherSeries(periods)
+
+
+class WeatherProvider(ABC):
+    """
+    Base class for sources of WeatherData.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def load_weather(self, callback: Optional[Callable[[WeatherData], None]]) -> Optional[WeatherData]:
+        """
+        Loads the current weather data.
+        :param callback: Called with the new data when it had to be loaded asynchronously.
+        :return: The data if it was available instantly, otherwise None.
+        """
 
 
-class WetterCom:
+class WetterCom(WeatherProvider):
     _location_id: str
     _download_manager: DownloadManager
 
@@ -84,15 +244,42 @@ class WetterCom:
     def load_weather(self, callback: Optional[Callable[[WeatherData], None]]) -> Optional[WeatherData]:
         url = f'https://www.wetter.com/deutschland/{self._location_id}.html'
         wps = self._download_manager.get(url, lambda content: callback(self.parse_html(content) if callback else None),
-                                         timedelta(minutes=9))
+                                         timedelta(minutes=9), stale_while_revalidate=True)
         try:
             return self.parse_html(wps)
         except ValueError as e:
             log.error("Error when parsing Wetter.com.", exc_info=True)
 
-    # noinspection PyTypeChecker
     @staticmethod
     def parse_html(html: Union[str, bytes]) -> Optional[WeatherData]:
+        """
+        Extracts the forecast from a wetter.com page without building a DOM of the whole page.
+        :param html: Content of the wetter.com forecast page.
+        :return: Parsed forecast data or None if no content was given.
+        """
+        if not html:
+            return None
+        if isinstance(html, bytes):
+            html = html.decode('utf-8')
+        extractor = _WetterComExtractor.extract(html)
+
+        data = WeatherData()
+        if extractor.location is not None:
+            data.location = extractor.location
+        else:
+            log.error("Failed to parse location.")
+
+        if extractor.diagram is None:
+            raise ValueError('Forecast table #vhs-detail-diagram not found.')
+        data.periods = _parse_diagram(extractor.diagram, extractor.date or datetime.now())
+        return data
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    def parse_html_soup(html: Union[str, bytes]) -> Optional[WeatherData]:
+        """
+        Reference implementation of parse_html that builds a full BeautifulSoup tree of the page.
+        """
         if not html:
             return None
         if isinstance(html, bytes):
@@ -102,49 +289,194 @@ class WetterCom:
         data = WeatherData()
 
         try:
-            data.location = s.findAll('h2', {'class': 'delta text--white mb--'})[0].text
+            data.location = s.findAll('h2', {'class': _LOCATION_CLASS})[0].text
         except IndexError:
             log.error("Failed to parse location.", exc_info=True)
 
-        t_body: Tag = s.select('#vhs-detail-diagram')[0]
-
-        wps: List[WeatherPeriod] = []
-        for _ in range(24):
-            wps.append(WeatherPeriod())
+        t_body: Tag = s.select(f'#{_DIAGRAM_ID}')[0]
 
         date = None
         for t in s.find_all('h3'):
-            match = re.search('[0-3][0-9]\\.[0-1][0-9]\\.20[0-9][0-9]', t.text)
+            match = _DATE_PATTERN.search(t.text)
             if match:
                 date = datetime.strptime(match[0], "%d.%m.%Y")
                 break
         if not date:
             date = datetime.now()
 
-        # noinspection PyUnresolvedReferences
-        start_hours = int(t_body.contents[5].contents[1].text.strip()[0:2])
-        t = datetime(date.year, date.month, date.day, start_hours, 0, 0)
-        t -= timedelta(hours=1)
-        for wp in wps:
-            wp.start = t
-            t += timedelta(hours=1)
-            wp.end = t
-
-        _parse_row(wps, t_body.contents[9], _parse_weather)
-        _parse_row(wps, t_body.contents[13], _parse_temp)
-        _parse_row(wps, t_body.contents[17], _parse_pop)
-        _parse_row(wps, t_body.contents[21], _parse_rainfall)
-        _parse_row(wps, t_body.contents[27], _parse_wind_speed)
-        _parse_row(wps, t_body.contents[25], _parse_wind_direction)
-        _parse_row(wps, t_body.contents[31], _parse_pressure)
-        _parse_row(wps, t_body.contents[35], _parse_humidity)
-        _parse_row(wps, t_body.contents[39], _parse_cloudiness)
-        data.periods = wps
-
+        data.periods = _parse_diagram(t_body, date)
         return data
 
 
-def _parse_row(wps: List[WeatherPeriod], tr: Tag, job: Callable[[List[WeatherPeriod], int, Tag], None]):
+_LOCATION_CLASS = 'delta text--white mb--'
+_DIAGRAM_ID = 'vhs-detail-diagram'
+_DATE_PATTERN = re.compile('[0-3][0-9]\\.[0-1][0-9]\\.20[0-9][0-9]')
+
+
+class _Text(str):
+    """Text node of the forecast table. Mimics the parts of bs4's NavigableString used by the row parsers."""
+    __slots__ = ()
+    name = None
+
+    @property
+    def text(self) -> str:
+        return str(self)
+
+
+class _Comment(_Text):
+    """Comment in the forecast table. Like bs4's Comment, it takes a position in contents but has no text."""
+    __slots__ = ()
+
+    @property
+    def text(self) -> str:
+        return ''
+
+
+class _Node:
+    """Element of the forecast table. Mimics the parts of bs4's Tag used by the row parsers."""
+    __slots__ = ('name', 'attrs', 'contents')
+
+    name: str
+    attrs: Dict[str, str]
+    contents: List[Union[_Node, _Text]]
+
+    def __init__(self, name: str, attrs: Dict[str, str]):
+        self.name = name
+        self.attrs = attrs
+        self.contents = []
+
+    @property
+    def text(self) -> str:
+        return ''.join(c.text for c in self.contents)
+
+
+class _WetterComExtractor(HTMLParser):
+    """
+    Collects only the location header, the date heading and the forecast table from a wetter.com page.
+    Elements outside of the forecast table are not stored, and parsing stops as soon as everything was found.
+    """
+    _CHUNK_SIZE = 16 * 1024
+    _VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                                'param', 'source', 'track', 'wbr'))
+
+    location: Optional[str] = None
+    date: Optional[datetime] = None
+    diagram: Optional[_Node] = None
+    diagram_closed: bool = False
+
+    _open_nodes: List[_Node]
+    _heading: Optional[str] = None
+    _heading_text: List[str]
+
+    def __init__(self):
+        super().__init__()
+        self._open_nodes = []
+        self._heading_text = []
+
+    @staticmethod
+    def extract(html: str) -> _WetterComExtractor:
+        extractor = _WetterComExtractor()
+        for i in range(0, len(html), _WetterComExtractor._CHUNK_SIZE):
+            extractor.feed(html[i:i + _WetterComExtractor._CHUNK_SIZE])
+            if extractor.done:
+                break
+        else:
+            extractor.close()
+        return extractor
+
+    @property
+    def done(self) -> bool:
+        return self.diagram_closed and self.location is not None and self.date is not None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if self._open_nodes:
+            node = _Node(tag, {k: v or '' for k, v in attrs})
+            self._open_nodes[-1].contents.append(node)
+            if tag not in self._VOID_ELEMENTS:
+                self._open_nodes.append(node)
+        elif self.diagram is None and ('id', _DIAGRAM_ID) in attrs:
+            self.diagram = _Node(tag, {k: v or '' for k, v in attrs})
+            self._open_nodes.append(self.diagram)
+        elif self._heading is None:
+            if tag == 'h2' and self.location is None:
+                if ' '.join((dict(attrs).get('class') or '').split()) == _LOCATION_CLASS:
+                    self._heading = tag
+            elif tag == 'h3' and self.date is None:
+                self._heading = tag
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if self._open_nodes:
+            self._open_nodes[-1].contents.append(_Node(tag, {k: v or '' for k, v in attrs}))
+        else:
+            self.handle_starttag(tag, attrs)
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str):
+        if self._open_nodes:
+            for i in range(len(self._open_nodes) - 1, -1, -1):
+                if self._open_nodes[i].name == tag:
+                    del self._open_nodes[i:]
+                    if not self._open_nodes:
+                        self.diagram_closed = True
+                    break
+        elif tag == self._heading:
+            text = ''.join(self._heading_text)
+            if tag == 'h2':
+                self.location = text
+            else:
+                match = _DATE_PATTERN.search(text)
+                if match:
+                    self.date = datetime.strptime(match[0], "%d.%m.%Y")
+            self._heading = None
+            self._heading_text.clear()
+
+    def handle_data(self, data: str):
+        if self._open_nodes:
+            contents = self._open_nodes[-1].contents
+            if contents and type(contents[-1]) is _Text:
+                contents[-1] = _Text(contents[-1] + data)
+            else:
+                contents.append(_Text(data))
+        elif self._heading:
+            self._heading_text.append(data)
+
+    def handle_comment(self, data: str):
+        # bs4 keeps comments as separate nodes, so they shift the positions of the following nodes in contents.
+        if self._open_nodes:
+            self._open_nodes[-1].contents.append(_Comment(data))
+
+
+TableElement = Union[Tag, _Node]
+
+
+def _parse_diagram(t_body: TableElement, date: datetime) -> List[WeatherPeriod]:
+    wps: List[WeatherPeriod] = []
+    for _ in range(24):
+        wps.append(WeatherPeriod())
+
+    # noinspection PyUnresolvedReferences
+    start_hours = int(t_body.contents[5].contents[1].text.strip()[0:2])
+    t = datetime(date.year, date.month, date.day, start_hours, 0, 0)
+    t -= timedelta(hours=1)
+    for wp in wps:
+        wp.start = t
+        t += timedelta(hours=1)
+        wp.end = t
+
+    _parse_row(wps, t_body.contents[9], _parse_weather)
+    _parse_row(wps, t_body.contents[13], _parse_temp)
+    _parse_row(wps, t_body.contents[17], _parse_pop)
+    _parse_row(wps, t_body.contents[21], _parse_rainfall)
+    _parse_row(wps, t_body.contents[27], _parse_wind_speed)
+    _parse_row(wps, t_body.contents[25], _parse_wind_direction)
+    _parse_row(wps, t_body.contents[31], _parse_pressure)
+    _parse_row(wps, t_body.contents[35], _parse_humidity)
+    _parse_row(wps, t_body.contents[39], _parse_cloudiness)
+    return wps
+
+
+def _parse_row(wps: List[WeatherPeriod], tr: TableElement,
+               job: Callable[[List[WeatherPeriod], int, TableElement], None]):
     i = 0
     for td in tr.contents:
         if td.name == 'td' and i < len(wps):
@@ -152,7 +484,7 @@ def _parse_row(wps: List[WeatherPeriod], tr: Tag, job: Callable[[List[WeatherPer
             i += 1
 
 
-def _parse_weather(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_weather(wps: List[WeatherPeriod], i: int, td: TableElement):
     for img in td.contents:
         if img.name == 'img':
             wps[i].icon = img.attrs['data-single-src']
@@ -160,19 +492,19 @@ def _parse_weather(wps: List[WeatherPeriod], i: int, td: Tag):
             wps[i].long_text = img.attrs['title']
 
 
-def _parse_temp(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_temp(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].temp = int(td.contents[1].contents[1].text)
 
 
-def _parse_pop(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_pop(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].pop = int(td.text)
 
 
-def _parse_rainfall(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_rainfall(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].rainfall = float(td.text)
 
 
-def _parse_wind_direction(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_wind_direction(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].wind_direction = td.contents[2].strip()
     if len(td.contents) > 3:
         try:
@@ -184,17 +516,17 @@ def _parse_wind_direction(wps: List[WeatherPeriod], i: int, td: Tag):
         wps[i].wind_squall_speed = wps[i].wind_speed
 
 
-def _parse_wind_speed(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_wind_speed(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].wind_speed = int(td.text)
 
 
-def _parse_pressure(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_pressure(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].pressure = int(td.text)
 
 
-def _parse_humidity(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_humidity(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].humidity = int(td.text)
 
 
-def _parse_cloudiness(wps: List[WeatherPeriod], i: int, td: Tag):
+def _parse_cloudiness(wps: List[WeatherPeriod], i: int, td: TableElement):
     wps[i].cloudiness = int(td.text.strip()[0])
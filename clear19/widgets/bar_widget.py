@@ -97,7 +97,24 @@ class BarWidget(Widget):
             total += value[0]
         self._values = values
         self._total = total
-        self.dirty = True
+        self.set_render_key(self._pixel_key())
+
+    def _pixel_key(self) -> Tuple:
+        """
+        :return: The pixel at which every value ends and the colors of the values.
+        """
+        if self.orientation in (BarWidget.Orientation.HORIZONTAL_LEFT_TO_RIGHT,
+                                BarWidget.Orientation.HORIZONTAL_RIGHT_TO_LEFT):
+            length = self.width
+        else:
+            length = self.height
+        key = []
+        pos = 0.0
+        for value in self.values:
+            pos += value[0]
+            key.append((round(pos / self._total * length) if self._total else 0,
+                        tuple(value[1]) if value[1] else None))
+        return tuple(key)
 
     @property
     def border(self) -> Optional[Color]:
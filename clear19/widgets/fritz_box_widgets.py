@@ -1,15 +1,18 @@
 import logging
+import math
+import time
 from abc import ABC, ABCMeta, abstractmethod
-from collections import deque
-from dataclasses import dataclass
-from datetime import datetime, timedelta
-from threading import Lock
-from typing import Optional
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional, Tuple, Union
 
 import humanize
+import numpy as np
 from cairocffi import Context
 
-from clear19.data.fritzbox import FritzBox, FritzBoxData
+from clear19.data.fritzbox import FritzBox, FritzBoxData, Viewer
+from clear19.data.history import RingBuffer, decimate
+from clear19.data.net_dev import NetDev
 from clear19.widgets.color import Color
 from clear19.widgets.text_widget import TextWidget, Font
 from clear19.widgets.widget import Widget, ContainerWidget
@@ -18,29 +21,41 @@ log = logging.getLogger(__name__)
 
 class FritzBoxWidget(Widget, ABC):
     """
-    Base class for all media player widgets.
+    Base class for all Fritz!Box widgets.
+    Registers as viewer, so the Fritz!Box is only polled while a widget is shown.
+    The traffic widgets can also show the traffic of this machine from a NetDev provider.
     """
     __metaclass__ = ABCMeta
 
-    _fritz_box_data_provider: FritzBox
+    SHOWS_TRAFFIC: bool = False
+    """If True, the Fritz!Box is polled fast while this widget is shown."""
 
-    def __init__(self, parent: ContainerWidget, fritz_box_data_provider: FritzBox):
-        self._data_mutex = Lock()
+    _fritz_box_data_provider: Union[FritzBox, NetDev]
+    _viewer: Viewer
+
+    def __init__(self, parent: ContainerWidget, fritz_box_data_provider: Union[FritzBox, NetDev]):
         super().__init__(parent)
         self._fritz_box_data_provider = fritz_box_data_provider
         fritz_box_data_provider.add_listener(self.update)
+        self._viewer = fritz_box_data_provider.add_viewer(self.SHOWS_TRAFFIC)
+        self.app.add_shown_listener(self, self._set_shown)
         self.update(fritz_box_data_provider.current_data)
 
+    def _set_shown(self, shown: bool):
+        self._viewer.shown = shown
+
+    def data_color(self, data: FritzBoxData) -> Color:
+        """
+        :return: The foreground color for values of data: Grayed out if they are stale.
+        """
+        return Color.GRAY50 if data.stale else self.parent.foreground
+
     @abstractmethod
     def update(self, data: FritzBoxData):
         pass
 
-    def paint_foreground(self, ctx: Context):
-        with self._data_mutex:
-            super().paint_foreground(ctx)
-
     @property
-    def fritz_box_data_provider(self) -> FritzBox:
+    def fritz_box_data_provider(self) -> Union[FritzBox, NetDev]:
         return self._fritz_box_data_provider
 
 
@@ -51,20 +66,21 @@ class FritzBoxConnectedWidget(FritzBoxWidget, TextWidget):
         self.update(None)
 
     def update(self, data: Optional[FritzBoxData]):
-        with self._data_mutex:
-            if data:
-                if not data.is_linked:
-                    self.text = "Not Linked"
-                    self.foreground = Color.RED
-                elif not data.is_connected:
-                    self.text = "Connecting"
-                    self.foreground = Color.YELLOW
-                else:
-                    self.text = "Connected"
-                    self.foreground = self.parent.foreground
+        if data:
+            if not data.is_linked:
+                self.text = "Not Linked"
+                self.foreground = Color.RED
+            elif not data.is_connected:
+                self.text = "Connecting"
+                self.foreground = Color.YELLOW
             else:
-                self.text = "Unknown"
+                self.text = "Connected"
+                self.foreground = self.parent.foreground
+            if data.stale:
                 self.foreground = Color.GRAY50
+        else:
+            self.text = "Unknown"
+            self.foreground = Color.GRAY50
 
 
 class FritzBoxSpeedWidget(FritzBoxWidget, TextWidget):
@@ -74,15 +90,14 @@ class FritzBoxSpeedWidget(FritzBoxWidget, TextWidget):
         self.update(None)
 
     def update(self, data: Optional[FritzBoxData]):
-        with self._data_mutex:
-            if data:
-                up = f'{round(data.max_bit_rate[0] / 1000000)}Mb'
-                down = f'{round(data.max_bit_rate[1] / 1000000)}Mb'
-                self.text = f'🠕 {up} 🠗 {down}'
-                self.foreground = self.parent.foreground
-            else:
-                self.text = "🠕 Unknown 🠗"
-                self.foreground = Color.GRAY50
+        if data and data.max_bit_rate:
+            up = f'{round(data.max_bit_rate[0] / 1000000)}Mb'
+            down = f'{round(data.max_bit_rate[1] / 1000000)}Mb'
+            self.text = f'🠕 {up} 🠗 {down}'
+            self.foreground = self.data_color(data)
+        else:
+            self.text = "🠕 Unknown 🠗"
+            self.foreground = Color.GRAY50
 
 
 class FritzBoxIp4Widget(FritzBoxWidget, TextWidget):
@@ -92,13 +107,12 @@ class FritzBoxIp4Widget(FritzBoxWidget, TextWidget):
         self.update(None)
 
     def update(self, data: Optional[FritzBoxData]):
-        with self._data_mutex:
-            if data and data.external_ip:
-                self.text = data.external_ip
-                self.foreground = self.parent.foreground
-            else:
-                self.text = '0.0.0.0'
-                self.foreground = Color.GRAY50
+        if data and data.external_ip:
+            self.text = data.external_ip
+            self.foreground = self.data_color(data)
+        else:
+            self.text = '0.0.0.0'
+            self.foreground = Color.GRAY50
 
 
 class FritzBoxIp6Widget(FritzBoxWidget, TextWidget):
@@ -108,13 +122,12 @@ class FritzBoxIp6Widget(FritzBoxWidget, TextWidget):
         self.update(None)
 
     def update(self, data: Optional[FritzBoxData]):
-        with self._data_mutex:
-            if data and data.external_ipv6:
-                self.text = data.external_ipv6
-                self.foreground = self.parent.foreground
-            else:
-                self.text = '::0'
-                self.foreground = Color.GRAY50
+        if data and data.external_ipv6:
+            self.text = data.external_ipv6
+            self.foreground = self.data_color(data)
+        else:
+            self.text = '::0'
+            self.foreground = Color.GRAY50
 
 
 class FritzBoxHostsWidget(FritzBoxWidget, TextWidget):
@@ -124,106 +137,109 @@ class FritzBoxHostsWidget(FritzBoxWidget, TextWidget):
         self.update(None)
 
     def update(self, data: Optional[FritzBoxData]):
-        with self._data_mutex:
-            if data:
-                self.text = f'{data.lan_hosts} LAN, {data.wifi_hosts} WLAN'
-                self.foreground = self.parent.foreground
-            else:
-                self.text = '? LAN, ? WLAN'
-                self.foreground = Color.GRAY50
+        if data:
+            self.text = f'{data.lan_hosts} LAN, {data.wifi_hosts} WLAN'
+            self.foreground = self.data_color(data)
+        else:
+            self.text = '? LAN, ? WLAN'
+            self.foreground = Color.GRAY50
 
 
 class FritzBoxTrafficWidget(FritzBoxWidget, TextWidget):
+    SHOWS_TRAFFIC = True
+
     def __init__(self, parent: ContainerWidget, fritz_box_data_provider: FritzBox, font: Font = Font()):
         FritzBoxWidget.__init__(self, parent, fritz_box_data_provider)
         TextWidget.__init__(self, parent, '🠕 00Mb 🠗 00Mb', font)
         self.update(None)
 
     def update(self, data: Optional[FritzBoxData]):
-        with self._data_mutex:
-            if data and data.transmission_rate:
-                up = humanize.naturalsize(data.transmission_rate[0],
-                                          binary=True, gnu=True, format='%.0f')
-                down = humanize.naturalsize(data.transmission_rate[1],
-                                            binary=True, gnu=True, format='%.0f')
-                self.text = f'🠕 {up} 🠗 {down}'
-                self.foreground = self.parent.foreground
-            else:
-                self.text = "🠕 Unknown 🠗"
-                self.foreground = Color.GRAY50
+        if data and data.transmission_rate:
+            up = humanize.naturalsize(data.transmission_rate[0],
+                                      binary=True, gnu=True, format='%.0f')
+            down = humanize.naturalsize(data.transmission_rate[1],
+                                        binary=True, gnu=True, format='%.0f')
+            self.text = f'🠕 {up} 🠗 {down}'
+            self.foreground = self.data_color(data)
+        else:
+            self.text = "🠕 Unknown 🠗"
+            self.foreground = Color.GRAY50
 
 
 class FritzBoxTrafficGraphWidget(FritzBoxWidget):
-    @dataclass
-    class Measurement:
-        time: datetime
-        up: int
-        down: int
-
-        def __getitem__(self, key: int) -> int:
-            if key == 0:
-                return self.up
-            if key == 1:
-                return self.down
-            raise IndexError('Index must be 0 for UP or 1 for DOWN.')
-
-    def __init__(self, parent: ContainerWidget, fritz_box_data_provider: FritzBox,
-                 time_span: timedelta = timedelta(minutes=1)):
-        self._measurements: deque[FritzBoxTrafficGraphWidget.Measurement] = deque()
-        self._measurements_mutex = Lock()
+    """
+    Graph of the upload and download rate.
+    The rates are kept in a ring buffer, which can be persisted, and are reduced to their minimum and maximum per pixel
+    column when painting, so long time spans are painted as fast as short ones.
+    """
+    SHOWS_TRAFFIC = True
+    FLUSH_INTERVAL: timedelta = timedelta(minutes=1)
+    """Interval in which a persisted history is written to its files."""
+
+    _time_span: timedelta
+    _history: RingBuffer
+    """Time stamps and upload and download rate in bit/s."""
+    _max: Optional[Tuple[int, int]] = None
+    _bar_width: int = 20
+    _last_time: Optional[float] = None
+    _last_bytes: Optional[Tuple[int, int]] = None
+    _last_flush: float = 0
+
+    def __init__(self, parent: ContainerWidget, fritz_box_data_provider: Union[FritzBox, NetDev],
+                 time_span: timedelta = timedelta(minutes=1), history_path: Optional[Path] = None):
+        """
+        :param time_span: Time span shown by the graph.
+        :param history_path: If set, the rates are stored in memory mapped files with this path, see RingBuffer.
+        """
         self._time_span = time_span
-        self._max = (0., 0.)
-        self._bar_width = 20
-        self._last_time: datetime = datetime(1, 1, 1)
-        self._last_up = -1
-        self._last_down = -1
+        self._history = RingBuffer(math.ceil(time_span / fritz_box_data_provider.FAST_INTERVAL) + 1, (2,),
+                                   history_path)
         FritzBoxWidget.__init__(self, parent, fritz_box_data_provider)
 
     def update(self, data: Optional[FritzBoxData]):
-        with self._data_mutex:
-            if data:
-                now = datetime.now()
-                if self._last_up and self._last_up >= 0:
-                    time_diff = (now - self._last_time).total_seconds()
-                    up = int((data.bytes_sent - self._last_up) / time_diff * 8)
-                    down = int((data.bytes_received - self._last_down) / time_diff * 8)
-                    # noinspection PyCallByClass
-                    with self._measurements_mutex:
-                        self._measurements.append(
-                            FritzBoxTrafficGraphWidget.Measurement(now, up, down))
-                        while self._measurements and self._measurements[-1].time < now - self._time_span:
-                            self._measurements.popleft()
-                    self._max = data.max_bit_rate
-
-                self._last_time = now
-                self._last_up = data.bytes_sent
-                self._last_down = data.bytes_received
+        if data and not data.stale and data.bytes_sent is not None:
+            now = data.poll_time or time.time()
+            if self._last_time and now <= self._last_time:
+                return
+            if self._last_bytes:
+                rates = (np.array((data.bytes_sent, data.bytes_received)) - self._last_bytes) \
+                        * 8 / (now - self._last_time)
+                # Counters are reset when the router restarts.
+                if (rates >= 0).all():
+                    self._history.append(now, rates)
+                    self.dirty = True
+            self._max = data.max_bit_rate
+            self._last_time = now
+            self._last_bytes = (data.bytes_sent, data.bytes_received)
+            if now - self._last_flush >= self.FLUSH_INTERVAL.total_seconds():
+                self._history.flush()
+                self._last_flush = now
 
     def paint_foreground(self, ctx: Context):
-        with self._data_mutex:
-            if self._measurements and self._max:
-                sx = (self.width - self._bar_width) / self._time_span.total_seconds()
-                sy = (self.height / self._max[0], self.height / self._max[1])
-                colors = (Color.GREEN, Color.RED)
-                current = self._measurements[-1]
-
-                for i in (1, 0):
-                    current_y = current[i] * sy[i]
-                    ctx.set_source_rgba(*colors[i])
-                    ctx.rectangle(self.width - self._bar_width, self.height - current_y,
-                                  self._bar_width / (2 - i), current_y)
-                    ctx.fill()
-
-                    first = True
-                    with self._measurements_mutex:
-                        for m in self._measurements:
-                            m_x = (self.width - self._bar_width) - (current.time - m.time).total_seconds() * sx
-                            m_y = self.height - m[i] * sy[i]
-                            if first:
-                                ctx.move_to(m_x, m_y)
-                                first = False
-                            else:
-                                ctx.line_to(m_x, m_y)
-
-                    ctx.set_source_rgba(*colors[i])
-                    ctx.stroke()
+        times, rates = self._history.view()
+        graph_width = self.width - self._bar_width
+        columns = max(1, int(graph_width))
+        # The window ends now, so a history that was restored after a pause is not drawn as if it was current.
+        end = time.time()
+        indices, minimum, maximum = decimate(times, rates, end - self._time_span.total_seconds(), end, columns)
+        if not len(indices):
+            return
+        xs = ((indices + 1) * (graph_width / columns)).tolist()
+        # Without a known maximum rate, e.g. for virtual interfaces, the graph is scaled to the shown rates.
+        limits = np.array(self._max, dtype=float) if self._max and all(self._max) else maximum.max(axis=0)
+        scale = self.height / np.where(limits > 0, limits, 1)
+        tops = (self.height - maximum * scale).tolist()
+        bottoms = (self.height - minimum * scale).tolist()
+        colors = (Color.GREEN, Color.RED)
+
+        for i in (1, 0):
+            current_y = rates[-1, i] * scale[i]
+            ctx.set_source_rgba(*colors[i])
+            ctx.rectangle(graph_width, self.height - current_y, self._bar_width / (2 - i), current_y)
+            ctx.fill()
+
+            ctx.move_to(xs[0], tops[0][i])
+            for x, top, bottom in zip(xs, tops, bottoms):
+                ctx.line_to(x, top[i])
+                ctx.line_to(x, bottom[i])
+            ctx.stroke()
@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import struct
+import time
+from concurrent.futures import CancelledError, Future
+from datetime import timedelta
+from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread
+from typing import Optional, Tuple, Callable, Set, Dict
+
+import cairocffi as cairo
+from cairocffi import Context, ImageSurface, pixbuf
+
+from clear19.data.lru_cache import LruCache
+from clear19.widgets import load_svg
+from clear19.widgets.geometry import Size
+
+log = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """
+    Cache of decoded images that are already scaled to the size they are painted with.
+    Images are identified by a hash of their encoded data, so widgets that show the same image share one surface.
+    Opaque images are stored in the native RGB16_565 format of the display, images with transparency in ARGB32.
+    SVG images are rasterized in background and can additionally be stored on disk, so they are only parsed once.
+    Images from get_async and get_fetched are loaded, decoded and scaled in background, so only the scaled image is
+    kept in memory.
+    Images whose data could not be loaded, e.g. because of a failed download, are only requested again after
+    RETRY_DELAY.
+    """
+    WORKERS: int = 2
+    """Number of background threads that load, decode and scale images."""
+    RETRY_DELAY: timedelta = timedelta(minutes=1)
+    """Time after which an image whose data could not be loaded is loaded again."""
+
+    _RASTER_HEADER = struct.Struct('<4sIII')
+    _RASTER_MAGIC = b'SVGR'
+
+    svg_cache_path: Optional[Path]
+    """Directory where rasterized SVG images are stored. If None, they are only kept in memory."""
+
+    _cache: LruCache[Tuple[bytes, int, int], ImageSurface]
+    _tasks: Optional[Queue[Callable[[], None]]] = None
+    _pending: Set[Tuple[bytes, int, int]]
+    _failed: Dict[Tuple[bytes, int, int], float]
+    """Monotonic time after which images whose data could not be loaded are loaded again."""
+    _lock: Lock
+
+    def __init__(self, max_size: int = 16 * 2 ** 20, svg_cache_path: Optional[Path] = None):
+        """
+        :param max_size: Maximum number of bytes of pixel data kept in the cache.
+        :param svg_cache_path: Directory where rasterized SVG images are stored. If None, they are only kept in memory.
+        """
+        self._cache = LruCache(max_size, lambda surface: surface.get_stride() * surface.get_height())
+        self.svg_cache_path = svg_cache_path
+        self._pending = set()
+        self._failed = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def key(data: bytes) -> bytes:
+        """
+        :return: Key of the encoded image data for get.
+        """
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, key: bytes, data: bytes, size: Size) -> Optional[ImageSurface]:
+        """
+        :param key: Key of the image data as returned by key.
+        :param data: Encoded image data in any format supported by pixbuf. Only decoded if the image isn't cached.
+        :param size: Size of the area the image shall fit into. The aspect ratio of the image is retained.
+        :return: The scaled image, or None if the image data could not be decoded.
+        """
+        width = max(1, round(size.width))
+        height = max(1, round(size.height))
+        surface = self._cache.get((key, width, height))
+        if surface is None:
+            try:
+                image = pixbuf.decode_to_image_surface(data)[0]
+            except pixbuf.ImageLoadingError as e:
+                log.error(f"Error while loading image: {e}", exc_info=True)
+                return None
+            surface = self.scale(image, width, height)
+            self._cache.put((key, width, height), surface)
+        return surface
+
+    @staticmethod
+    def scale(image: ImageSurface, width: int, height: int) -> ImageSurface:
+        """
+        :return: A copy of the image that fits into the given size, with the aspect ratio retained.
+        """
+        s = min(width / image.get_width(), height / image.get_height())
+        image_format = cairo.FORMAT_RGB16_565 if image.get_format() == cairo.FORMAT_RGB24 else cairo.FORMAT_ARGB32
+        surface = ImageSurface(image_format, max(1, round(image.get_width() * s)),
+                               max(1, round(image.get_height() * s)))
+        ctx = Context(surface)
+        ctx.scale(s, s)
+        ctx.set_source_surface(image, 0, 0)
+        ctx.paint()
+        surface.flush()
+        return surface
+
+    def get_svg(self, key: bytes, data: bytes, size: Size, on_ready: Callable[[], None]) -> Optional[ImageSurface]:
+        """
+        Returns a rasterized SVG image if it is in memory. Otherwise it is loaded from disk or rasterized in background.
+        :param key: Key of the SVG data as returned by key.
+        :param data: Plain SVG data.
+        :param size: Size the image is rendered for.
+        :param on_ready: Called from the background thread when the image was not in memory and is available now.
+        :return: The rasterized image, or None if it is not available yet.
+        """
+        return self._get_in_background((key, max(1, round(size.width)), max(1, round(size.height))),
+                                       lambda cache_key: self._rasterize(cache_key, data), on_ready)
+
+    def get_async(self, key: bytes, loader: Callable[[], Optional[bytes]], size: Size,
+                  on_ready: Callable[[], None]) -> Optional[ImageSurface]:
+        """
+        Returns a scaled image if it is in memory. Otherwise its data is loaded, decoded and scaled in background. The
+        encoded data is dropped afterwards, so large originals are never kept in memory.
+        :param key: Key of the image, e.g. from key of its URL. Must change when the image changes.
+        :param loader: Returns the encoded image data, or None if it is not available. Called on a background thread,
+                       so it may block. If it raises CancelledError, the image is silently dropped.
+        :param size: Size of the area the image shall fit into. The aspect ratio of the image is retained.
+        :param on_ready: Called from the background thread when the image was not in memory and is available now.
+        :return: The scaled image, or None if it is not available yet.
+        """
+        return self._get_in_background((key, max(1, round(size.width)), max(1, round(size.height))),
+                                       lambda cache_key: self._decode(cache_key, loader), on_ready)
+
+    def get_fetched(self, key: bytes, fetch: Callable[[], Future[Optional[bytes]]], size: Size,
+                    on_ready: Callable[[], None]) -> Optional[ImageSurface]:
+        """
+        Like get_async, but for image data that is loaded asynchronously, e.g. by DownloadManager.fetch. No worker waits
+        for the data, it is only decoded and scaled in background when it arrived.
+        :param key: Key of the image, e.g. from key of its URL. Must change when the image changes.
+        :param fetch: Starts loading the encoded image data. Only called if the image is not in memory, on the calling
+                      thread. The future is resolved with None if the data is not available. If it is cancelled, the
+                      image is silently dropped.
+        :param size: Size of the area the image shall fit into. The aspect ratio of the image is retained.
+        :param on_ready: Called from a background thread when the image was not in memory and is available now.
+        :return: The scaled image, or None if it is not available yet.
+        """
+        cache_key = (key, max(1, round(size.width)), max(1, round(size.height)))
+        surface = self._cache.get(cache_key)
+        if surface is None and self._reserve(cache_key):
+            fetch().add_done_callback(lambda future: self._fetched(cache_key, future, on_ready))
+        return surface
+
+    def _get_in_background(self, cache_key: Tuple[bytes, int, int],
+                           render: Callable[[Tuple[bytes, int, int]], Optional[ImageSurface]],
+                           on_ready: Callable[[], None]) -> Optional[ImageSurface]:
+        surface = self._cache.get(cache_key)
+        if surface is None and self._reserve(cache_key):
+            self._tasks.put(lambda: self._render(cache_key, render, on_ready))
+        return surface
+
+    def _reserve(self, cache_key: Tuple[bytes, int, int]) -> bool:
+        """
+        Marks an image as pending.
+        :return: False if it was already pending, or if loading its data failed within RETRY_DELAY.
+        """
+        with self._lock:
+            if cache_key in self._pending:
+                return False
+            retry_time = self._failed.get(cache_key)
+            if retry_time is not None:
+                if time.monotonic() < retry_time:
+                    return False
+                del self._failed[cache_key]
+            self._pending.add(cache_key)
+            if not self._tasks:
+                self._tasks = Queue()
+                # Daemon threads, so a read that hangs on a network mount doesn't block the exit of the interpreter,
+                # which joins the threads of a ThreadPoolExecutor.
+                for i in range(ImageCache.WORKERS):
+                    Thread(target=self._worker, name=f'ImageCache worker {i}', daemon=True).start()
+            return True
+
+    def _worker(self):
+        while True:
+            task = self._tasks.get()
+            try:
+                task()
+            except Exception as e:
+                log.error(f"Error in image worker: {e}", exc_info=True)
+
+    def _fetched(self, cache_key: Tuple[bytes, int, int], future: Future[Optional[bytes]],
+                 on_ready: Callable[[], None]):
+        if future.cancelled():
+            # Cancelling runs this on the thread that cancelled, so the image can be requested again right away.
+            with self._lock:
+                self._pending.discard(cache_key)
+            return
+        self._tasks.put(lambda: self._render(cache_key, lambda k: self._decode(k, future.result), on_ready))
+
+    def _render(self, cache_key: Tuple[bytes, int, int],
+                render: Callable[[Tuple[bytes, int, int]], Optional[ImageSurface]], on_ready: Callable[[], None]):
+        try:
+            surface = render(cache_key)
+        except CancelledError:
+            with self._lock:
+                self._pending.discard(cache_key)
+            return
+        except Exception as e:
+            # The key stays pending, so broken images are not decoded again on every paint.
+            log.error(f"Error while loading image: {e}", exc_info=True)
+            return
+        if surface is None:
+            # Unavailable images, e.g. from a failed download, are loaded again after a delay, not on every paint.
+            now = time.monotonic()
+            with self._lock:
+                self._pending.discard(cache_key)
+                self._failed = {k: t for k, t in self._failed.items() if t > now}
+                self._failed[cache_key] = now + ImageCache.RETRY_DELAY.total_seconds()
+            return
+        self._cache.put(cache_key, surface)
+        with self._lock:
+            self._pending.discard(cache_key)
+        on_ready()
+
+    def _rasterize(self, cache_key: Tuple[bytes, int, int], data: bytes) -> ImageSurface:
+        file = self._raster_file(cache_key)
+        surface = self._read_raster(file) if file else None
+        if surface is None:
+            surface = load_svg(data, cache_key[1], cache_key[2])
+            if file:
+                self._write_raster(file, surface)
+        return surface
+
+    def _decode(self, cache_key: Tuple[bytes, int, int], loader: Callable[[], Optional[bytes]]) \
+            -> Optional[ImageSurface]:
+        """
+        :return: The decoded and scaled image, or None if the data is not available.
+        :raise CancelledError: If the loader was cancelled.
+        """
+        try:
+            data = loader()
+        except CancelledError:
+            raise
+        except Exception as e:
+            log.warning(f"Failed to load image data: {e}")
+            return None
+        if not data:
+            return None
+        image = pixbuf.decode_to_image_surface(data)[0]
+        return self.scale(image, cache_key[1], cache_key[2])
+
+    def _raster_file(self, cache_key: Tuple[bytes, int, int]) -> Optional[Path]:
+        if not self.svg_cache_path:
+            return None
+        key, width, height = cache_key
+        return self.svg_cache_path.joinpath(f'{key.hex()}-{width}x{height}.raster')
+
+    @staticmethod
+    def _read_raster(file: Path) -> Optional[ImageSurface]:
+        try:
+            with open(str(file), 'rb') as f:
+                raster = f.read()
+        except OSError:
+            return None
+        header_size = ImageCache._RASTER_HEADER.size
+        if len(raster) < header_size:
+            log.warning(f"Ignoring invalid raster file {file}.")
+            return None
+        magic, width, height, stride = ImageCache._RASTER_HEADER.unpack_from(raster)
+        if magic != ImageCache._RASTER_MAGIC or len(raster) != header_size + stride * height:
+            log.warning(f"Ignoring invalid raster file {file}.")
+            return None
+        return ImageSurface.create_for_data(bytearray(raster[header_size:]), cairo.FORMAT_ARGB32,
+                                            width, height, stride)
+
+    @staticmethod
+    def _write_raster(file: Path, surface: ImageSurface):
+        surface.flush()
+        tmp_file = file.with_name(file.name + '.tmp')
+        try:
+            file.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+            with open(str(tmp_file), 'wb') as f:
+                f.write(ImageCache._RASTER_HEADER.pack(ImageCache._RASTER_MAGIC, surface.get_width(),
+                                                       surface.get_height(), surface.get_stride()))
+                f.write(bytes(surface.get_data()))
+            os.replace(str(tmp_file), str(file))
+        except OSError:
+            log.error(f'Failed to write "{file}".', exc_info=True)
+
+    @property
+    def statistics(self) -> LruCache.Statistics:
+        return self._cache.statistics
@@ -1,11 +1,14 @@
 import logging
-from typing import Optional
+import os
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Optional, Callable
 
-from cairocffi import Context, ImageSurface, pixbuf
+from cairocffi import Context, ImageSurface
 
-from clear19.widgets import load_svg
 from clear19.widgets.color import Color
-from clear19.widgets.geometry import Anchor
+from clear19.widgets.geometry import Anchor, Rectangle, Size
+from clear19.widgets.image_cache import ImageCache
 from clear19.widgets.widget import Widget, ContainerWidget
 
 log = logging.getLogger(__name__)
@@ -15,8 +18,20 @@ class ImageWidget(Widget):
     """
     Displays an image.
     Supports all formats supported by pixbuf and SVG.
+    Images are decoded and scaled in the shared image_cache, so painting them is a plain copy. SVG images, files and
+    images from load_async and load_fetched are loaded in background and the widget stays empty until they are
+    available.
     """
-    _image: Optional[ImageSurface] = None
+    image_cache: ImageCache = ImageCache()
+    """Cache shared by all ImageWidgets."""
+
+    _image_data: Optional[bytes] = None
+    _is_svg: bool = False
+    _loader: Optional[Callable[[], Optional[bytes]]] = None
+    _fetcher: Optional[Callable[[], Future[Optional[bytes]]]] = None
+    _image_key: Optional[bytes] = None
+    _scaled_image: Optional[ImageSurface] = None
+    _scaled_size: Optional[Size] = None
     _alignment: Anchor
 
     def __init__(self, parent: ContainerWidget, alignment: Anchor = Anchor.CENTER_CENTER, overlay_color : Optional[Color] = None):
@@ -25,67 +40,82 @@ class ImageWidget(Widget):
         self._overlay_color = overlay_color
 
     def load_image(self, image_data: Optional[bytes]):
-        if image_data:
-            try:
-                self._image = pixbuf.decode_to_image_surface(image_data)[0]
-            except pixbuf.ImageLoadingError as e:
-                log.error(f"Error while loading image: {e}", exc_info=True)
-                self._image = None
-        else:
-            self._image = None
-        self.dirty = True
+        self._load(image_data, False)
 
     def load_svg(self, svg_data: Optional[bytes]):
-        if svg_data:
-            self._image = load_svg(svg_data, *self.size)
-        else:
-            self._image = None
+        self._load(svg_data, True)
+
+    def load_async(self, key: bytes, loader: Callable[[], Optional[bytes]]):
+        """
+        Shows an image whose data is only loaded if it is not cached at the size of this widget. The widget doesn't keep
+        the data, so the loader is called again when the widget is resized.
+        :param key: Key of the image, see ImageCache.get_async.
+        :param loader: Returns the encoded image data. Called on a background thread.
+        """
+        self._load(None, False)
+        self._image_key = key
+        self._loader = loader
+
+    def load_fetched(self, key: bytes, fetch: Callable[[], Future[Optional[bytes]]]):
+        """
+        Shows an image whose data is loaded asynchronously, e.g. by DownloadManager.fetch, if it is not cached at the
+        size of this widget. The widget doesn't keep the data, so the data is fetched again when the widget is resized.
+        :param key: Key of the image, see ImageCache.get_fetched.
+        :param fetch: Starts loading the encoded image data and returns a future for it. Called while painting.
+        """
+        self._load(None, False)
+        self._image_key = key
+        self._fetcher = fetch
+
+    def load_file(self, path: Path):
+        """
+        Shows an image file. It is read, decoded and scaled in background.
+        """
+        try:
+            stat = os.stat(str(path))
+        except OSError as e:
+            log.warning(f"Can't load image: {e}")
+            self._load(None, False)
+            return
+        self.load_async(ImageCache.key(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode()), path.read_bytes)
+
+    def _load(self, image_data: Optional[bytes], is_svg: bool):
+        self._scaled_image = None
+        self._image_data = image_data or None
+        self._image_key = ImageCache.key(image_data) if image_data else None
+        self._is_svg = is_svg
+        self._loader = None
+        self._fetcher = None
         self.dirty = True
 
+    def _scaled(self) -> Optional[ImageSurface]:
+        """
+        :return: The loaded image data, decoded and scaled to the current size of this widget.
+        """
+        if self._scaled_image is None or self._scaled_size != self.size:
+            self._scaled_size = self.size
+            if self._loader:
+                self._scaled_image = self.image_cache.get_async(self._image_key, self._loader, self.size, self.repaint)
+            elif self._fetcher:
+                self._scaled_image = self.image_cache.get_fetched(self._image_key, self._fetcher, self.size,
+                                                                  self.repaint)
+            elif self._is_svg:
+                self._scaled_image = self.image_cache.get_svg(self._image_key, self._image_data, self.size,
+                                                              self.repaint)
+            else:
+                self._scaled_image = self.image_cache.get(self._image_key, self._image_data, self.size)
+                if self._scaled_image is None:
+                    self._image_data = None
+                    self._image_key = None
+        return self._scaled_image
+
     def paint_foreground(self, ctx: Context):
-        if self._image:
-            sx = self.width / self._image.get_width()
-            sy = self.height / self._image.get_height()
-            s = min(sx, sy)
-            sw = self._image.get_width() * s
-            sh = self._image.get_height() * s
-            ctx.save()
-            ctx.scale(s, s)
-            x = 0
-            y = 0
-            if self.alignment == Anchor.TOP_LEFT:
-                x = 0
-                y = 0
-            elif self.alignment == Anchor.TOP_CENTER:
-                x = (self.width - sw) / 2
-                y = 0
-            elif self.alignment == Anchor.TOP_RIGHT:
-                x = self.width - sw
-                y = 0
-            elif self.alignment == Anchor.CENTER_LEFT:
-                x = 0
-                y = (self.height - sh) / 2
-            elif self.alignment == Anchor.CENTER_CENTER:
-                x = (self.width - sw) / 2
-                y = (self.height - sh) / 2
-            elif self.alignment == Anchor.CENTER_RIGHT:
-                x = (self.width - sw)
-                y = (self.height - sh) / 2
-            elif self.alignment == Anchor.BOTTOM_LEFT:
-                x = 0
-                y = self.height - sh
-            elif self.alignment == Anchor.BOTTOM_CENTER:
-                x = (self.width - sw) / 2
-                y = self.height - sh
-            elif self.alignment == Anchor.BOTTOM_RIGHT:
-                x = self.width - sw
-                y = self.height - sh
-            x /= s
-            y /= s
-            ctx.set_source_surface(self._image, x, y)
+        image = self._scaled() if self._image_key else None
+        if image:
+            area = Rectangle(self.size.position(self.alignment), Size(image.get_width(), image.get_height()))
+            ctx.set_source_surface(image, round(area.left), round(area.top))
             ctx.paint()
-            ctx.restore()
-        else:
+        elif not self._image_key:
             ctx.set_source_rgba(*self.background)
             ctx.rectangle(0, 0, self.size.width, self.size.height)
             ctx.fill()
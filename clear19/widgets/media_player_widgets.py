@@ -1,16 +1,20 @@
 import logging
 from abc import ABCMeta, ABC
+from concurrent.futures import Future
 from dataclasses import replace
-from datetime import timedelta
+from pathlib import Path
 from typing import Optional, List, Any
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 
 from cairo import Context
 
 from clear19.App import Global
-from clear19.data.media_player import MediaPlayer, Track, PlayState
-from clear19.scheduler import TaskParameters
+from clear19.data.download_manager import DownloadManager
+from clear19.data.media_player import MediaPlayer, Track, PlayState, PlaybackClock
 from clear19.widgets.color import Color
 from clear19.widgets.geometry import Size, Rectangle, ZERO_TOP_LEFT, Anchor, AnchoredPoint, Point, VAnchor, HAnchor
+from clear19.widgets.image_cache import ImageCache
 from clear19.widgets.image_widget import ImageWidget
 from clear19.widgets.text_widget import TextWidget, Font
 from clear19.widgets.widget import ContainerWidget, Widget
@@ -46,10 +50,11 @@ class MediaPlayerNameWidget(MediaPlayerWidget, TextWidget):
     def __init__(self, parent: ContainerWidget, media_player: MediaPlayer, font: Font = Font()):
         MediaPlayerWidget.__init__(self, parent, media_player)
         TextWidget.__init__(self, parent, font=font)
-        self.app.scheduler.schedule_synchronous(timedelta(milliseconds=100), self._update_play_state, priority=90)
+        self.media_player.add_listener(self._update_play_state)
+        self._update_play_state(self.media_player.current_play_state)
 
-    def _update_play_state(self, _: TaskParameters):
-        self.text = f'Player: {self.media_player.current_player_name}'
+    def _update_play_state(self, play_state: PlayState):
+        self.text = f'Player: {play_state.player_name}'
 
 
 class MediaPlayerTrackTitleWidget(MediaPlayerWidget, ContainerWidget):
@@ -69,7 +74,7 @@ class MediaPlayerTrackTitleWidget(MediaPlayerWidget, ContainerWidget):
         self._selected.background = Color.BLUE * 1.5
         self._update_play_state(self.media_player.current_play_state)
         self.media_player.add_listener(self._update_play_state)
-        self.app.scheduler.schedule_synchronous(timedelta(milliseconds=100), self._update_position, priority=90)
+        self.media_player.add_position_listener(self._update_position, self._next_progress_change)
 
     def do_layout(self):
         self._unselected.rectangle = Rectangle(ZERO_TOP_LEFT, self.size)
@@ -105,16 +110,32 @@ class MediaPlayerTrackTitleWidget(MediaPlayerWidget, ContainerWidget):
         self._unselected.text = title
         self._selected.font = font
         self._selected.text = title
+        self.set_render_key(self._progress_pixel)
         self.dirty = True
 
-    def _update_position(self, _: TaskParameters):
-        if self.media_player.current_track:
-            if self.media_player.current_track.duration:
-                self._progress = self.media_player.current_position / self.media_player.current_track.duration
-            else:
-                self._progress = 0
+    def _update_position(self, position: float):
+        track = self.media_player.current_track
+        if track and track.duration:
+            self._progress = position / track.duration
         else:
             self._progress = 0
+        self.set_render_key(self._progress_pixel)
+
+    def _next_progress_change(self, track: Optional[Track], position: float) -> Optional[float]:
+        """
+        :return: The position at which the progress moves to the next pixel.
+        """
+        if not track or not track.duration or self.width <= 0:
+            return None
+        step = track.duration / self.width
+        return PlaybackClock.next_boundary(position, step, step / 2)
+
+    @property
+    def _progress_pixel(self) -> int:
+        """
+        :return: The pixel where the progress split is painted.
+        """
+        return round(self.width * self._progress)
 
     @property
     def font(self) -> Font:
@@ -127,7 +148,7 @@ class MediaPlayerTrackTitleWidget(MediaPlayerWidget, ContainerWidget):
             self.dirty = True
 
     def paint_foreground(self, ctx: Context):
-        x1 = self.width * self._progress
+        x1 = self._progress_pixel
         x2 = self.width - x1
 
         ctx.save()
@@ -166,14 +187,21 @@ class MediaPlayerTrackPositionWidget(MediaPlayerWidget, TextWidget):
     def __init__(self, parent: ContainerWidget, media_player: MediaPlayer, font: Font = Font()):
         MediaPlayerWidget.__init__(self, parent, media_player)
         TextWidget.__init__(self, parent, '--:--', font)
-        self.app.scheduler.schedule_synchronous(timedelta(milliseconds=100), self._update_play_state, priority=90)
+        self.media_player.add_position_listener(self._update_position, self._next_change)
 
-    def _update_play_state(self, _: TaskParameters):
+    def _update_position(self, position: float):
         if self.media_player.current_track:
-            self.text = format_position(self.media_player.current_position)
+            self.text = format_position(position)
         else:
             self.text = '--:--'
 
+    @staticmethod
+    def _next_change(track: Optional[Track], position: float) -> Optional[float]:
+        """
+        :return: The position at which the displayed second changes. Positions are rounded to seconds.
+        """
+        return PlaybackClock.next_boundary(position, 1, 0.5) if track else None
+
 
 class MediaPlayerTrackRemainingWidget(MediaPlayerWidget, TextWidget):
     """
@@ -182,15 +210,22 @@ class MediaPlayerTrackRemainingWidget(MediaPlayerWidget, TextWidget):
     def __init__(self, parent: ContainerWidget, media_player: MediaPlayer, font: Font = Font()):
         MediaPlayerWidget.__init__(self, parent, media_player)
         TextWidget.__init__(self, parent, '--:--', font)
-        self.app.scheduler.schedule_synchronous(timedelta(milliseconds=100), self._update_play_state, priority=90)
+        self.media_player.add_position_listener(self._update_position, self._next_change)
 
-    def _update_play_state(self, _: TaskParameters):
-        if self.media_player.current_track:
-            self.text = '-' + format_position(self.media_player.current_track.duration
-                                              - self.media_player.current_position)
+    def _update_position(self, position: float):
+        track = self.media_player.current_track
+        if track:
+            self.text = '-' + format_position(track.duration - position)
         else:
             self.text = '---:--'
 
+    @staticmethod
+    def _next_change(track: Optional[Track], position: float) -> Optional[float]:
+        """
+        :return: The position at which the displayed remaining second changes.
+        """
+        return PlaybackClock.next_boundary(position, 1, (track.duration - 0.5) % 1) if track else None
+
 
 class MediaPlayerTrackDurationWidget(MediaPlayerWidget, TextWidget):
     """
@@ -275,8 +310,12 @@ class MediaPlayerTrackDetailsWidget(MediaPlayerWidget, ContainerWidget):
 class MediaPlayerAlbumArt(MediaPlayerWidget, ImageWidget):
     """
     ImageWidget that shows the album art of the current track.
+    Local files are read directly. Other art is downloaded without keeping the original in the memory cache. Either
+    way only the art scaled to the size of the widget is cached. Loading the art of a track that is skipped before it
+    arrived is cancelled.
     """
     _image_url: str = ''
+    _image_future: Optional[Future] = None
 
     def __init__(self, parent, media_player, alignment: Anchor = Anchor.CENTER_CENTER, overlay_color: Optional[Color] = None):
         MediaPlayerWidget.__init__(self, parent, media_player)
@@ -291,7 +330,21 @@ class MediaPlayerAlbumArt(MediaPlayerWidget, ImageWidget):
             url = ''
 
         if url != self._image_url:
-            self.load_image(None)
+            if self._image_future:
+                self._image_future.cancel()
+                self._image_future = None
             self._image_url = url
-            if url:
-                Global.download_manager.get(url, self.load_image)
+            if not url:
+                self.load_image(None)
+            elif urlparse(url).scheme == 'file':
+                self.load_file(Path(url2pathname(urlparse(url).path)))
+            else:
+                self.load_fetched(ImageCache.key(url.encode()), lambda: self._download(url))
+
+    def _download(self, url: str) -> Future[Optional[bytes]]:
+        """
+        Starts the download of the art. Called while painting, when the art is not cached at the size of this widget.
+        """
+        self._image_future = Global.download_manager.fetch(url, priority=DownloadManager.PRIORITY_USER_VISIBLE,
+                                                           memory_cache=False)
+        return self._image_future
@@ -1,11 +1,11 @@
-import operator
-from datetime import timedelta
+import math
 from typing import Optional, List, Tuple, Dict
 
-import psutil
-from cairocffi import Context
+import numpy as np
+from cairocffi import Context, ImageSurface, FORMAT_RGB24, FILTER_NEAREST
 
 from clear19.App import Global
+from clear19.data.disk_data import DiskUsage
 from clear19.data.system_data import SystemData
 from clear19.widgets import Rectangle, Anchor
 from clear19.widgets.bar_widget import BarWidget
@@ -45,6 +45,70 @@ class CpuLoadBarWidget (BarWidget):
             ctx.stroke()
 
 
+class CpuHeatmapWidget(Widget):
+    """
+    Shows the load of every CPU core as a colored cell of a grid.
+    The grid is rendered as an image with one pixel per core, which is scaled to the widget in one paint operation.
+    A frame is only rendered when a cell changes its color.
+    """
+    DEFAULT_GRADIENT: Dict[float, Color] = {0: Color.GRAY20, 30: Color.BLUE, 70: Color.YELLOW, 100: Color.RED}
+
+    _gradient: Dict[float, Color]
+    _lut: np.ndarray
+    """Pixel for every load from 0 to 100 percent."""
+    _levels: Optional[np.ndarray] = None
+    """Load of every core, rounded to an index of _lut."""
+    _image: Optional[ImageSurface] = None
+
+    def __init__(self, parent: ContainerWidget, gradient: Optional[Dict[float, Color]] = None):
+        """
+        :param gradient: Colors for loads in percent. Loads between are interpolated.
+        """
+        super().__init__(parent)
+        self.gradient = gradient or self.DEFAULT_GRADIENT
+        Global.system_data.add_per_cpu_listener(self._update)
+
+    def _update(self, load: np.ndarray):
+        self._levels = np.rint(np.clip(load, 0, 100)).astype(np.intp)
+        self.set_render_key(self._lut[self._levels].tobytes())
+
+    def paint_foreground(self, ctx: Context):
+        if self._levels is None or not len(self._levels) or self.width < 1 or self.height < 1:
+            return
+        count = len(self._levels)
+        columns = min(count, math.ceil(math.sqrt(count * self.width / self.height)))
+        rows = math.ceil(count / columns)
+        if not self._image or self._image.get_width() != columns or self._image.get_height() != rows:
+            self._image = ImageSurface(FORMAT_RGB24, columns, rows)
+        self._image.flush()
+        cells = np.full(rows * columns, self._pixel(self.background) if self.background else 0, np.uint32)
+        cells[:count] = self._lut[self._levels]
+        pixels = np.frombuffer(self._image.get_data(), np.uint32).reshape(rows, self._image.get_stride() // 4)
+        pixels[:, :columns] = cells.reshape(rows, columns)
+        self._image.mark_dirty()
+
+        ctx.save()
+        ctx.scale(self.width / columns, self.height / rows)
+        ctx.set_source_surface(self._image)
+        ctx.get_source().set_filter(FILTER_NEAREST)
+        ctx.paint()
+        ctx.restore()
+
+    @property
+    def gradient(self) -> Dict[float, Color]:
+        return self._gradient
+
+    @gradient.setter
+    def gradient(self, gradient: Dict[float, Color]):
+        self._gradient = gradient
+        self._lut = np.array([self._pixel(Color.interpolate(p, gradient)) for p in range(101)], np.uint32)
+        self.dirty = True
+
+    @staticmethod
+    def _pixel(color: Color) -> int:
+        return (color.red_255 << 16) | (color.green_255 << 8) | color.blue_255
+
+
 class CpuLoadTextWidget(TextWidget):
     """
     Shows the CPU load as text.
@@ -107,15 +171,19 @@ class DiskStats(TextWidget):
     Shows the disk usage as text.
     """
     def __init__(self, disks: Dict[str, str], parent: ContainerWidget, font: Font = Font()):
+        """
+        :param disks: Mounts to show by name. Their usage is read by Global.disk_data, which must know the names.
+        """
         super().__init__(parent, '', font)
-        self.app.scheduler.schedule_synchronous(timedelta(seconds=1), self._update)
         self.disks = disks
+        Global.disk_data.add_usage_listener(self._update)
+        self._update(Global.disk_data.usage)
 
-    def _update(self, _):
+    def _update(self, usage: Dict[str, Optional[DiskUsage]]):
         texts = list()
-        for (name, path) in self.disks.items():
-            usage = psutil.disk_usage(path)
-            texts.append(f'{name}: {usage.percent:0.0f}%')
+        for name in self.disks:
+            disk_usage = usage.get(name)
+            texts.append(f'{name}: {disk_usage.percent:0.0f}%' if disk_usage else f'{name}: ?')
         self.text = ' '.join(texts)
 
 
@@ -141,7 +209,6 @@ class ProcessList(ContainerWidget):
             p = child.position(Anchor.BOTTOM_LEFT).anchored(Anchor.TOP_LEFT)
 
     def _update(self, data: List[Tuple[str, float]]):
-        d = sorted(data, key=operator.itemgetter(1), reverse=True)
         for i in range(len(self.children)):
             # noinspection PyUnresolvedReferences
-            self.children[i].text = f'{d[i][1]:3.0f}% {d[i][0]}'
+            self.children[i].text = f'{data[i][1]:3.0f}% {data[i][0]}' if i < len(data) else ''
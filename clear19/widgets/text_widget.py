@@ -213,9 +213,8 @@ class TextWidget(Widget):
     @text.setter
     def text(self, text: str):
         assert isinstance(text, str)
-        if self._text != text:
-            self._text = text
-            self.dirty = True
+        self._text = text
+        self.set_render_key(text)
 
     @property
     def font(self) -> Font:
@@ -103,7 +103,12 @@ class WeatherWidget(ContainerWidget):
             self._rain_widget.foreground = Color.interpolate(
                 weather_period.rainfall * (1 - (1 - weather_period.pop) ** 2), self.rain_color_gradient)
             self._rain_widget.text = f'{weather_period.rainfall:.1f}mm {weather_period.pop:.0f}%'
-            self._icon_widget.load_image(self._download_manager.get(weather_period.icon, self._icon_widget.load_image))
+            if weather_period.icon:
+                self._icon_widget.load_image(self._download_manager.get(weather_period.icon,
+                                                                        self._icon_widget.load_image,
+                                                                        stale_while_revalidate=True))
+            else:
+                self._icon_widget.load_image(None)
         else:
             self._from_to_widget.foreground = Color.GRAY90
             self._from_to_widget.text = '00:00-00:00'
@@ -152,20 +157,14 @@ class WeatherWidgets(ContainerWidget):
 
     def _update_children(self):
         if self.weather_data:
-            n = 0
-            i = 0
-            for w in self.children:
-                if isinstance(w, WeatherWidget):
-                    m = i + 1
-                    combined = None
-                    for j in range(n, n + m):
-                        if not combined:
-                            combined = self.weather_data.periods[j]
-                        else:
-                            combined += self.weather_data.periods[j]
-                    n += m
-                    w.weather_period = combined
-                    i += 1
+            widgets = [w for w in self.children if isinstance(w, WeatherWidget)]
+            # The n-th widget combines the next n hours, as far as the forecast reaches.
+            sizes = []
+            while len(sizes) < len(widgets) and sum(sizes) + len(sizes) + 1 <= len(self.weather_data.series):
+                sizes.append(len(sizes) + 1)
+            periods = self.weather_data.series.aggregate_sizes(sizes)
+            for i, w in enumerate(widgets):
+                w.weather_period = periods[i] if i < len(periods) else None
         else:
             for w in self.children:
                 if isinstance(w, WeatherWidget):
@@ -2,8 +2,9 @@ from __future__ import annotations
 
 import logging
 from abc import ABC, abstractmethod, ABCMeta
+from dataclasses import dataclass
 from enum import Enum
-from typing import List, Type, Optional
+from typing import List, Type, Optional, Any, Tuple, Callable
 
 from cairocffi import Context
 
@@ -24,6 +25,8 @@ class Widget(ABC):
     _dirty: bool = True
     _background: Optional[Color]
     _foreground: Color
+    _render_key: Any = None
+    _avoided_frames: int = 0
 
     def __init__(self, parent: ContainerWidget):
         """
@@ -55,6 +58,27 @@ class Widget(ABC):
             if dirty and self.parent is not None:
                 self.parent.dirty = True
 
+    def set_render_key(self, key: Any) -> bool:
+        """
+        Sets the dirty flag only if the key differs from the last key.
+        The key shall contain everything that changes the rendered result at device pixel resolution, like formatted
+        text or rounded pixel positions, so changes of the data that are too small to be visible don't render a frame.
+        :return: True if the key changed.
+        """
+        if key == self._render_key:
+            self._avoided_frames += 1
+            return False
+        self._render_key = key
+        self.dirty = True
+        return True
+
+    @property
+    def avoided_frames(self) -> int:
+        """
+        :return: Number of updates that didn't set the dirty flag because the render key didn't change.
+        """
+        return self._avoided_frames
+
     @property
     def rectangle(self) -> Rectangle:
         """
@@ -215,6 +239,21 @@ class Widget(ABC):
     def visible(self, visible: bool):
         self._visible = visible
         self.dirty = True
+        self.app.update_shown()
+
+    @property
+    def shown(self) -> bool:
+        """
+        :return: True if this widget is on the current screen, and neither it nor one of its parents is invisible.
+        """
+        widget = self
+        while widget.visible:
+            parent = widget.parent
+            if isinstance(parent, AppWidget):
+                return parent is widget or (parent.current_screen is not None
+                                            and parent._current_screen_object is widget)
+            widget = parent
+        return False
 
     def set_height(self, height: float, anchor: VAnchor):
         self.rectangle = Rectangle(self.position(anchor + HAnchor.LEFT), Size(self.width, height))
@@ -268,6 +307,19 @@ class ContainerWidget(Widget):
             child.paint(ctx)
             ctx.restore()
 
+    def avoided_frames_report(self) -> List[Tuple[Widget, int]]:
+        """
+        :return: All direct and indirect children that avoided frames with set_render_key and their number of avoided
+                 frames.
+        """
+        report = []
+        for child in self.children:
+            if child.avoided_frames:
+                report.append((child, child.avoided_frames))
+            if isinstance(child, ContainerWidget):
+                report.extend(child.avoided_frames_report())
+        return report
+
     def repaint(self):
         """
         Sets the dirty flag of this ContainerWidget and all its direct and indirect children.
@@ -312,13 +364,21 @@ class AppWidget(ContainerWidget):
     """
     __metaclass__ = ABCMeta
 
+    @dataclass(eq=False)
+    class _ShownListener:
+        widget: Widget
+        listener: Callable[[bool], None]
+        shown: bool
+
     _current_screen: Optional[Enum] = None
     _scheduler: Scheduler
     _last_screens: List[Enum]
+    _shown_listeners: List[AppWidget._ShownListener]
 
     def __init__(self):
         self._scheduler = Scheduler()
         self._last_screens = []
+        self._shown_listeners = []
         self._background = Color.BLACK
         self._foreground = Color.WHITE
         super().__init__(self)
@@ -353,12 +413,34 @@ class AppWidget(ContainerWidget):
                     self._last_screens.append(self.current_screen)
             self._current_screen = current_screen
             self.repaint()
+            self.update_shown()
             log.info(f"Screen changed to {self._current_screen.name}.")
 
     @property
     def _current_screen_object(self) -> Screen:
         return self._screen_object(self._current_screen)
 
+    def add_shown_listener(self, widget: Widget, listener: Callable[[bool], None]):
+        """
+        Tells a listener whether a widget is shown, now and whenever that changes. This way data providers learn if
+        their data is displayed without reading the widget tree from their own threads.
+        :param widget: Widget whose shown property is observed.
+        :param listener: Gets the new value of widget.shown. Called on the thread that changes the screen.
+        """
+        shown = widget.shown
+        self._shown_listeners.append(AppWidget._ShownListener(widget, listener, shown))
+        listener(shown)
+
+    def update_shown(self):
+        """
+        Calls the shown listeners of all widgets that were shown or hidden since the last call.
+        """
+        for shown_listener in self._shown_listeners:
+            shown = shown_listener.widget.shown
+            if shown != shown_listener.shown:
+                shown_listener.shown = shown
+                shown_listener.listener(shown)
+
     def navigate_back(self):
         """
         Change current screen to previous screen.
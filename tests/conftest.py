@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from typing import Dict, List, Tuple, Iterator
+
+import pytest
+
+# clear19.py registers the VERBOSE level when the app starts, the tests don't run it.
+if not hasattr(logging.getLoggerClass(), 'verbose'):
+    logging.addLevelName(5, 'VERBOSE')
+    logging.VERBOSE = 5
+
+    def verbose(self, message, *args, **kwargs):
+        if self.isEnabledFor(5):
+            self._log(5, message, args, **kwargs)
+
+    logging.getLoggerClass().verbose = verbose
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local HTTP server that serves resources from memory with ETags and answers conditional requests with 304.
+    It keeps connections alive and can add latency to every answer.
+    """
+    daemon_threads = True
+    resources: Dict[str, bytes]
+    """Content by path."""
+    requests: List[Tuple[str, int]]
+    """Path and status of every answered request."""
+    delay: float = 0
+    """Seconds to wait before answering."""
+    connections: int = 0
+    """Number of accepted connections."""
+    active: Dict[str, int]
+    """Number of requests that are being answered by Host header."""
+    max_active: Dict[str, int]
+    """Maximum number of requests that were answered at once by Host header."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _StandInHandler)
+        self.resources = {}
+        self.requests = []
+        self.active = {}
+        self.max_active = {}
+        self.lock = Lock()
+
+    def url(self, path: str, host: str = '127.0.0.1') -> str:
+        """
+        :param host: Name of the host in the URL. Names that resolve to 127.0.0.1 reach this server as different hosts.
+        """
+        return f'http://{host}:{self.server_port}{path}'
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: StandInServer
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        host = self.headers.get('Host', '')
+        with self.server.lock:
+            self.server.active[host] = self.server.active.get(host, 0) + 1
+            self.server.max_active[host] = max(self.server.max_active.get(host, 0), self.server.active[host])
+        try:
+            time.sleep(self.server.delay)
+            self._get()
+        finally:
+            with self.server.lock:
+                self.server.active[host] -= 1
+
+    def _get(self):
+        content = self.server.resources.get(self.path)
+        if content is None:
+            self._answer(404, b'', {})
+            return
+        etag = f'"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self._answer(304, b'', {'ETag': etag})
+        else:
+            self._answer(200, content, {'ETag': etag})
+
+    def _answer(self, status: int, content: bytes, headers: Dict[str, str]):
+        with self.server.lock:
+            self.server.requests.append((self.path, status))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_server() -> Iterator[StandInServer]:
+    server = StandInServer()
+    Thread(target=server.serve_forever, name='Stand-in HTTP server', daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
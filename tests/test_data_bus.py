@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from clear19.data.data_bus import DataBus, Topic
+
+TOPIC: Topic[int] = Topic('test')
+
+
+def test_subscribe_after_publish_gets_latest():
+    data_bus = DataBus()
+    data_bus.publish(TOPIC, 1)
+    data_bus.publish(TOPIC, 2)
+    received = []
+    data_bus.subscribe(TOPIC, received.append)
+    assert received == []
+    data_bus.deliver()
+    assert received == [2]
+
+    # An equal sample is still dropped.
+    data_bus.publish(TOPIC, 2)
+    data_bus.deliver()
+    assert received == [2]
+    data_bus.publish(TOPIC, 3)
+    data_bus.deliver()
+    assert received == [2, 3]
+
+
+def test_subscribe_before_publish():
+    data_bus = DataBus()
+    received = []
+    data_bus.subscribe(TOPIC, received.append, timedelta(hours=1))
+    data_bus.deliver()
+    assert received == []
+    data_bus.publish(TOPIC, 1)
+    data_bus.publish(TOPIC, 2)
+    data_bus.deliver()
+    data_bus.publish(TOPIC, 3)
+    data_bus.deliver()
+    assert received == [2]
@@ -0,0 +1,35 @@
+import json
+import os
+import time
+from datetime import timedelta
+
+from clear19.data.disk_cache import DiskCache
+
+
+def _wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def test_startup_cleanup(tmp_path):
+    first = DiskCache(tmp_path, maintenance_interval=timedelta(hours=1))
+    first.write('https://example.com/kept', b'kept')
+    first.write('https://example.com/lost', b'lost')
+    first.stop()
+    os.unlink(tmp_path / first.lookup('https://example.com/lost').file)
+    (tmp_path / 'unreferenced').write_bytes(b'old layout')
+    (tmp_path / '.running.tmp').write_bytes(b'')
+    (tmp_path / '.crashed.tmp').write_bytes(b'')
+    os.utime(tmp_path / '.crashed.tmp', (0, 0))
+
+    cache = DiskCache(tmp_path, maintenance_interval=timedelta(hours=1))
+    _wait_for(lambda: cache.lookup('https://example.com/lost') is None)
+    _wait_for(lambda: not (tmp_path / 'unreferenced').exists())
+    cache.stop()
+    assert cache.read('https://example.com/kept') == b'kept'
+    assert (tmp_path / '.running.tmp').exists()
+    assert not (tmp_path / '.crashed.tmp').exists()
+    index = json.loads((tmp_path / DiskCache.INDEX_FILE).read_text())
+    assert list(index) == ['https://example.com/kept']
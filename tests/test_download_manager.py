@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+from queue import Queue
+
+from clear19.data.download_manager import DownloadManager
+
+
+def test_malformed_url_resolves_every_request(tmp_path):
+    download_manager = DownloadManager(tmp_path, workers=1)
+    try:
+        for _ in range(2):
+            # urlopen raises ValueError for URLs without scheme.
+            first = download_manager.fetch('//host/icon.png')
+            second = download_manager.fetch('//host/icon.png')
+            assert first.result(timeout=5) is None
+            assert second.result(timeout=5) is None
+    finally:
+        download_manager.stop()
+
+
+def test_stale_memory_entry_without_file_is_refreshed(tmp_path):
+    download_manager = DownloadManager(tmp_path / 'cache', workers=1)
+    source = tmp_path / 'values.json'
+    url = source.as_uri()
+    received = Queue()
+    try:
+        source.write_bytes(b'old')
+        assert download_manager.get(url, received.put, timedelta(0), stale_while_revalidate=True) is None
+        assert received.get(timeout=5) == b'old'
+
+        # The file was evicted from the disk cache, only the stale content in memory is left.
+        download_manager._disk_cache.remove(url)
+        source.write_bytes(b'new')
+        assert download_manager.get(url, received.put, timedelta(0), stale_while_revalidate=True) == b'old'
+        assert received.get(timeout=5) == b'new'
+    finally:
+        download_manager.stop()
+
+
+def test_user_visible_downloads_go_first(tmp_path, stand_in_server):
+    for name in ('busy', 'weather', 'icon1', 'icon2', 'art'):
+        stand_in_server.resources[f'/{name}'] = name.encode()
+    stand_in_server.delay = 0.2
+    download_manager = DownloadManager(tmp_path, workers=1)
+    try:
+        busy = download_manager.fetch(stand_in_server.url('/busy'))
+        time.sleep(0.1)
+        background = [download_manager.fetch(stand_in_server.url(f'/{name}')) for name in ('weather', 'icon1', 'icon2')]
+        art = download_manager.fetch(stand_in_server.url('/art'), priority=DownloadManager.PRIORITY_USER_VISIBLE)
+        for future in [busy, art] + background:
+            assert future.result(timeout=5) is not None
+        assert [path for path, _ in stand_in_server.requests] == ['/busy', '/art', '/weather', '/icon1', '/icon2']
+    finally:
+        download_manager.stop()
+
+
+def test_parallel_downloads_with_latency(tmp_path, stand_in_server):
+    """
+    Benchmark against hosts with 100 ms latency: 8 requests that would take 0.8 s one after another.
+    """
+    hosts = {'127.0.0.1': 6, 'localhost': 2}
+    for host, count in hosts.items():
+        for i in range(count):
+            stand_in_server.resources[f'/{host}/{i}'] = b'x' * 1000
+    stand_in_server.delay = 0.1
+    download_manager = DownloadManager(tmp_path, workers=4, max_per_host=2)
+    try:
+        start = time.monotonic()
+        futures = [download_manager.fetch(stand_in_server.url(f'/{host}/{i}', host))
+                   for host, count in hosts.items() for i in range(count)]
+        assert all(future.result(timeout=5) == b'x' * 1000 for future in futures)
+        elapsed = time.monotonic() - start
+        print(f'{len(futures)} downloads in {elapsed:.2f} s over {stand_in_server.connections} connections.')
+
+        # Three rounds of two parallel downloads from the busiest host.
+        assert elapsed < 0.6
+        assert all(active <= 2 for active in stand_in_server.max_active.values())
+        assert stand_in_server.max_active[f'127.0.0.1:{stand_in_server.server_port}'] == 2
+        # Connections are kept alive and reused, at most two per host.
+        assert stand_in_server.connections <= 4
+
+        futures = [download_manager.fetch(stand_in_server.url(f'/127.0.0.1/{i}'), lifetime=timedelta(0))
+                   for i in range(6)]
+        assert all(future.result(timeout=5) for future in futures)
+        assert stand_in_server.connections <= 4
+    finally:
+        download_manager.stop()
@@ -0,0 +1,171 @@
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from typing import Dict, List, Tuple
+
+import pytest
+
+from clear19.data.data_bus import DataBus
+from clear19.data.fritzbox import FritzBox
+
+# Out arguments by action by service, with their value and TR-064 data type.
+_SERVICES: Dict[str, Dict[str, Dict[str, Tuple[str, str]]]] = {
+    'WANCommonIFC1': {
+        'GetAddonInfos': {'NewByteSendRate': ('1200', 'ui4'), 'NewByteReceiveRate': ('34000', 'ui4'),
+                          'NewTotalBytesSent': ('1000', 'ui4'), 'NewTotalBytesReceived': ('2000', 'ui4'),
+                          'NewX_AVM_DE_TotalBytesSent64': ('5000000000', 'string'),
+                          'NewX_AVM_DE_TotalBytesReceived64': ('9000000000', 'string')},
+        'GetCommonLinkProperties': {'NewPhysicalLinkStatus': ('Up', 'string'),
+                                    'NewLayer1UpstreamMaxBitRate': ('40000000', 'ui4'),
+                                    'NewLayer1DownstreamMaxBitRate': ('250000000', 'ui4')},
+    },
+    'WANIPConn1': {
+        'GetStatusInfo': {'NewConnectionStatus': ('Connected', 'string')},
+        'GetExternalIPAddress': {'NewExternalIPAddress': ('203.0.113.7', 'string')},
+        'X_AVM_DE_GetExternalIPv6Address': {'NewExternalIPv6Address': ('2001:db8::7', 'string')},
+    },
+    'Hosts1': {
+        'X_AVM-DE_GetHostListPath': {'NewX_AVM-DE_HostListPath': ('/devicehostlist.lua', 'string')},
+    },
+}
+
+_HOSTS = [('1', '802.11'), ('1', 'Ethernet'), ('1', 'Ethernet'), ('0', '802.11')]
+"""Active flag and interface type of the hosts."""
+
+
+class _Scheduler:
+    """Never ticks, the tests poll by calling FritzBox._poll_once."""
+
+    def schedule_to_queue(self, interval, queue):
+        pass
+
+
+class _MalformedConnection:
+    def call_action(self, service, action):
+        return {}
+
+
+def test_unexpected_answer_is_retried():
+    fritz_box = FritzBox(_Scheduler(), DataBus(), '127.0.0.1', '')
+    fritz_box._connection = _MalformedConnection()
+    now = datetime.now()
+    fritz_box._poll_once(now)
+    assert fritz_box.current_data.stale
+    assert fritz_box._retry_at > now
+    assert fritz_box._connection is None
+
+
+class _FakeTr064Server(ThreadingHTTPServer):
+    """
+    Answers the description, SCPD and host list requests and the SOAP actions of a Fritz!Box.
+    """
+    daemon_threads = True
+    actions: List[str]
+    """Names of the called actions."""
+    host_lists: int = 0
+    """Number of host list requests."""
+    connections: int = 0
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _FakeTr064Handler)
+        self.actions = []
+        self.lock = Lock()
+
+
+class _FakeTr064Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: _FakeTr064Server
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        if self.path == '/tr64desc.xml':
+            services = ''.join(f'<service><serviceType>urn:dslforum-org:service:{name}</serviceType>'
+                               f'<serviceId>urn:dslforum-org:serviceId:{name}</serviceId>'
+                               f'<controlURL>/upnp/control/{name}</controlURL>'
+                               f'<SCPDURL>/{name}SCPD.xml</SCPDURL></service>' for name in _SERVICES)
+            self._answer(f'<root><specVersion><major>1</major><minor>0</minor></specVersion><device>'
+                         f'<modelName>FRITZ!Box Fake</modelName><serviceList>{services}</serviceList>'
+                         f'</device></root>')
+        elif self.path.endswith('SCPD.xml') and self.path[1:-8] in _SERVICES:
+            actions = ''
+            variables = ''
+            for action, arguments in _SERVICES[self.path[1:-8]].items():
+                actions += f'<action><name>{action}</name><argumentList>'
+                for name, (_, data_type) in arguments.items():
+                    actions += (f'<argument><name>{name}</name><direction>out</direction>'
+                                f'<relatedStateVariable>{name}</relatedStateVariable></argument>')
+                    variables += f'<stateVariable><name>{name}</name><dataType>{data_type}</dataType></stateVariable>'
+                actions += '</argumentList></action>'
+            self._answer(f'<scpd><actionList>{actions}</actionList>'
+                         f'<serviceStateTable>{variables}</serviceStateTable></scpd>')
+        elif self.path == '/devicehostlist.lua':
+            with self.server.lock:
+                self.server.host_lists += 1
+            items = ''.join(f'<Item><Index>{i}</Index><Active>{active}</Active>'
+                            f'<InterfaceType>{interface}</InterfaceType></Item>'
+                            for i, (active, interface) in enumerate(_HOSTS, 1))
+            self._answer(f'<List>{items}</List>')
+        else:
+            self._answer('Not found', 404, 'text/html')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        service = self.path.rpartition('/')[2]
+        action = self.headers['soapaction'].rpartition('#')[2]
+        with self.server.lock:
+            self.server.actions.append(action)
+        arguments = ''.join(f'<{name}>{value}</{name}>' for name, (value, _) in _SERVICES[service][action].items())
+        self._answer(f'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>'
+                     f'<u:{action}Response xmlns:u="urn:dslforum-org:service:{service}">{arguments}'
+                     f'</u:{action}Response></s:Body></s:Envelope>')
+
+    def _answer(self, content: str, status: int = 200, content_type: str = 'text/xml'):
+        body = content.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_tr064_server():
+    server = _FakeTr064Server()
+    Thread(target=server.serve_forever, name='Fake TR-064 server', daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_round_trips(fake_tr064_server):
+    fritz_box = FritzBox(_Scheduler(), DataBus(), '127.0.0.1', '', fake_tr064_server.server_port)
+    fritz_box._poll_once(datetime.now())
+    data = fritz_box.current_data
+    assert not data.stale
+    assert data.transmission_rate == (1200, 34000)
+    assert (data.bytes_sent, data.bytes_received) == (5000000000, 9000000000)
+    assert data.is_connected and data.is_linked
+    assert data.max_bit_rate == (40000000, 250000000)
+    assert (data.external_ip, data.external_ipv6) == ('203.0.113.7', '2001:db8::7')
+    assert (data.lan_hosts, data.wifi_hosts) == (2, 1)
+    # The first poll reads everything: 5 actions, plus the path of the host list and the list itself.
+    assert fake_tr064_server.actions == ['GetAddonInfos', 'GetStatusInfo', 'GetCommonLinkProperties',
+                                         'GetExternalIPAddress', 'X_AVM_DE_GetExternalIPv6Address',
+                                         'X_AVM-DE_GetHostListPath']
+    assert fake_tr064_server.host_lists == 1
+    assert fritz_box.round_trips == 7
+
+    for _ in range(3):
+        fritz_box._poll_once(datetime.now())
+    # Fast polls only read the counters and the connection state.
+    assert fake_tr064_server.actions[6:] == ['GetAddonInfos', 'GetStatusInfo'] * 3
+    assert fritz_box.round_trips == 7 + 2 * 3
+    # Descriptions, actions and host list share one kept alive connection.
+    assert fake_tr064_server.connections == 1
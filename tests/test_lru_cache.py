@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from clear19.data.lru_cache import LruCache
+
+
+def test_size_stays_within_budget():
+    max_size = 1024 * 1024
+    cache: LruCache[str, bytes] = LruCache(max_size)
+    for i in range(10000):
+        # Synthetic album art between 1 and 20 KiB.
+        cache.put(f'https://example.com/track/{i}.jpg', bytes(1024 * (1 + i % 20)))
+        assert cache.size <= max_size
+
+    statistics = cache.statistics
+    assert statistics.size == cache.size > max_size - 20 * 1024
+    assert statistics.entries == len(cache) < 10000
+    assert statistics.evictions == 10000 - len(cache)
+    # The most recently inserted entries are kept.
+    assert 'https://example.com/track/9999.jpg' in cache
+    assert 'https://example.com/track/0.jpg' not in cache
+
+
+def test_oversized_and_replaced_values():
+    cache: LruCache[str, bytes] = LruCache(100)
+    cache.put('large', bytes(101))
+    assert 'large' not in cache and cache.size == 0
+    for i in range(10000):
+        cache.put('same', bytes(i % 100), timedelta(minutes=1))
+    assert len(cache) == 1 and cache.size == 9999 % 100
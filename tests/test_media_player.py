@@ -0,0 +1,124 @@
+import shutil
+import subprocess
+import time
+
+import pytest
+
+dbus = pytest.importorskip('dbus')
+pytest.importorskip('gi')
+
+import dbus.service  # noqa: E402
+from _dbus_glib_bindings import DBusGMainLoop  # noqa: E402
+from dbus.bus import BusConnection  # noqa: E402
+from dbus.lowlevel import HANDLER_RESULT_NOT_YET_HANDLED  # noqa: E402
+from gi.repository import GLib  # noqa: E402
+
+from clear19.data.data_bus import DataBus  # noqa: E402
+from clear19.data.media_player import MediaPlayer  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not shutil.which('dbus-daemon'), reason='dbus-daemon is not installed')
+
+
+class _FakePlayer(dbus.service.Object):
+    """
+    MPRIS player that answers GetAll and emits PropertiesChanged and Seeked.
+    """
+    get_all_calls: int = 0
+
+    def __init__(self, bus: BusConnection):
+        super().__init__(bus, MediaPlayer.OBJECT_PATH)
+        self.properties = {
+            'PlaybackStatus': 'Paused',
+            'Rate': 1.0,
+            'Position': dbus.Int64(5000000),
+            'Metadata': dbus.Dictionary({'xesam:title': 'First', 'xesam:artist': ['Artist'],
+                                         'mpris:length': dbus.Int64(200000000)}, signature='sv'),
+        }
+
+    @dbus.service.method(MediaPlayer.PROPERTIES_INTERFACE, in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface):
+        self.get_all_calls += 1
+        return self.properties
+
+    @dbus.service.signal(MediaPlayer.PROPERTIES_INTERFACE, signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        self.properties.update(changed)
+
+    @dbus.service.signal(MediaPlayer.PLAYER_INTERFACE, signature='x')
+    def Seeked(self, position):
+        pass
+
+
+@pytest.fixture
+def bus_address():
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'], stdout=subprocess.PIPE)
+    try:
+        yield daemon.stdout.readline().decode().strip()
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+def _connect(address: str) -> BusConnection:
+    return BusConnection(address, mainloop=DBusGMainLoop())
+
+
+def _wait_for(condition, timeout: float = 5.0):
+    """
+    Runs the main loop of the buses until condition is met.
+    """
+    context = GLib.MainContext.default()
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        if not context.iteration(False):
+            time.sleep(0.01)
+
+
+def test_fake_player(bus_address):
+    bus = _connect(bus_address)
+    name_changes = []
+
+    def count_name_owner_changed(_, message):
+        if message.is_signal('org.freedesktop.DBus', 'NameOwnerChanged'):
+            name_changes.append(str(message.get_args_list()[0]))
+        return HANDLER_RESULT_NOT_YET_HANDLED
+
+    bus.add_message_filter(count_name_owner_changed)
+    media_player = MediaPlayer(None, DataBus(), bus)
+    assert media_player.current_play_state.player_name is None
+
+    player_bus = _connect(bus_address)
+    player = _FakePlayer(player_bus)
+    # Clients that are not players don't wake the media player, as the bus daemon filters by arg0namespace.
+    other_name = dbus.service.BusName('org.example.Other', _connect(bus_address))
+    player_name = dbus.service.BusName(MediaPlayer.BUS_NAME_PREFIX + 'fake', player_bus)
+
+    # The state is read with one GetAll.
+    _wait_for(lambda: media_player.current_track is not None)
+    assert media_player.current_player_name == 'fake'
+    assert media_player.current_track.title == 'First'
+    assert media_player.current_track.duration == 200
+    assert not media_player.playing
+    assert media_player.current_position == 5
+    assert name_changes == [MediaPlayer.BUS_NAME_PREFIX + 'fake']
+    assert player.get_all_calls == 1
+
+    player.PropertiesChanged(MediaPlayer.PLAYER_INTERFACE, {
+        'PlaybackStatus': 'Playing',
+        'Metadata': dbus.Dictionary({'xesam:title': 'Second', 'mpris:length': dbus.Int64(100000000)},
+                                    signature='sv')}, [])
+    _wait_for(lambda: media_player.playing)
+    assert media_player.current_track.title == 'Second'
+    assert media_player.current_position < 1
+
+    player.Seeked(dbus.Int64(30000000))
+    _wait_for(lambda: media_player.current_position >= 30)
+    assert media_player.current_position < 31
+    assert player.get_all_calls == 1
+
+    # Releasing the name removes the player.
+    del player_name
+    _wait_for(lambda: media_player.current_player_name is None)
+    assert name_changes == [MediaPlayer.BUS_NAME_PREFIX + 'fake'] * 2
+    assert other_name.get_name() not in name_changes
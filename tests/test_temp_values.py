@@ -0,0 +1,53 @@
+from datetime import timedelta
+from queue import Queue
+
+import pytest
+
+from clear19.data.download_manager import DownloadManager
+from clear19.data.temp_values import TempValues
+
+
+def test_malformed_periods_are_skipped():
+    data = TempValues.parse_json(b'{"location": "Garden", "periods": ['
+                                 b'{"start": "2026-10-19T15:00:00", "temp": 11},'
+                                 b'{"start": ["2026-10-19T16:00:00"]},'
+                                 b'{"start": 1e300},'
+                                 b'{"start": "2026-10-19T17:00:00", "humidity": {}},'
+                                 b'{"start": "2026-10-19T14:00:00", "temp": 12.5}]}')
+    assert data.location == 'Garden'
+    assert [wp.temp for wp in data.periods] == [12.5, 11]
+
+
+def test_load_weather_through_download_manager(tmp_path, stand_in_server):
+    stand_in_server.resources['/values.json'] = \
+        b'{"location": "Garden", "periods": [{"start": "2026-10-19T14:00:00", "temp": 12.5}]}'
+    download_manager = DownloadManager(tmp_path, workers=1)
+    received = Queue()
+    try:
+        temp_values = TempValues(stand_in_server.url('/values.json'), download_manager, timedelta(0))
+        assert temp_values.load_weather(received.put) is None
+        data = received.get(timeout=5)
+        assert data.location == 'Garden'
+        assert [wp.temp for wp in data.periods] == [12.5]
+
+        # The outdated document is used at once and revalidated. It didn't change, so it isn't parsed again.
+        assert temp_values.load_weather(received.put) is data
+        assert received.get(timeout=5) is data
+        assert stand_in_server.requests == [('/values.json', 200), ('/values.json', 304)]
+
+        stand_in_server.resources['/values.json'] = \
+            b'{"location": "Garden", "periods": [{"start": "2026-10-19T14:00:00", "temp": 13}]}'
+        assert temp_values.load_weather(received.put) is data
+        assert [wp.temp for wp in received.get(timeout=5).periods] == [13]
+        assert stand_in_server.requests[-1] == ('/values.json', 200)
+    finally:
+        download_manager.stop()
+
+
+def test_periods_are_only_decoded_from_the_periods_list():
+    data = TempValues.parse_json(b'{"location": "Garden", "start": "2026-10-19T00:00:00",'
+                                 b'"sensor": {"start": "yesterday"}, "periods": ['
+                                 b'{"start": "2026-10-19T14:00:00", "temp": 12.5, "source": {"start": 0}}]}')
+    assert [wp.temp for wp in data.periods] == [12.5]
+    with pytest.raises(ValueError):
+        TempValues.parse_json(b'{"start": "2026-10-19T14:00:00"}')
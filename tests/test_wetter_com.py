@@ -0,0 +1,73 @@
+"""
+Tests of the wetter.com extractor. Every fixtures/wetter_com_*.html is parsed by both implementations and benchmarked.
+wetter_com_forecast.html and wetter_com_comments.html are written by hand in the layout of the page, recorded pages
+can be added with:
+curl -o tests/fixtures/wetter_com_<name>.html https://www.wetter.com/deutschland/<location id>.html
+"""
+import timeit
+import tracemalloc
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup
+
+from clear19.data.wetter_com import WetterCom, _WetterComExtractor, _DIAGRAM_ID
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+PAGES = sorted(path.name for path in FIXTURES.glob('wetter_com_*.html'))
+
+
+def _shape(node):
+    """
+    :return: Name, text and children of a bs4 or extractor node, to compare the trees position by position.
+    """
+    if node.name is None:
+        return None, str(node), node.text
+    return node.name, node.text, [_shape(child) for child in node.contents]
+
+
+@pytest.mark.parametrize('fixture', PAGES)
+def test_parse_html_equals_soup(fixture):
+    html = (FIXTURES / fixture).read_bytes()
+    reference = WetterCom.parse_html_soup(html)
+    data = WetterCom.parse_html(html)
+    assert len(data.series) == 24
+    assert data.location == reference.location
+    assert data.periods == reference.periods
+
+
+def test_comments_keep_positions():
+    html = (f'<html><body><h2 class="delta text--white mb--">Ber<!-- x -->lin</h2>\n'
+            f'<table><tbody id="{_DIAGRAM_ID}"><!-- before -->\n'
+            f'<tr><td>1<!-- split -->2</td><!-- between --><td><span></span><!-- a --><!-- b -->N</td></tr>\n'
+            f'<!-- after --></tbody></table></body></html>')
+    extractor = _WetterComExtractor.extract(html)
+    diagram = BeautifulSoup(html, 'html.parser').select(f'#{_DIAGRAM_ID}')[0]
+    assert extractor.location == 'Berlin'
+    assert _shape(extractor.diagram) == _shape(diagram)
+
+
+def _peak_memory(parse, html: bytes) -> int:
+    tracemalloc.start()
+    try:
+        parse(html)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# parse_html_soup calls the deprecated findAll.
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+@pytest.mark.parametrize('fixture', PAGES)
+def test_benchmark(fixture):
+    """
+    Compares the speed and the peak memory of the extractor and the BeautifulSoup implementation.
+    """
+    html = (FIXTURES / fixture).read_bytes()
+    results = {}
+    for parse in (WetterCom.parse_html, WetterCom.parse_html_soup):
+        seconds = min(timeit.repeat(lambda: parse(html), number=10, repeat=3)) / 10
+        results[parse.__name__] = seconds, _peak_memory(parse, html)
+        print(f'{fixture}: {parse.__name__} takes {seconds * 1000:.1f} ms and {results[parse.__name__][1]} bytes.')
+    assert results['parse_html'][0] < results['parse_html_soup'][0]
+    assert results['parse_html'][1] < results['parse_html_soup'][1]